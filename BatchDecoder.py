@@ -0,0 +1,363 @@
+import math
+
+import numpy as np
+
+from XbusPacket import XbusPacket
+from DataPacketParser import DataPacketParser, XsDataPacket
+from Metrics import Metrics
+
+
+# decode_file reads this much at a time. A chunk takes about 5 times its size while it's decoded:
+# the chunk and its copy with the carried over tail, the frame bytes and the decoded columns.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+_fp1632 = np.dtype([('frac', '>i4'), ('int', '>i2')])
+_utc = np.dtype([('ns', '>u4'), ('year', '>u2'), ('month', 'u1'), ('day', 'u1'),
+                 ('hour', 'u1'), ('minute', 'u1'), ('second', 'u1'), ('flags', 'u1')])
+
+# MTData2 data id -> (column name, big-endian dtype of the item data)
+ITEM_DTYPES = {
+    0x1020: ('packetCounter', np.dtype('>u2')),
+    0x1060: ('sampleTimeFine', np.dtype('>u4')),
+    0x1010: ('utcTime', _utc),
+    0x2030: ('euler', np.dtype(('>f4', (3,)))),
+    0x2010: ('quat', np.dtype(('>f4', (4,)))),
+    0x4020: ('acc', np.dtype(('>f4', (3,)))),
+    0x4030: ('freeAcc', np.dtype(('>f4', (3,)))),
+    0x8020: ('rot', np.dtype(('>f4', (3,)))),
+    0xC020: ('mag', np.dtype(('>f4', (3,)))),
+    0x5042: ('latlon', np.dtype((_fp1632, (2,)))),
+    0x5022: ('altitude', _fp1632),
+    0xE020: ('statusWord', np.dtype('>u4')),
+    0xD012: ('vel', np.dtype((_fp1632, (3,)))),
+    0x0810: ('temperature', np.dtype('>f4')),
+    0x3010: ('baropressure', np.dtype('>u4')),
+    0x4010: ('deltaV', np.dtype(('>f4', (3,)))),
+    0x8030: ('deltaQ', np.dtype(('>f4', (4,)))),
+}
+
+
+def layout_from_frame(frame, offset=0):
+    # Item order and sizes ((data_id, data_len), ...) of one MTData2 frame
+    pos, data_end = XbusPacket.payload_bounds(frame, offset)
+    layout = []
+    while pos + 3 <= data_end:
+        data_id = (frame[pos] << 8) | frame[pos + 1]
+        data_len = frame[pos + 2]
+        layout.append((data_id, data_len))
+        pos += 3 + data_len
+    return tuple(layout)
+
+
+def _output_conf_items(conf):
+    # ((data_id, rate), ...) of a SetOutputConfiguration message, rate None for every packet
+    if isinstance(conf, str):
+        conf = bytes.fromhex(conf)
+    items = []
+    for pos in range(4, 4 + conf[3], 4):
+        data_id = (conf[pos] << 8) | conf[pos + 1]
+        rate = (conf[pos + 2] << 8) | conf[pos + 3]
+        items.append((data_id, None if rate >= 0xFFFE else rate))
+    return items
+
+
+def _item_size(data_id):
+    if data_id not in ITEM_DTYPES:
+        raise ValueError(f"Size of data id 0x{data_id:04X} is unknown, use layout_from_frame instead.")
+    return ITEM_DTYPES[data_id][1].itemsize
+
+
+def layout_from_output_conf(conf):
+    # Item order and sizes of the packets produced by a SetOutputConfiguration message,
+    # conf is the message as sent by set_output_conf (bytes or hex string, checksum optional)
+    return tuple((data_id, _item_size(data_id)) for data_id, _ in _output_conf_items(conf))
+
+
+def layouts_from_output_conf(conf):
+    # Every layout the configuration produces: items with a lower rate than the fastest one are only in
+    # every n-th packet, e.g. option5 sends mag in one packet out of four. The full layout comes first.
+    items = _output_conf_items(conf)
+    fastest = max([rate for _, rate in items if rate] or [1])
+    every = [1 if not rate else max(1, fastest // rate) for _, rate in items]
+    period = 1
+    for n in set(every):
+        period = period * n // math.gcd(period, n)
+    layouts = []
+    for i in range(min(period, 10000)):
+        layout = tuple((data_id, _item_size(data_id)) for (data_id, _), n in zip(items, every) if i % n == 0)
+        if layout not in layouts:
+            layouts.append(layout)
+    return layouts
+
+
+def fp1632_to_double(values):
+    # Vectorized DataPacketParser.get_data_fp1632 over an array of the _fp1632 dtype
+    fp_i64 = (values['int'].astype(np.int64) << 32) | (values['frac'].astype(np.int64) & 0xffffffff)
+    return fp_i64 / 4294967296.0
+
+
+def utc_to_epoch(values):
+    # Vectorized calendar.timegm + nanoseconds over an array of the _utc dtype
+    months = (values['year'].astype(np.int64) - 1970) * 12 + values['month'] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + values['day'] - 1
+    seconds = days * 86400 + values['hour'].astype(np.int64) * 3600 + values['minute'].astype(np.int64) * 60 + values['second']
+    return seconds + values['ns'] * 1e-9
+
+
+def quat_to_euler(quat):
+    # Vectorized XsDataPacket.convert_quat_to_euler, (n, 4) quaternions to (n, 3) roll, pitch, yaw in degrees
+    q0, q1, q2, q3 = np.asarray(quat, dtype=np.float64).T
+    sqw = q0 * q0
+    dphi = 2.0 * (sqw + q3 * q3) - 1.0
+    dpsi = 2.0 * (sqw + q1 * q1) - 1.0
+    euler = np.empty((len(sqw), 3))
+    euler[:, 0] = np.arctan2(2.0 * (q2 * q3 + q0 * q1), dphi)
+    euler[:, 1] = -np.arcsin(np.clip(2.0 * (q1 * q3 - q0 * q2), -1.0, 1.0))
+    euler[:, 2] = np.arctan2(2.0 * (q1 * q2 + q0 * q3), dpsi)
+    euler *= XsDataPacket.rad2deg
+    return euler
+
+
+def _frames(raw, starts, frame_length):
+    # (n, frame_length) uint8 matrix of the frames at starts: a view when they are back to back,
+    # otherwise one copy of the frame bytes (no index matrix)
+    if len(starts) and starts[-1] - starts[0] == (len(starts) - 1) * frame_length and (np.diff(starts) == frame_length).all():
+        return raw[starts[0]:starts[0] + len(starts) * frame_length].reshape(-1, frame_length)
+    return np.lib.stride_tricks.sliding_window_view(raw, frame_length)[starts]
+
+
+def _frame_lengths(raw, starts):
+    # Payload and frame lengths of the frames at starts (FA FF 36 LEN, or LEN FF and a 2 byte extended length),
+    # -1 for an extended length that isn't in raw any more
+    payload_lengths = raw[starts + 3].astype(np.intp)
+    header_lengths = np.full(len(starts), 4, dtype=np.intp)
+    extended = np.flatnonzero(payload_lengths == XbusPacket.EXTENDED_LENGTH)
+    if len(extended):
+        positions = starts[extended]
+        inside = positions + 6 <= len(raw)
+        positions = np.where(inside, positions, 0)
+        payload_lengths[extended] = np.where(inside, (raw[positions + 4].astype(np.intp) << 8) | raw[positions + 5], -1)
+        header_lengths[extended] = 6
+    return payload_lengths, payload_lengths + header_lengths + 1
+
+
+class _FrameLayout:
+    # numpy record dtype and header check of the MTData2 frames with one item layout, layouts of 255
+    # payload bytes and more use the extended length header (FA FF 36 FF hi lo) like on the device
+    def __init__(self, layout):
+        self.layout = tuple(layout)
+        self.payload_length = sum(3 + data_len for _, data_len in self.layout)
+        if self.payload_length > XbusPacket.MAX_PAYLOAD_LENGTH:
+            raise ValueError("Layout does not fit in an MTData2 frame.")
+        header_length = 4 if self.payload_length < XbusPacket.EXTENDED_LENGTH else 6
+        self.frame_length = header_length + self.payload_length + 1
+
+        fields = [('header', 'u1', (header_length,))]
+        header_columns = []
+        header_values = []
+        pos = header_length
+        self.columns = []
+        for data_id, data_len in self.layout:
+            name, dtype = ITEM_DTYPES.get(data_id, (None, None))
+            if dtype is None or dtype.itemsize != data_len:
+                name, dtype = f'data_{data_id:04X}', np.dtype(('u1', (data_len,)))
+            fields.append((f'_item{pos}', 'u1', (3,)))
+            fields.append((name, dtype))
+            header_columns += [pos, pos + 1, pos + 2]
+            header_values += [data_id >> 8, data_id & 0xFF, data_len]
+            self.columns.append((data_id, name))
+            pos += 3 + data_len
+        fields.append(('checksum', 'u1'))
+        self.frame_dtype = np.dtype(fields)
+        self.header_columns = np.array(header_columns, dtype=np.intp)
+        self.header_values = np.array(header_values, dtype=np.uint8)
+
+    def valid(self, raw, starts):
+        # Which of the frames at starts pass the checksum and have this layout's item headers
+        frames = _frames(raw, starts, self.frame_length)
+        valid = (frames[:, 1:].sum(axis=1, dtype=np.uint32) & 0xFF) == 0
+        valid &= (frames[:, self.header_columns] == self.header_values).all(axis=1)
+        return valid
+
+
+class BatchDecoder:
+    # Decodes whole recordings of MTData2 packets in a few numpy passes. Layouts are kept per frame
+    # length like in LayoutParser: one output configuration gives a few (items with a lower output
+    # rate are only in some packets), see layouts_from_output_conf.
+    # Frames with another layout (or any other message) are decoded one by one with
+    # XbusPacket + DataPacketParser and returned separately. Their checksum failures, unknown data ids
+    # and parse errors are counted in metrics (a new Metrics.Metrics by default) instead of printed.
+    def __init__(self, layout=None, layouts=(), metrics=None):
+        self.metrics = Metrics() if metrics is None else metrics
+        self.layouts = {}
+        for layout in ([layout] if layout is not None else []) + list(layouts):
+            self.add_layout(layout)
+
+    @classmethod
+    def from_output_conf(cls, conf, metrics=None):
+        return cls(layouts=layouts_from_output_conf(conf), metrics=metrics)
+
+    def add_layout(self, layout):
+        # layout is ((data_id, data_len), ...), see layout_from_frame
+        frame_layout = _FrameLayout(layout)
+        self.layouts[frame_layout.frame_length] = frame_layout
+
+    @property
+    def max_frame_length(self):
+        return max(self.layouts, default=0)
+
+    def find_frames(self, data):
+        # Offsets of all checksum-valid, non overlapping frames with one of the layouts
+        raw = np.frombuffer(data, dtype=np.uint8)
+        last = len(raw) - 4
+        if last < 0 or not self.layouts:
+            return np.empty(0, dtype=np.intp)
+
+        # One pass over the bytes for FA, the rest of the preamble is only checked at those positions
+        starts = np.flatnonzero(raw[:last + 1] == XbusPacket.PREAMBLE[0])
+        starts = starts[(raw[starts + 1] == XbusPacket.PREAMBLE[1]) & (raw[starts + 2] == XbusPacket.PREAMBLE[2])]
+        payload_lengths, frame_lengths = _frame_lengths(raw, starts)
+
+        valid = np.zeros(len(starts), dtype=bool)
+        for frame_layout in self.layouts.values():
+            rows = np.flatnonzero((payload_lengths == frame_layout.payload_length) & (frame_lengths == frame_layout.frame_length) &
+                                  (starts <= len(raw) - frame_layout.frame_length))
+            if len(rows):
+                valid[rows] = frame_layout.valid(raw, starts[rows])
+        starts = starts[valid]
+
+        # A false preamble inside a valid frame that happens to pass both checks is very unlikely,
+        # drop it anyway so every byte belongs to at most one frame
+        ends = starts + frame_lengths[valid]
+        if len(starts) > 1 and (starts[1:] < ends[:-1]).any():
+            keep = []
+            end = 0
+            for start, frame_end in zip(starts.tolist(), ends.tolist()):
+                if start >= end:
+                    keep.append(start)
+                    end = frame_end
+            starts = np.array(keep, dtype=np.intp)
+        return starts
+
+    def decode_columns(self, data, starts):
+        # Columnar arrays for the frames at starts, converted to native types. Items missing from a
+        # frame's layout are NaN (or 0 for integers), present has the XsDataPacket.present bits per row.
+        from columnar_logging import COLUMNS
+        raw = np.frombuffer(data, dtype=np.uint8)
+        count = len(starts)
+        frame_lengths = _frame_lengths(raw, starts)[1]
+        present = np.zeros(count, dtype=np.uint32)
+        columns = {}
+        for frame_layout in self.layouts.values():
+            rows = np.flatnonzero(frame_lengths == frame_layout.frame_length)
+            if not len(rows):
+                continue
+            records = _frames(raw, starts[rows], frame_layout.frame_length).view(frame_layout.frame_dtype).reshape(-1)
+            for data_id, name in frame_layout.columns:
+                values = records[name]
+                if values.dtype == _fp1632 or values.dtype.base == _fp1632:
+                    values = fp1632_to_double(values)
+                elif values.dtype == _utc:
+                    values = utc_to_epoch(values)
+                else:
+                    values = values.astype(values.dtype.base.newbyteorder('='))
+                if name not in columns:
+                    if len(rows) == count:
+                        columns[name] = values
+                    else:
+                        columns[name] = np.full((count,) + values.shape[1:], np.nan if values.dtype.kind == 'f' else 0, dtype=values.dtype)
+                if len(rows) != count:
+                    columns[name][rows] = values
+                if data_id in COLUMNS:
+                    present[rows] |= COLUMNS[data_id][3]
+        if 'quat' in columns:
+            # Like the per-packet parser, which fills euler from the quaternion
+            derive = (present & XsDataPacket.QUATERNION != 0) & (present & XsDataPacket.EULER == 0)
+            if derive.all():
+                columns['euler'] = quat_to_euler(columns['quat'])
+            elif derive.any():
+                euler = columns.setdefault('euler', np.full((count, 3), np.nan))
+                euler[derive] = quat_to_euler(columns['quat'][derive])
+            present[derive] |= XsDataPacket.EULER
+        columns['present'] = present
+        return columns
+
+    def decode(self, data):
+        # Returns (columns, fallback): columns is a dict of arrays for the frames matching a layout,
+        # fallback a list of (row, XsDataPacket) for the other MTData2 frames, where row is the number of
+        # layout frames that came before it.
+        columns, fallback, _ = self._decode_chunk(data, self._framer(), 0, final=True)
+        return columns, fallback
+
+    def decode_file(self, path, chunk_size=CHUNK_SIZE):
+        # Same as decode() for a capture file, read in chunks so memory stays bounded
+        fallback = []
+        parts = []
+        framer = self._framer()
+        rows = 0
+        carry = b''
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                data = carry + chunk
+                columns, chunk_fallback, carry_start = self._decode_chunk(data, framer, rows, final=not chunk)
+                if columns:
+                    parts.append(columns)
+                    rows += len(columns['present'])
+                fallback += chunk_fallback
+                if not chunk:
+                    break
+                carry = data[carry_start:]
+
+        if not parts:
+            return {}, fallback
+        return _concatenate_columns(parts), fallback
+
+    def _framer(self):
+        # Framer of the per-packet path, its checksum failures go to the decoder's metrics
+        framer = XbusPacket()
+        framer.metrics = self.metrics
+        return framer
+
+    def _decode_chunk(self, data, framer, rows, final):
+        starts = self.find_frames(data)
+        columns = self.decode_columns(data, starts) if len(starts) else {}
+
+        fallback = []
+
+        def on_frame(frame):
+            xbus_data = XsDataPacket()
+            DataPacketParser.parse_data_packet(frame, xbus_data, metrics=self.metrics)
+            fallback.append((row, xbus_data))
+
+        framer.on_data_available = on_frame
+        # Everything between the layout frames goes through the per-packet path
+        raw = np.frombuffer(data, dtype=np.uint8)
+        ends = (starts + _frame_lengths(raw, starts)[1]).tolist()
+        end = 0
+        for row, (start, frame_end) in enumerate(zip(starts.tolist(), ends), rows):
+            if start > end:
+                framer.feed_bytes(data[end:start])
+            end = frame_end
+        row = rows + len(starts)
+
+        # The tail may hold the beginning of a layout frame, keep it for the next chunk
+        carry_start = len(data) if final else max(end, len(data) - self.max_frame_length + 1)
+        if carry_start > end:
+            framer.feed_bytes(data[end:carry_start])
+        return columns, fallback, carry_start
+
+
+def _concatenate_columns(parts):
+    # Chunks may not all have every column, missing ones are filled like in decode_columns
+    names = []
+    for part in parts:
+        names += [name for name in part if name not in names]
+    columns = {}
+    for name in names:
+        template = next(part[name] for part in parts if name in part)
+        fill = np.nan if template.dtype.kind == 'f' else 0
+        columns[name] = np.concatenate([part[name] if name in part else
+                                        np.full((len(part['present']),) + template.shape[1:], fill, dtype=template.dtype)
+                                        for part in parts])
+    return columns
@@ -0,0 +1,398 @@
+import calendar
+import mmap
+import os
+import time
+from struct import Struct, error as StructError
+
+import numpy as np
+
+from XbusPacket import XbusPacket
+
+
+# A capture is the raw Xbus byte stream exactly as read from the serial port (so it can also be
+# decoded with BatchDecoder.decode_file), plus a sidecar <capture>.idx with one record per MTData2 frame.
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),          # frame position in the capture file
+    ('length', '<u2'),          # frame length including header and checksum
+    ('packetCounter', '<u2'),
+    ('sampleTimeFine', '<u4'),
+    ('hostTime', '<f8'),        # time.time() when the frame was received, NaN if unknown
+])
+_index_record = Struct('<QHHId')
+_item_header = Struct('>HB')
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+def _frame_times(frame, missing=0):
+    # packetCounter and sampleTimeFine of a frame without a full parse, missing when not present
+    packet_counter = missing
+    sample_time_fine = missing
+    pos, data_end = XbusPacket.payload_bounds(frame)
+    while pos + 3 <= data_end:
+        data_id, data_len = _item_header.unpack_from(frame, pos)
+        if data_id == 0x1020:
+            packet_counter = (frame[pos + 3] << 8) | frame[pos + 4]
+        elif data_id == 0x1060:
+            sample_time_fine = int.from_bytes(frame[pos + 3:pos + 7], 'big')
+        pos += 3 + data_len
+    return packet_counter, sample_time_fine
+
+
+class FrameIndexer:
+    # Frames a byte stream and appends one index record per MTData2 frame to index_file
+    def __init__(self, index_file, stream_offset=0):
+        self.index_file = index_file
+        self.framer = XbusPacket(on_data_available=self._on_frame)
+        self.framer.stream_offset = stream_offset
+        self.host_time = float('nan')
+
+    def feed_bytes(self, data, host_time=float('nan')):
+        self.host_time = host_time
+        self.framer.feed_bytes(data)
+
+    def _on_frame(self, frame):
+        packet_counter, sample_time_fine = _frame_times(frame)
+        self.index_file.write(_index_record.pack(self.framer.frame_offset, len(frame),
+                                                 packet_counter, sample_time_fine, self.host_time))
+
+
+class CaptureWriter:
+    # Appends raw serial data to a capture file and indexes the frames in it, call write() with
+    # every chunk returned by SerialHandler.read_bytes()
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.index_file = open(index_path(path), 'ab')
+        # Continue the stream offsets when appending to an existing capture
+        self.indexer = FrameIndexer(self.index_file, self.file.tell())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data, host_time=None):
+        self.file.write(data)
+        self.indexer.feed_bytes(data, time.time() if host_time is None else host_time)
+
+    def flush(self):
+        self.file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        self.index_file.close()
+
+
+def build_index(path):
+    # Recreate the sidecar index of a capture (or any raw Xbus recording), host times are unknown
+    with open(index_path(path), 'wb') as index_file, open(path, 'rb') as f:
+        indexer = FrameIndexer(index_file)
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            indexer.feed_bytes(chunk)
+
+
+class CaptureReader:
+    # Memory maps a capture and its index, frames are looked up in the index so only the
+    # pages of the requested range are touched
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(index_path(path)):
+            build_index(path)
+        self.file = open(path, 'rb')
+        size = os.path.getsize(path)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if os.path.getsize(index_path(path)):
+            self.index = np.memmap(index_path(path), dtype=INDEX_DTYPE, mode='r')
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.index = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def select(self, start=None, end=None, field='hostTime'):
+        # Index range [first, last) of the frames with start <= field < end, the field must be
+        # increasing over the capture (hostTime always is, sampleTimeFine until it wraps)
+        values = self.index[field]
+        first = 0 if start is None else int(np.searchsorted(values, start, side='left'))
+        last = len(values) if end is None else int(np.searchsorted(values, end, side='left'))
+        return first, last
+
+    def frame(self, i):
+        record = self.index[i]
+        offset = int(record['offset'])
+        return memoryview(self.data)[offset:offset + int(record['length'])]
+
+    def frames(self, start=None, end=None, field='hostTime'):
+        # Yields (index record, frame memoryview) for the selected range
+        first, last = self.select(start, end, field)
+        view = memoryview(self.data)
+        for i in range(first, last):
+            record = self.index[i]
+            offset = int(record['offset'])
+            yield record, view[offset:offset + int(record['length'])]
+
+    def replay(self, packet, speed=1.0, start=None, end=None, field='hostTime'):
+        # Feeds the recorded bytes into an XbusPacket framer. speed=1.0 is real time, 2.0 twice as
+        # fast, None as fast as possible. Bytes between frames (noise, other messages) are replayed too.
+        first, last = self.select(start, end, field)
+        if first >= last:
+            return
+        view = memoryview(self.data)
+        pos = int(self.index[first]['offset'])
+        host_start = float(self.index[first]['hostTime'])
+        wall_start = time.monotonic()
+        for i in range(first, last):
+            record = self.index[i]
+            if speed is not None:
+                host_time = float(record['hostTime'])
+                if host_time == host_time:  # skip NaN host times
+                    delay = (host_time - host_start) / speed - (time.monotonic() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+            end_offset = int(record['offset']) + int(record['length'])
+            packet.feed_bytes(view[pos:end_offset])
+            pos = end_offset
+
+
+# Sparse index <recording>.sidx: the position and times of every every-th MTData2 frame, so a window of
+# a long recording is found with a search over a few thousand records and only its pages are read
+# packetCounter and sampleTimeFine are unwrapped, they count on past 0xFFFF and 0xFFFFFFFF.
+SPARSE_INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),          # frame position in the recording
+    ('frame', '<u8'),           # number of the frame, counting MTData2 frames from 0
+    ('packetCounter', '<i8'),   # -1 when the frame has no packetCounter
+    ('sampleTimeFine', '<i8'),  # -1 when the frame has no sampleTimeFine
+    ('utcTime', '<f8'),         # NaN when the frame has no UTC time
+])
+# magic, every, number of MTData2 frames, bytes of the recording that were indexed
+_sparse_header = Struct('<4sIQQ')
+_SPARSE_MAGIC = b'XSI2'
+# Period of the counters that wrap
+_WRAP = {'packetCounter': 1 << 16, 'sampleTimeFine': 1 << 32}
+_utc_item = Struct('>IHBBBBBB')
+_FIELD_IDS = {'utcTime': 0x1010, 'sampleTimeFine': 0x1060, 'packetCounter': 0x1020}
+
+
+def sparse_index_path(path):
+    return path + '.sidx'
+
+
+def _unwrap(value, last, period):
+    # value of a counter that wraps at period, continued from the unwrapped value last (None at the start)
+    if value < 0 or last is None:
+        return value
+    return last + (value - last) % period
+
+
+def _frame_utc(frame):
+    # utcTime of a frame as seconds since the epoch, NaN when not present
+    pos, data_end = XbusPacket.payload_bounds(frame)
+    while pos + 3 <= data_end:
+        data_id, data_len = _item_header.unpack_from(frame, pos)
+        if data_id == 0x1010 and data_len >= _utc_item.size:
+            nano, year, month, day, hour, minute, second, _ = _utc_item.unpack_from(frame, pos + 3)
+            try:
+                return calendar.timegm((year, month, day, hour, minute, second)) + nano * 1e-9
+            except ValueError:
+                return float('nan')
+        pos += 3 + data_len
+    return float('nan')
+
+
+class SessionReader:
+    # Random access to windows of a long recording (a capture or any raw Xbus recording) through a
+    # memory map and a sparse index of every every-th frame, persisted next to the recording.
+    # Reopening loads the index, and when the recording has grown only the new part is scanned.
+    # A window is selected by utcTime, sampleTimeFine, packetCounter or frame number, and returned as
+    # XsDataPackets or as numpy records (see SharedRing.record_dtype). packetCounter and sampleTimeFine
+    # windows count on across their wrap: after the first wrap packetCounter 5 is 65536 + 5.
+    # Frames are assumed to lose less than a whole counter period between two index records.
+    def __init__(self, path, every=1000):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.every = every
+        self.frame_count = 0
+        self.index = np.zeros(0, dtype=SPARSE_INDEX_DTYPE)
+        self._load_index()
+        if self.indexed < self.size:
+            self._extend_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.frame_count
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def _load_index(self):
+        self.indexed = 0
+        try:
+            with open(sparse_index_path(self.path), 'rb') as f:
+                header = f.read(_sparse_header.size)
+                magic, every, frame_count, indexed = _sparse_header.unpack(header)
+                index = np.frombuffer(f.read(), dtype=SPARSE_INDEX_DTYPE)
+        except (OSError, ValueError, StructError):
+            return
+        if magic != _SPARSE_MAGIC or every != self.every or indexed > self.size:
+            # Another spacing, or not the recording the index was made for
+            return
+        self.index = index.copy()
+        self.frame_count = frame_count
+        self.indexed = indexed
+
+    def _extend_index(self):
+        # Scans from the last indexed frame, its record is made again
+        if len(self.index):
+            start = int(self.index[-1]['offset'])
+            self.frame_count = int(self.index[-1]['frame'])
+            self.index = self.index[:-1]
+        else:
+            start = 0
+            self.frame_count = 0
+        records = []
+        # Counters continue from the last indexed frames that have them
+        last = {}
+        for field in _WRAP:
+            known = self.index[field][self.index[field] >= 0]
+            last[field] = int(known[-1]) if len(known) else None
+
+        def on_frame(frame):
+            if self.frame_count % self.every == 0:
+                times = _frame_times(frame, missing=-1)
+                for field, value in zip(_WRAP, times):
+                    value = _unwrap(value, last[field], _WRAP[field])
+                    if value >= 0:
+                        last[field] = value
+                records.append((framer.frame_offset, self.frame_count, *[last[field] if value >= 0 else -1
+                                for field, value in zip(_WRAP, times)], _frame_utc(frame)))
+            self.frame_count += 1
+
+        framer = XbusPacket(on_data_available=on_frame)
+        framer.stream_offset = start
+        view = memoryview(self.data)
+        for pos in range(start, self.size, 4 * 1024 * 1024):
+            framer.feed_bytes(view[pos:pos + 4 * 1024 * 1024])
+        view.release()
+
+        self.index = np.concatenate((self.index, np.array(records, dtype=SPARSE_INDEX_DTYPE)))
+        self.indexed = self.size
+        try:
+            with open(sparse_index_path(self.path), 'wb') as f:
+                f.write(_sparse_header.pack(_SPARSE_MAGIC, self.every, self.frame_count, self.indexed))
+                f.write(self.index.tobytes())
+        except OSError as e:
+            print(f"Could not write the sparse index of {self.path}: {e}")
+
+    def select(self, start=None, end=None, field='utcTime'):
+        # Byte range [begin, end) and number of its first frame that holds all frames with
+        # start <= field < end, found from the index records around the window
+        return self._select(start, end, field)[:3]
+
+    def _select(self, start, end, field):
+        # select() plus the unwrapped counter of the first frame, None when the range starts at 0
+        records = self.index
+        if field == 'utcTime':
+            records = records[~np.isnan(records['utcTime'])]
+        elif field in _WRAP:
+            # Records of frames without the counter would break the ordering searchsorted needs
+            records = records[records[field] >= 0]
+        values = records[field]
+        begin, begin_frame, begin_value, stop = 0, 0, None, self.size
+        if start is not None:
+            i = int(np.searchsorted(values, start, side='right')) - 1
+            if i >= 0:
+                begin, begin_frame = int(records[i]['offset']), int(records[i]['frame'])
+                if field in _WRAP:
+                    begin_value = int(values[i])
+        if end is not None:
+            i = int(np.searchsorted(values, end, side='left'))
+            if i < len(records):
+                stop = int(records[i]['offset'])
+        return begin, max(begin, stop), begin_frame, begin_value
+
+    def packets(self, start=None, end=None, field='utcTime', data_ids=None):
+        # XsDataPackets of the frames with start <= field < end. Frames without the field (items at a
+        # lower rate) belong to the window when the last frame before them with the field does.
+        from DataPacketParser import XsDataPacket
+        from LayoutParser import LayoutParser
+        if data_ids is not None and field in _FIELD_IDS:
+            # The window field is always decoded
+            data_ids = set(data_ids) | {_FIELD_IDS[field]}
+        parser = LayoutParser(data_ids=data_ids)
+        begin, stop, frame_number, begin_value = self._select(start, end, field)
+        packets = []
+        inside = [start is None]
+        number = [frame_number]
+        # Unwrapped counter of the last frame, the first frame of the range continues from the index
+        last = [begin_value]
+
+        def on_frame(frame):
+            xbus_data = XsDataPacket()
+            parser.parse_data_packet(frame, xbus_data)
+            value = number[0] if field == 'frame' else _field_value(xbus_data, field)
+            if value is not None and field in _WRAP:
+                value = last[0] = _unwrap(value, last[0], _WRAP[field])
+            if value is not None:
+                inside[0] = (start is None or value >= start) and (end is None or value < end)
+            if inside[0]:
+                packets.append(xbus_data)
+            number[0] += 1
+
+        framer = XbusPacket(on_data_available=on_frame)
+        view = memoryview(self.data)
+        framer.feed_bytes(view[begin:stop])
+        view.release()
+        return packets
+
+    def records(self, start=None, end=None, field='utcTime', data_ids=None):
+        # Same window as packets() as a numpy structured array with one field per column,
+        # missing values are NaN, see SharedRing.RecordPacker
+        from SharedRing import RecordPacker, normalize_data_ids
+        packer = RecordPacker(normalize_data_ids(data_ids))
+        packets = self.packets(start, end, field, data_ids)
+        buffer = bytearray(packer.size * len(packets))
+        for i, xbus_data in enumerate(packets):
+            packer.pack_into(buffer, i * packer.size, i + 1, xbus_data)
+        return np.frombuffer(buffer, dtype=packer.dtype)
+
+
+def _field_value(xbus_data, field):
+    # Value of a window field of a decoded packet, None when the packet doesn't have it
+    if field == 'utcTime':
+        return xbus_data.utcTime if xbus_data.utcTimeAvailable else None
+    if field == 'sampleTimeFine':
+        return xbus_data.sampleTimeFine if xbus_data.sampleTimeFineAvailable else None
+    if field == 'packetCounter':
+        return xbus_data.packetCounter if xbus_data.packetCounterAvailable else None
+    raise ValueError(f"Unknown window field {field}.")
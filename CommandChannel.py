@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+# Message ids, the device acknowledges a command with message id + 1
+GO_TO_CONFIG = 0x30
+GO_TO_MEASUREMENT = 0x10
+SET_OUTPUT_CONFIGURATION = 0xC0
+ERROR = 0x42
+
+
+class CommandError(Exception):
+    # The device answered a command with an Error message (0x42)
+    def __init__(self, mid, code):
+        super().__init__(f"Command 0x{mid:02X} failed with error code 0x{code:02X}.")
+        self.mid = mid
+        self.code = code
+
+
+def build_message(mid, data=b''):
+    # Complete Xbus message with preamble, bus id, (extended) length and checksum
+    length = len(data)
+    if length < 0xFF:
+        body = bytes((0xFF, mid, length)) + data
+    else:
+        body = bytes((0xFF, mid, 0xFF, length >> 8, length & 0xFF)) + data
+    return b'\xfa' + body + bytes(((-sum(body)) & 0xFF,))
+
+
+class CommandChannel:
+    # Sends commands to one device without blocking and matches the replies to them.
+    # send() returns a concurrent.futures.Future that gets the payload of the acknowledgement
+    # (message id + 1), a CommandError when the device replies with an Error message, or a
+    # TimeoutError. Replies are taken from the framer's message handlers, so the channel works
+    # next to streaming: with pump=False whoever reads the port (SerialPipeline, SensorHub, a read
+    # loop) feeds the framer, with pump=True wait() reads the port itself until the replies are in.
+    # Commands to several devices can be in flight at once, see wait_all().
+    def __init__(self, serial, framer, pump=True, timeout=1.0, on_bytes=None):
+        # on_bytes(data) gets the raw chunks read while pumping, e.g. CaptureWriter.write
+        self.serial = serial
+        self.framer = framer
+        self.pump = pump
+        self.on_bytes = on_bytes
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # (mid, ack mid, future, deadline) in the order the commands were sent
+        self.pending = deque()
+        self.round_trip = None
+        framer.set_mid_handler(ERROR, self._on_error)
+
+    def send(self, mid, data=b'', timeout=None):
+        future = Future()
+        future.channel = self
+        ack_mid = (mid + 1) & 0xFF
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self.lock:
+            self.framer.set_mid_handler(ack_mid, self._on_ack)
+            future.sent = time.perf_counter()
+            # Appended before writing so a fast reply always finds its command
+            self.pending.append((mid, ack_mid, future, deadline))
+            self.serial.serial_port.write(build_message(mid, data))
+        return future
+
+    def go_to_config(self, timeout=None):
+        return self.send(GO_TO_CONFIG, timeout=timeout)
+
+    def go_to_measurement(self, timeout=None):
+        return self.send(GO_TO_MEASUREMENT, timeout=timeout)
+
+    def set_output_configuration(self, configuration, timeout=None):
+        # configuration is a SetOutputConfiguration message as in SetOutput.py (bytes or hex string),
+        # only its data is used, the header and checksum are rebuilt
+        if isinstance(configuration, str):
+            configuration = bytes.fromhex(configuration)
+        return self.send(SET_OUTPUT_CONFIGURATION, configuration[4:4 + configuration[3]], timeout)
+
+    def call(self, mid, data=b'', timeout=None):
+        # Blocking send, returns the acknowledgement payload
+        return self.wait(self.send(mid, data, timeout))[0]
+
+    def wait(self, *futures):
+        return wait_all(futures)
+
+    def poll(self):
+        # Feeds whatever is waiting on the port to the framer without blocking, expires old commands
+        port = self.serial.serial_port
+        waiting = port.in_waiting
+        if waiting:
+            data = port.read(waiting)
+            if self.on_bytes is not None:
+                self.on_bytes(data)
+            self.framer.feed_bytes(data)
+        self.expire()
+        return waiting
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            expired = [entry for entry in self.pending if entry[3] <= now]
+            for entry in expired:
+                self.pending.remove(entry)
+        for mid, _, future, _ in expired:
+            future.set_exception(TimeoutError(f"No reply to command 0x{mid:02X}."))
+
+    def _take(self, ack_mid=None):
+        # Oldest pending command, or the oldest one waiting for ack_mid
+        with self.lock:
+            for i, entry in enumerate(self.pending):
+                if ack_mid is None or entry[1] == ack_mid:
+                    del self.pending[i]
+                    return entry
+        return None
+
+    def _on_ack(self, frame):
+        entry = self._take(frame[2])
+        if entry is not None:
+            future = entry[2]
+            self.round_trip = time.perf_counter() - future.sent
+            start, end = self.framer.payload_bounds(frame)
+            future.set_result(bytes(frame[start:end]))
+
+    def _on_error(self, frame):
+        # The error doesn't say which command failed, it's the oldest one still waiting
+        entry = self._take()
+        if entry is not None:
+            start, end = self.framer.payload_bounds(frame)
+            entry[2].set_exception(CommandError(entry[0], frame[start] if end > start else 0))
+
+
+def wait_all(futures, poll_interval=0.0005):
+    # Waits for the commands of any number of channels, pumping the ones with pump=True,
+    # returns the results in order and raises the first CommandError or TimeoutError
+    futures = list(futures)
+    channels = {id(future.channel): future.channel for future in futures}.values()
+    while not all(future.done() for future in futures):
+        received = 0
+        for channel in channels:
+            if channel.pump:
+                received += channel.poll()
+            else:
+                channel.expire()
+        if not received:
+            time.sleep(poll_interval)
+    return [future.result() for future in futures]
@@ -1,8 +1,12 @@
-from struct import unpack, unpack_from
+from struct import Struct, unpack_from
 from datetime import datetime, timezone
 import calendar
 import math
-import numpy as np
+
+from XbusPacket import XbusPacket
+
+
+_UTC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 class XsDataPacket:
@@ -10,58 +14,132 @@ class XsDataPacket:
     minusHalfPi = -1.5707963267948966192313216916397514420985846996875529104874
     halfPi = 1.5707963267948966192313216916397514420985846996875529104874
 
-    def __init__(self):
-        self.euler = [0.0, 0.0, 0.0]
-        self.eulerAvailable = False
+    # Bits of the present mask, the *Available attributes are views on these bits
+    EULER = 1 << 0
+    QUATERNION = 1 << 1
+    ACC = 1 << 2
+    FREE_ACC = 1 << 3
+    ROT = 1 << 4
+    LATLON = 1 << 5
+    ALTITUDE = 1 << 6
+    VELOCITY = 1 << 7
+    MAG = 1 << 8
+    PACKET_COUNTER = 1 << 9
+    SAMPLE_TIME_FINE = 1 << 10
+    UTC_TIME = 1 << 11
+    STATUS_WORD = 1 << 12
+    TEMPERATURE = 1 << 13
+    BAROPRESSURE = 1 << 14
+    DELTA_V = 1 << 15
+    DELTA_Q = 1 << 16
+
+    AVAILABLE_BITS = {
+        'eulerAvailable': EULER,
+        'quaternionAvailable': QUATERNION,
+        'accAvailable': ACC,
+        'freeAccAvailable': FREE_ACC,
+        'rotAvailable': ROT,
+        'latlonAvailable': LATLON,
+        'altitudeAvailable': ALTITUDE,
+        'velocityAvailable': VELOCITY,
+        'magAvailable': MAG,
+        'packetCounterAvailable': PACKET_COUNTER,
+        'sampleTimeFineAvailable': SAMPLE_TIME_FINE,
+        'utcTimeAvailable': UTC_TIME,
+        'statusWordAvailable': STATUS_WORD,
+        'temperatureAvailable': TEMPERATURE,
+        'baropressureAvailable': BAROPRESSURE,
+        'deltaVAvailable': DELTA_V,
+        'deltaQAvailable': DELTA_Q,
+    }
+
+    # euler, utcTime and utcTimeInfo are properties, derived from the quaternion and the raw UTC
+    # item on first access instead of for every parsed packet
+    __slots__ = ('_euler', 'quat', 'acc', 'freeAcc', 'rot', 'latlon', 'altitude', 'vel', 'mag',
+                 'packetCounter', 'sampleTimeFine', '_utcTime', '_utcTimeInfo', 'statusWord',
+                 'temperature', 'baropressure', 'deltaV', 'deltaQ', 'present',
+                 'euler_pending', 'utc_values')
 
+    def __init__(self):
+        self._euler = [0.0, 0.0, 0.0]
         self.quat = [0.0, 0.0, 0.0, 0.0]
-        self.quaternionAvailable = False
-
         self.acc = [0.0, 0.0, 0.0]
-        self.accAvailable = False
-
         self.freeAcc = [0.0, 0.0, 0.0]
-        self.freeAccAvailable = False
-
         self.rot = [0.0, 0.0, 0.0]
-        self.rotAvailable = False
-
         self.latlon = [0.0, 0.0]
-        self.latlonAvailable = False
-
-        self.altitude = 0.0
-        self.altitudeAvailable = False
-
         self.vel = [0.0, 0.0, 0.0]
-        self.velocityAvailable = False
-
         self.mag = [0.0, 0.0, 0.0]
-        self.magAvailable = False
-
+        self.deltaV = [0.0, 0.0, 0.0]
+        self.deltaQ = [0.0, 0.0, 0.0, 0.0]
+        self.reset()
+
+    def reset(self):
+        # Back to the state of a new packet, the lists are zeroed in place so a packet can be reused
+        self._euler[:] = (0.0, 0.0, 0.0)
+        self.quat[:] = (0.0, 0.0, 0.0, 0.0)
+        self.acc[:] = (0.0, 0.0, 0.0)
+        self.freeAcc[:] = (0.0, 0.0, 0.0)
+        self.rot[:] = (0.0, 0.0, 0.0)
+        self.latlon[:] = (0.0, 0.0)
+        self.vel[:] = (0.0, 0.0, 0.0)
+        self.mag[:] = (0.0, 0.0, 0.0)
+        self.deltaV[:] = (0.0, 0.0, 0.0)
+        self.deltaQ[:] = (0.0, 0.0, 0.0, 0.0)
+        self.altitude = 0.0
         self.packetCounter = 0
-        self.packetCounterAvailable = False
-
         self.sampleTimeFine = 0
-        self.sampleTimeFineAvailable = False
-
-        self.utcTime = 0.0
-        self.utcTimeInfo = datetime(1970, 1, 1, tzinfo=timezone.utc)
-        self.utcTimeAvailable = False
-
+        self._utcTime = 0.0
+        self._utcTimeInfo = _UTC_EPOCH
+        # True while euler still has to be computed from quat
+        self.euler_pending = False
+        # Raw (nanoseconds, year, month, day, hour, minute, second) until utcTime is read
+        self.utc_values = None
         self.statusWord = 0
-        self.statusWordAvailable = False
-        
         self.temperature = 0.0
-        self.temperatureAvailable = False
-        
         self.baropressure = 0
-        self.baropressureAvailable = False
-        
-        self.deltaV = [0.0, 0.0, 0.0]
-        self.deltaVAvailable = False
-        
-        self.deltaQ = [0.0, 0.0, 0.0, 0.0]
-        self.deltaQAvailable = False
+        self.present = 0
+
+    @property
+    def euler(self):
+        if self.euler_pending:
+            self.convert_quat_to_euler()
+        return self._euler
+
+    @euler.setter
+    def euler(self, value):
+        self._euler[:] = value
+        self.euler_pending = False
+
+    @property
+    def utcTime(self):
+        if self.utc_values is not None:
+            self.convert_utc_time()
+        return self._utcTime
+
+    @utcTime.setter
+    def utcTime(self, value):
+        if self.utc_values is not None:
+            self.convert_utc_time()
+        self._utcTime = value
+
+    @property
+    def utcTimeInfo(self):
+        if self.utc_values is not None:
+            self.convert_utc_time()
+        return self._utcTimeInfo
+
+    @utcTimeInfo.setter
+    def utcTimeInfo(self, value):
+        if self.utc_values is not None:
+            self.convert_utc_time()
+        self._utcTimeInfo = value
+
+    def convert_utc_time(self):
+        utc_nano, year, month, day, hour, minute, second = self.utc_values
+        self.utc_values = None
+        # Create a time struct and convert to time_t
+        self._utcTimeInfo = calendar.timegm((year, month, day, hour, minute, second))
+        self._utcTime = self._utcTimeInfo + utc_nano * 1e-9
 
     @staticmethod
     def asin_clamped(x):
@@ -72,186 +150,289 @@ class XsDataPacket:
         return math.asin(x)
 
     def convert_quat_to_euler(self):
-        if not self.quaternionAvailable:
+        if not self.present & XsDataPacket.QUATERNION:
             # Handle error: Quaternion data not available.
             return
 
+        self.euler_pending = False
         sqw = self.quat[0] * self.quat[0]
         dphi = 2.0 * (sqw + self.quat[3] * self.quat[3]) - 1.0
         dpsi = 2.0 * (sqw + self.quat[1] * self.quat[1]) - 1.0
 
-        self.euler[0] = math.atan2(2.0 * (self.quat[2] * self.quat[3] + self.quat[0] * self.quat[1]), dphi) * XsDataPacket.rad2deg
-        self.euler[1] = -XsDataPacket.asin_clamped(2.0 * (self.quat[1] * self.quat[3] - self.quat[0] * self.quat[2])) * XsDataPacket.rad2deg
-        self.euler[2] = math.atan2(2.0 * (self.quat[1] * self.quat[2] + self.quat[0] * self.quat[3]), dpsi) * XsDataPacket.rad2deg
+        self._euler[0] = math.atan2(2.0 * (self.quat[2] * self.quat[3] + self.quat[0] * self.quat[1]), dphi) * XsDataPacket.rad2deg
+        self._euler[1] = -XsDataPacket.asin_clamped(2.0 * (self.quat[1] * self.quat[3] - self.quat[0] * self.quat[2])) * XsDataPacket.rad2deg
+        self._euler[2] = math.atan2(2.0 * (self.quat[1] * self.quat[2] + self.quat[0] * self.quat[3]), dpsi) * XsDataPacket.rad2deg
 
-        self.eulerAvailable = True
+        self.present |= XsDataPacket.EULER
+
+
+def _available_property(bit):
+    def get(self):
+        return bool(self.present & bit)
+
+    def set(self, value):
+        if value:
+            self.present |= bit
+        else:
+            self.present &= ~bit
+    return property(get, set)
+
+
+for _name, _bit in XsDataPacket.AVAILABLE_BITS.items():
+    setattr(XsDataPacket, _name, _available_property(_bit))
+
+
+class XsDataPacketPool:
+    # Hands out reset packets from a fixed set so steady state parsing allocates no packets.
+    # release() a packet once it's no longer used, acquire() creates a new one when the pool is empty.
+    def __init__(self, size=8):
+        self.free = [XsDataPacket() for _ in range(size)]
+
+    def acquire(self):
+        if self.free:
+            return self.free.pop()
+        return XsDataPacket()
+
+    def release(self, packet):
+        packet.reset()
+        self.free.append(packet)
 
 
 class DataPacketParser:
+    # MTData2 data id (int) -> (precompiled Struct, handler(xsdata, values)), see register_data_id()
+    data_id_handlers = {}
+    # Optional Metrics.Metrics for the whole process, unknown data ids and malformed items are counted
+    # instead of printed. Pass metrics to parse_data_packet (or use LayoutParser.metrics) to count them
+    # per device.
+    metrics = None
+
     @staticmethod
-    def parse_data_packet(packet, xbus_data):
-        # Ensure packet is a list of bytes
-        if not isinstance(packet, list) or not all(isinstance(b, bytes) for b in packet):
-            raise ValueError("Packet must be a list of bytes.")
+    def register_data_id(data_id, fmt, handler):
+        # fmt is a struct format for the item data, handler(xsdata, values) stores the unpacked values.
+        # Registering an id that already exists replaces its handler.
+        DataPacketParser.data_id_handlers[data_id] = (Struct(fmt), handler)
+
+    @staticmethod
+    def report_error(counter, message, metrics=None):
+        # Counts the problem in metrics (DataPacketParser.metrics by default) when there are any,
+        # prints it otherwise
+        if metrics is None:
+            metrics = DataPacketParser.metrics
+        if metrics is not None:
+            setattr(metrics, counter, getattr(metrics, counter) + 1)
+        else:
+            print(message)
+
+    @staticmethod
+    def parse_data_packet(packet, xbus_data, offset=0, data_ids=None, metrics=None):
+        # packet is a complete frame (FA FF 36 LEN [EXTLEN] DATA CS) starting at offset in a bytes-like buffer.
+        # Items are decoded in place with unpack_from, nothing is copied out of the buffer.
+        # With data_ids (a set) only those items are decoded, the others are skipped undecoded.
+        # Problems are counted in metrics, see report_error().
+        if isinstance(packet, list):
+            # Old style list of 1-byte bytes objects
+            if not all(isinstance(b, bytes) for b in packet):
+                raise ValueError("Packet must be a list of bytes.")
+            packet = b''.join(packet)
+        elif not isinstance(packet, (bytes, bytearray, memoryview)):
+            raise ValueError("Packet must be bytes-like or a list of bytes.")
 
         # Ensure the packet has enough data to skip header
-        if len(packet) < 5:
-            print("Error: Packet too short.")
+        if len(packet) < offset + 5 or (packet[offset + 3] == XbusPacket.EXTENDED_LENGTH and len(packet) < offset + 7):
+            DataPacketParser.report_error('parse_errors', "Error: Packet too short.", metrics)
             return
 
-        # Join bytes from the packet, skipping the first 4 bytes (header) and the last byte (checksum)
-        data_part = b''.join(packet[4:-1])  
-        bytes_offset = 0
+        # Skip the header (4 bytes, 6 with extended length), the data ends before the checksum
+        bytes_offset, data_end = XbusPacket.payload_bounds(packet, offset)
+        if data_end + 1 > len(packet):
+            DataPacketParser.report_error('parse_errors', "Error: Packet too short.", metrics)
+            return
 
-        while bytes_offset < len(data_part):
+        handlers = DataPacketParser.data_id_handlers
+        while bytes_offset < data_end:
             # Ensure there's enough data to read data_id and data_len
-            if bytes_offset + 3 > len(data_part):
-                print("Not enough data to read data_id and data_len.")
+            if bytes_offset + 3 > data_end:
+                DataPacketParser.report_error('parse_errors', "Not enough data to read data_id and data_len.", metrics)
                 break
-            
-            # 2 bytes used for data id
-            data_id = data_part[bytes_offset:bytes_offset + 2]
-            # 1 byte used for data len
-            data_len = int.from_bytes(data_part[bytes_offset + 2:bytes_offset + 3], 'big')
+
+            # 2 bytes used for data id, 1 byte used for data len
+            data_id, data_len = _item_header.unpack_from(packet, bytes_offset)
+            bytes_offset += 3
 
             # Ensure there is enough data for packet_data
-            if bytes_offset + 3 + data_len > len(data_part):
-                print("Not enough data for packet_data.")
+            if bytes_offset + data_len > data_end:
+                DataPacketParser.report_error('parse_errors', "Not enough data for packet_data.", metrics)
                 break
 
-            packet_data = data_part[bytes_offset + 3:bytes_offset + 3 + data_len]
-
             # Debug: Print details about the current data being parsed
-            # print(f"Data ID: {data_id.hex().upper()}, Data Length: {data_len}, Packet Data: {packet_data.hex().upper()}")
+            # print(f"Data ID: {data_id:04X}, Data Length: {data_len}, Packet Data: {bytes(packet[bytes_offset:bytes_offset + data_len]).hex().upper()}")
 
-            # Call the parsing function
-            DataPacketParser.parse_mtdata2(xbus_data, data_id, packet_data)
+            if data_ids is None or data_id in data_ids:
+                entry = handlers.get(data_id)
+                if entry is None:
+                    DataPacketParser.report_error('unknown_data_ids', f"Unparsed Device ID: 0x{data_id:04X}\n", metrics)
+                elif data_len < entry[0].size:
+                    DataPacketParser.report_error('parse_errors', f"Data ID 0x{data_id:04X} too short: {data_len} bytes.", metrics)
+                else:
+                    entry[1](xbus_data, entry[0].unpack_from(packet, bytes_offset))
 
             # Move offset for the next data segment
-            bytes_offset += data_len + 3  # 2 bytes for data_id and 1 byte for size field
+            bytes_offset += data_len
 
 
     @staticmethod
-    def get_data_fp1632(message, offset):
-        fpfrac = unpack_from('>i', message, offset)[0]
-        fpint = unpack_from('>h', message, offset + 4)[0]
-
+    def fp1632_to_double(fpfrac, fpint):
+        # fpfrac is the signed 32-bit fractional part, fpint the signed 16-bit integer part.
+        # The 48-bit value and the division by 2^32 are exact in a Python float, no numpy scalar needed
         fp_i64 = (fpint << 32) | (fpfrac & 0xffffffff)
 
-        rv_d = np.float64(fp_i64) / 4294967296.0
+        rv_d = fp_i64 / 4294967296.0
         return rv_d
 
     @staticmethod
-    def parse_mtdata2(xsdata, data_id, packet_data):
-        if data_id == bytes.fromhex('1020'):
-            xsdata.packetCounter = unpack('>H', packet_data)[0]
-            xsdata.packetCounterAvailable = True
-        
-        elif data_id == bytes.fromhex('1060'):
-            xsdata.sampleTimeFine = unpack('>I', packet_data)[0]
-            xsdata.sampleTimeFineAvailable = True
-        
-        elif data_id == bytes.fromhex('1010'):
-            # 12 bytes, UInt32, UInt16, Uint8.....
-            utc_nano = unpack('>I', packet_data[:4])[0]
-            year = unpack('>H', packet_data[4:6])[0]
-            month = unpack('>B', packet_data[6:7])[0]
-            day = unpack('>B', packet_data[7:8])[0]
-            hour = unpack('>B', packet_data[8:9])[0]
-            minute = unpack('>B', packet_data[9:10])[0]
-            second = unpack('>B', packet_data[10:11])[0]
-            # Create a time struct and convert to time_t
-            xsdata.utcTimeInfo = calendar.timegm((year, month, day, hour, minute, second))
-            xsdata.utcTime = xsdata.utcTimeInfo + utc_nano * 1e-9
-            xsdata.utcTimeAvailable = True
-
-        elif data_id == bytes.fromhex('2030'):
-            #4 bytes each, float32
-            xsdata.euler[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.euler[1]  = unpack('>f', packet_data[4:8])[0]
-            xsdata.euler[2]  = unpack('>f', packet_data[8:])[0]
-            xsdata.eulerAvailable = True
-        
-        elif data_id == bytes.fromhex('2010'):
-            #quaternion
-            parsed_data = unpack('>4f', packet_data[:16])
-            xsdata.quat[0] = parsed_data[0]
-            xsdata.quat[1] = parsed_data[1]
-            xsdata.quat[2] = parsed_data[2]
-            xsdata.quat[3] = parsed_data[3]
-            xsdata.quaternionAvailable = True
-            xsdata.convert_quat_to_euler()
-
-        elif data_id == bytes.fromhex('4020'):
-            #calibrated acceleration
-            xsdata.acc[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.acc[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.acc[2] = unpack('>f', packet_data[8:])[0]
-            xsdata.accAvailable = True
-        
-        elif data_id == bytes.fromhex('4030'):
-            #calibrated acceleration
-            xsdata.freeAcc[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.freeAcc[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.freeAcc[2] = unpack('>f', packet_data[8:])[0]
-            xsdata.freeAccAvailable = True
-        
-        elif data_id == bytes.fromhex('8020'):
-            #RateOfTurn, rad/sec
-            xsdata.rot[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.rot[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.rot[2] = unpack('>f', packet_data[8:])[0] 
-            xsdata.rotAvailable = True
-        
-        elif data_id == bytes.fromhex('C020'):
-            #magnetic field
-            xsdata.mag[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.mag[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.mag[2] = unpack('>f', packet_data[8:])[0]
-            xsdata.magAvailable = True
-
-        elif data_id == bytes.fromhex('5042'):
-            xsdata.latlon[0] = DataPacketParser.get_data_fp1632(packet_data,0)
-            xsdata.latlon[1] = DataPacketParser.get_data_fp1632(packet_data,6)
-            xsdata.latlonAvailable = True
-        
-        elif data_id == bytes.fromhex('5022'):
-            xsdata.altitude = DataPacketParser.get_data_fp1632(packet_data,0)
-            xsdata.altitudeAvailable = True
-
-        elif data_id == bytes.fromhex('E020'):
-            # parsed_data_dict['statusWord'] = "{:032b}".format(int.from_bytes(packet_data, 'big'))
-            xsdata.statusWord = int.from_bytes(packet_data, byteorder='big')
-            xsdata.statusWordAvailable = True
-
-        elif data_id == bytes.fromhex('D012'):
-            xsdata.vel[0] = DataPacketParser.get_data_fp1632(packet_data,0)
-            xsdata.vel[1] = DataPacketParser.get_data_fp1632(packet_data, 6)
-            xsdata.vel[2] = DataPacketParser.get_data_fp1632(packet_data, 12)
-            xsdata.velocityAvailable = True
-        
-        elif data_id == bytes.fromhex('0810'):
-            xsdata.temperature = unpack('>f', packet_data[:4])[0]
-            xsdata.temperatureAvailable = True
-        
-        elif data_id == bytes.fromhex('3010'):
-            xsdata.baropressure = unpack('>I', packet_data)[0]
-            xsdata.baropressureAvailable = True
-            
-        elif data_id == bytes.fromhex('4010'):
-            xsdata.deltaV[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.deltaV[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.deltaV[2] = unpack('>f', packet_data[8:])[0]
-            xsdata.deltaVAvailable = True
-        
-        elif data_id == bytes.fromhex('8030'):
-            xsdata.deltaQ[0] = unpack('>f', packet_data[:4])[0]
-            xsdata.deltaQ[1] = unpack('>f', packet_data[4:8])[0]
-            xsdata.deltaQ[2] = unpack('>f', packet_data[8:12])[0]
-            xsdata.deltaQ[3] = unpack('>f', packet_data[12:])[0]
-            xsdata.deltaQAvailable = True
+    def get_data_fp1632(message, offset):
+        fpfrac, fpint = unpack_from('>ih', message, offset)
+        return DataPacketParser.fp1632_to_double(fpfrac, fpint)
+
+    @staticmethod
+    def parse_mtdata2(xsdata, data_id, message, offset=0, metrics=None):
+        # Decode a single item whose data starts at offset in message, data_id is an int (or its 2 bytes)
+        if not isinstance(data_id, int):
+            data_id = int.from_bytes(data_id, 'big')
+
+        entry = DataPacketParser.data_id_handlers.get(data_id)
+        if entry is None:
+            DataPacketParser.report_error('unknown_data_ids', f"Unparsed Device ID: 0x{data_id:04X}\n", metrics)
+            return
+        fmt, handler = entry
+        handler(xsdata, fmt.unpack_from(message, offset))
+
+
+class PacketParser:
+    # DataPacketParser.parse_data_packet with its own metrics (and data_ids), for code that takes a parser
+    # object, e.g. SerialPipeline or one SensorHub device, and counts problems per device
+    def __init__(self, metrics=None, data_ids=None):
+        self.metrics = metrics
+        self.data_ids = data_ids
+
+    def parse_data_packet(self, packet, xbus_data, offset=0):
+        DataPacketParser.parse_data_packet(packet, xbus_data, offset, self.data_ids, self.metrics)
+
+
+_item_header = Struct('>HB')
+
+
+def _set_packet_counter(xsdata, values):
+    xsdata.packetCounter = values[0]
+    xsdata.present |= XsDataPacket.PACKET_COUNTER
+
+
+def _set_sample_time_fine(xsdata, values):
+    xsdata.sampleTimeFine = values[0]
+    xsdata.present |= XsDataPacket.SAMPLE_TIME_FINE
+
+
+def _set_utc_time(xsdata, values):
+    # 12 bytes, UInt32, UInt16, Uint8....., converted to utcTime when it's read
+    xsdata.utc_values = values
+    xsdata.present |= XsDataPacket.UTC_TIME
+
+
+def _set_euler(xsdata, values):
+    #4 bytes each, float32
+    xsdata._euler[0], xsdata._euler[1], xsdata._euler[2] = values
+    xsdata.euler_pending = False
+    xsdata.present |= XsDataPacket.EULER
+
+
+def _set_quaternion(xsdata, values):
+    xsdata.quat[0], xsdata.quat[1], xsdata.quat[2], xsdata.quat[3] = values
+    # Euler angles are computed from the quaternion when they're read
+    xsdata.present |= XsDataPacket.QUATERNION | XsDataPacket.EULER
+    xsdata.euler_pending = True
+
+
+def _set_acc(xsdata, values):
+    #calibrated acceleration
+    xsdata.acc[0], xsdata.acc[1], xsdata.acc[2] = values
+    xsdata.present |= XsDataPacket.ACC
+
+
+def _set_free_acc(xsdata, values):
+    xsdata.freeAcc[0], xsdata.freeAcc[1], xsdata.freeAcc[2] = values
+    xsdata.present |= XsDataPacket.FREE_ACC
+
+
+def _set_rate_of_turn(xsdata, values):
+    #RateOfTurn, rad/sec
+    xsdata.rot[0], xsdata.rot[1], xsdata.rot[2] = values
+    xsdata.present |= XsDataPacket.ROT
+
+
+def _set_mag(xsdata, values):
+    #magnetic field
+    xsdata.mag[0], xsdata.mag[1], xsdata.mag[2] = values
+    xsdata.present |= XsDataPacket.MAG
+
+
+def _set_latlon(xsdata, values):
+    xsdata.latlon[0] = DataPacketParser.fp1632_to_double(values[0], values[1])
+    xsdata.latlon[1] = DataPacketParser.fp1632_to_double(values[2], values[3])
+    xsdata.present |= XsDataPacket.LATLON
+
+
+def _set_altitude(xsdata, values):
+    xsdata.altitude = DataPacketParser.fp1632_to_double(values[0], values[1])
+    xsdata.present |= XsDataPacket.ALTITUDE
+
+
+def _set_status_word(xsdata, values):
+    # parsed_data_dict['statusWord'] = "{:032b}".format(values[0])
+    xsdata.statusWord = values[0]
+    xsdata.present |= XsDataPacket.STATUS_WORD
+
+
+def _set_velocity(xsdata, values):
+    xsdata.vel[0] = DataPacketParser.fp1632_to_double(values[0], values[1])
+    xsdata.vel[1] = DataPacketParser.fp1632_to_double(values[2], values[3])
+    xsdata.vel[2] = DataPacketParser.fp1632_to_double(values[4], values[5])
+    xsdata.present |= XsDataPacket.VELOCITY
+
+
+def _set_temperature(xsdata, values):
+    xsdata.temperature = values[0]
+    xsdata.present |= XsDataPacket.TEMPERATURE
+
+
+def _set_baro_pressure(xsdata, values):
+    xsdata.baropressure = values[0]
+    xsdata.present |= XsDataPacket.BAROPRESSURE
+
+
+def _set_delta_v(xsdata, values):
+    xsdata.deltaV[0], xsdata.deltaV[1], xsdata.deltaV[2] = values
+    xsdata.present |= XsDataPacket.DELTA_V
+
+
+def _set_delta_q(xsdata, values):
+    xsdata.deltaQ[0], xsdata.deltaQ[1], xsdata.deltaQ[2], xsdata.deltaQ[3] = values
+    xsdata.present |= XsDataPacket.DELTA_Q
 
-        else:
-            print(f"Unparsed Device ID: {', '.join(f'0x{byte:02X}' for byte in data_id)}\n")
 
-            
\ No newline at end of file
+DataPacketParser.register_data_id(0x1020, '>H', _set_packet_counter)
+DataPacketParser.register_data_id(0x1060, '>I', _set_sample_time_fine)
+DataPacketParser.register_data_id(0x1010, '>IHBBBBB', _set_utc_time)
+DataPacketParser.register_data_id(0x2030, '>3f', _set_euler)
+DataPacketParser.register_data_id(0x2010, '>4f', _set_quaternion)
+DataPacketParser.register_data_id(0x4020, '>3f', _set_acc)
+DataPacketParser.register_data_id(0x4030, '>3f', _set_free_acc)
+DataPacketParser.register_data_id(0x8020, '>3f', _set_rate_of_turn)
+DataPacketParser.register_data_id(0xC020, '>3f', _set_mag)
+DataPacketParser.register_data_id(0x5042, '>ihih', _set_latlon)
+DataPacketParser.register_data_id(0x5022, '>ih', _set_altitude)
+DataPacketParser.register_data_id(0xE020, '>I', _set_status_word)
+DataPacketParser.register_data_id(0xD012, '>ihihih', _set_velocity)
+DataPacketParser.register_data_id(0x0810, '>f', _set_temperature)
+DataPacketParser.register_data_id(0x3010, '>I', _set_baro_pressure)
+DataPacketParser.register_data_id(0x4010, '>3f', _set_delta_v)
+DataPacketParser.register_data_id(0x8030, '>4f', _set_delta_q)
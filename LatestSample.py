@@ -0,0 +1,49 @@
+import time
+
+from DataPacketParser import XsDataPacket
+from LayoutParser import LayoutParser
+
+
+class LatestSample:
+    # Consumer for control loops that only need a few fields, at a lower rate than the sensor's.
+    # Set on_frame as the framer's on_data_available. Only the items in data_ids are decoded,
+    # e.g. {0x2010, 0x8020} for the quaternion and rate of turn, the others are skipped undecoded.
+    # Every every-th packet is decoded and passed to on_sample(xbus_data). Every packet replaces the
+    # latest slot, which only holds the raw frame: latest() decodes it when it's read, so packets
+    # nobody reads cost a bytes copy. The slot is swapped as one tuple, the reader never takes a lock.
+    def __init__(self, data_ids=None, every=1, on_sample=None, layout=None):
+        self.parser = LayoutParser(layout, data_ids=data_ids)
+        self.every = every
+        self.on_sample = on_sample
+        self.frames = 0
+        # (sequence number, receive time, frame) and (sequence number, decoded packet)
+        self.slot = (0, 0.0, None)
+        self.decoded = (0, None)
+
+    def on_frame(self, frame):
+        self.frames += 1
+        seq = self.frames
+        self.slot = (seq, time.monotonic(), bytes(frame))
+        if self.on_sample is not None and seq % self.every == 0:
+            xbus_data = XsDataPacket()
+            self.parser.parse_data_packet(frame, xbus_data)
+            self.decoded = (seq, xbus_data)
+            self.on_sample(xbus_data)
+
+    def latest(self):
+        # Newest packet with the requested fields, None before the first one.
+        # Treat it as read only, the same object is returned until a newer packet arrives.
+        seq, _, frame = self.slot
+        if frame is None:
+            return None
+        decoded_seq, xbus_data = self.decoded
+        if decoded_seq != seq:
+            xbus_data = XsDataPacket()
+            self.parser.parse_data_packet(frame, xbus_data)
+            self.decoded = (seq, xbus_data)
+        return xbus_data
+
+    def age(self):
+        # Seconds since the newest packet arrived, None before the first one
+        seq, received, _ = self.slot
+        return time.monotonic() - received if seq else None
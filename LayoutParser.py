@@ -0,0 +1,120 @@
+from operator import itemgetter
+from struct import Struct, error as StructError
+
+from XbusPacket import XbusPacket
+from DataPacketParser import DataPacketParser
+from BatchDecoder import ITEM_DTYPES, layout_from_frame, layout_from_output_conf
+
+
+def _compile_layout(layout, data_ids=None):
+    # (Struct, header getter, expected headers, ((handler, first value, end value), ...)) for one layout.
+    # The Struct unpacks the frame header and every item header as bytes followed by the item's values,
+    # the header getter picks the headers out of the unpacked tuple for the layout check.
+    payload_length = sum(3 + data_len for _, data_len in layout)
+    if payload_length > XbusPacket.MAX_PAYLOAD_LENGTH:
+        raise ValueError("Layout is longer than the maximum MTData2 payload.")
+    if payload_length < XbusPacket.EXTENDED_LENGTH:
+        prefix = XbusPacket.PREAMBLE + bytes((payload_length,))
+    else:
+        prefix = XbusPacket.PREAMBLE + bytes((XbusPacket.EXTENDED_LENGTH, payload_length >> 8, payload_length & 0xFF))
+
+    fmt = f'>{len(prefix)}s'
+    headers = [0]
+    expected = [prefix]
+    items = []
+    count = 1
+    for data_id, data_len in layout:
+        fmt += '3s'
+        headers.append(count)
+        expected.append(bytes((data_id >> 8, data_id & 0xFF, data_len)))
+        count += 1
+        entry = DataPacketParser.data_id_handlers.get(data_id)
+        if entry is None or (data_ids is not None and data_id not in data_ids):
+            # Skipped like unknown ids in the item by item parser, and items that weren't asked for
+            fmt += f'{data_len}x'
+            continue
+        item_fmt, handler = entry
+        if data_len < item_fmt.size:
+            raise ValueError(f"Data ID 0x{data_id:04X} too short: {data_len} bytes.")
+        fmt += item_fmt.format.lstrip('<>!=@')
+        if data_len > item_fmt.size:
+            fmt += f'{data_len - item_fmt.size}x'
+        values = len(item_fmt.unpack(bytes(item_fmt.size)))
+        items.append((handler, count, count + values))
+        count += values
+    return Struct(fmt), itemgetter(*headers), tuple(expected), tuple(items)
+
+
+class LayoutParser:
+    # Decodes MTData2 packets with a fixed item layout, as produced by a SetOutputConfiguration,
+    # with a single Struct.unpack_from for the whole frame instead of walking the items one by one.
+    # The same unpack returns the frame and item headers, which are checked against the layout.
+    # Layouts are kept per payload length: the one of the output configuration, plus up to max_layouts
+    # learned from packets whose items are all registered (items with a lower output rate are only
+    # in some packets, so one configuration gives a few layouts). Other packets are decoded by
+    # DataPacketParser.parse_data_packet.
+    # parse_data_packet(packet, xbus_data, offset=0) is the same as DataPacketParser's, so it can be
+    # passed wherever a parser is expected. With data_ids only those items are decoded.
+    # metrics (Metrics.Metrics) counts the problems of packets decoded by the fallback.
+    def __init__(self, layout=None, max_layouts=8, data_ids=None, metrics=None):
+        self.metrics = metrics
+        self.max_layouts = max_layouts
+        self.data_ids = None if data_ids is None else frozenset(data_ids)
+        self.layouts = {}
+        self.fast_packets = 0
+        self.fallback_packets = 0
+        if layout is not None:
+            self.add_layout(layout)
+
+    @classmethod
+    def from_output_conf(cls, conf, max_layouts=8, data_ids=None):
+        # conf is the SetOutputConfiguration message (bytes or hex string), e.g. SetOutput.option5_ahrs_quat_400hz.
+        # When the size of a configured item isn't known the layout is learned from the packets instead.
+        if isinstance(conf, str):
+            conf = bytes.fromhex(conf)
+        configured = [(conf[pos] << 8) | conf[pos + 1] for pos in range(4, 4 + conf[3], 4)]
+        if any(data_id not in ITEM_DTYPES for data_id in configured):
+            return cls(max_layouts=max_layouts, data_ids=data_ids)
+        return cls(layout_from_output_conf(conf), max_layouts, data_ids)
+
+    def add_layout(self, layout):
+        # layout is ((data_id, data_len), ...), see BatchDecoder.layout_from_frame
+        layout = tuple(layout)
+        compiled = _compile_layout(layout, self.data_ids)
+        self.layouts[compiled[0].size] = (layout,) + compiled
+
+    def learn(self, packet, offset=0):
+        # Adds the layout of packet if every item is registered, returns whether it did
+        if len(self.layouts) >= self.max_layouts:
+            return False
+        start, end = XbusPacket.payload_bounds(packet, offset)
+        layout = layout_from_frame(packet, offset)
+        handlers = DataPacketParser.data_id_handlers
+        if (not layout or end >= len(packet) or sum(3 + data_len for _, data_len in layout) != end - start
+                or any(data_id not in handlers or data_len < handlers[data_id][0].size for data_id, data_len in layout)):
+            return False
+        self.add_layout(layout)
+        return True
+
+    def parse_data_packet(self, packet, xbus_data, offset=0):
+        if isinstance(packet, (bytes, bytearray, memoryview)) and len(packet) >= offset + 7:
+            end = XbusPacket.payload_bounds(packet, offset)[1]
+            # Layouts are keyed by their Struct size, the frame up to the checksum
+            entry = self.layouts.get(end - offset) if end < len(packet) else None
+            if entry is None and self.learn(packet, offset):
+                entry = self.layouts.get(end - offset)
+            if entry is not None:
+                _, frame_struct, headers, expected, items = entry
+                try:
+                    values = frame_struct.unpack_from(packet, offset)
+                except StructError:
+                    values = None
+                if values is not None and headers(values) == expected:
+                    self.fast_packets += 1
+                    for handler, first, last in items:
+                        handler(xbus_data, values[first:last])
+                    return
+
+        self.fallback_packets += 1
+        DataPacketParser.parse_data_packet(packet, xbus_data, offset, self.data_ids, self.metrics)
+
@@ -0,0 +1,159 @@
+import threading
+from time import perf_counter_ns
+
+from DataPacketParser import XsDataPacket
+
+
+_PACKET_COUNTER = XsDataPacket.PACKET_COUNTER
+
+
+class LatencyHistogram:
+    # Power of two buckets in nanoseconds, recording is one bit_length() and two additions
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p):
+        # Upper bound of the bucket holding the p-th percentile, in nanoseconds
+        if not self.count:
+            return 0
+        target = self.count * p / 100.0
+        seen = 0
+        for bits, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return (1 << bits) - 1
+        return self.max_ns
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total_ns / self.count / 1000.0 if self.count else 0.0,
+            'p50_us': self.percentile(50) / 1000.0,
+            'p99_us': self.percentile(99) / 1000.0,
+            'max_us': self.max_ns / 1000.0,
+        }
+
+
+class Metrics:
+    # Counters and per stage latency histograms for the read -> frame -> parse -> sink path.
+    # Attach one instance per device to its framer (XbusPacket.metrics) and parser (LayoutParser.metrics,
+    # DataPacketParser.parse_data_packet(..., metrics=) or DataPacketParser.metrics for the whole process),
+    # the consumer calls packet_parsed() and packet_sunk(). With metrics attached, checksum failures,
+    # unknown data ids and parse errors are counted instead of printed.
+    # frames counts MTData2 frames, messages the other messages (acks, errors).
+    # Every packet is counted, the latencies of every sample_every-th frame are recorded.
+    STAGES = ('read_to_frame', 'frame_to_parsed', 'parsed_to_sunk')
+    COUNTERS = ('bytes_read', 'chunks', 'bytes_skipped', 'resyncs', 'frames', 'messages', 'checksum_failures',
+                'unknown_data_ids', 'parse_errors', 'packets', 'packet_counter_gaps', 'packets_lost',
+                'packet_counter_duplicates', 'packets_reordered', 'packet_counter_resets', 'frames_dropped')
+    # A packetCounter up to this many steps behind the previous one is a reordered (late) packet,
+    # further back but less than half the 16 bit range it's a reset or a replayed stream
+    REORDER_WINDOW = 64
+
+    def __init__(self, sample_every=8):
+        self.sample_every = sample_every
+        self.reset()
+        self.reporter = None
+
+    def reset(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        for name in self.STAGES:
+            setattr(self, name, LatencyHistogram())
+        # -1 until the first packetCounter
+        self.last_packet_counter = -1
+        self.last_frame_ns = 0
+        self.countdown = 1
+
+    # The hooks below run for every packet. A sampled frame gets one perf_counter_ns() per stage,
+    # the others pass 0 along as their timestamp and are only counted.
+
+    def frame_complete(self, read_ns):
+        # Called by the framer for every valid MTData2 frame of a chunk read at read_ns,
+        # returns the frame timestamp, 0 when the frame isn't sampled
+        self.frames += 1
+        countdown = self.countdown - 1
+        if countdown:
+            self.countdown = countdown
+            self.last_frame_ns = 0
+            return 0
+        self.countdown = self.sample_every
+        now = perf_counter_ns()
+        self.read_to_frame.record(now - read_ns)
+        self.last_frame_ns = now
+        return now
+
+    def packet_parsed(self, xbus_data, frame_ns=None):
+        # Returns the parse timestamp for packet_sunk(), frame_ns defaults to the last framed packet
+        self.packets += 1
+        if xbus_data.present & _PACKET_COUNTER:
+            packet_counter = xbus_data.packetCounter
+            last = self.last_packet_counter
+            step = (packet_counter - last) & 0xFFFF
+            if step == 1 or last < 0:
+                self.last_packet_counter = packet_counter
+            elif step == 0:
+                self.packet_counter_duplicates += 1
+            elif step >= 0x10000 - self.REORDER_WINDOW:
+                # The stream goes on from the newer counter. The gap before it already counted this
+                # packet in packets_lost.
+                self.packets_reordered += 1
+            elif step >= 0x8000:
+                self.packet_counter_resets += 1
+                self.last_packet_counter = packet_counter
+            else:
+                self.packet_counter_gaps += 1
+                self.packets_lost += step - 1
+                self.last_packet_counter = packet_counter
+        if frame_ns is None:
+            frame_ns = self.last_frame_ns
+        if not frame_ns:
+            return 0
+        now = perf_counter_ns()
+        self.frame_to_parsed.record(now - frame_ns)
+        return now
+
+    def packet_sunk(self, parsed_ns):
+        if parsed_ns:
+            self.parsed_to_sunk.record(perf_counter_ns() - parsed_ns)
+
+    def snapshot(self):
+        snapshot = {name: getattr(self, name) for name in self.COUNTERS}
+        for name in self.STAGES:
+            snapshot[name] = getattr(self, name).snapshot()
+        return snapshot
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = [', '.join(f'{name}: {snapshot[name]}' for name in self.COUNTERS)]
+        for name in self.STAGES:
+            s = snapshot[name]
+            lines.append(f"{name}: n={s['count']} mean={s['mean_us']:.1f}us p50<={s['p50_us']:.1f}us "
+                         f"p99<={s['p99_us']:.1f}us max={s['max_us']:.1f}us")
+        return '\n'.join(lines)
+
+    def start_reporter(self, interval=10.0, output=print):
+        # Calls output(report()) every interval seconds on a daemon thread
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                output(self.report())
+
+        self.reporter = stop
+        threading.Thread(target=run, name='xbus-metrics', daemon=True).start()
+
+    def stop_reporter(self):
+        if self.reporter is not None:
+            self.reporter.set()
+            self.reporter = None
@@ -0,0 +1,218 @@
+import argparse
+import ctypes
+import time
+
+import numpy as np
+
+from DataPacketParser import DataPacketParser, XsDataPacket
+from LayoutParser import LayoutParser
+from Metrics import Metrics
+from SharedRing import RecordPacker, normalize_data_ids
+from XbusPacket import XbusPacket
+from columnar_logging import COLUMNS
+from NativeFramer import LIBRARY, SOURCE, NativeFramer, build, make_framer, native_library
+
+
+# Optional native decoder (xbus_native.c, loaded by NativeFramer.native_library()). RecordDecoder frames a
+# byte stream and decodes the MTData2 frames into SharedRing records, with the compiled library when it
+# has been built next to this file and with XbusPacket + LayoutParser otherwise, the records are the same
+# either way. NativeFramer and make_framer are imported from NativeFramer.py for the live path.
+# Build it with `python NativeDecoder.py --build`, set XSENS_NO_NATIVE=1 to use the Python path anyway.
+
+# Item modes of xbus_native.c
+_SKIP = 0
+_DECODE = 1
+_IN_PYTHON = 2
+# Result codes of xbus_decode
+_MESSAGE = 1
+_FULL = 2
+
+NATIVE_DATA_IDS = frozenset(COLUMNS)
+
+
+def _item_modes(data_ids):
+    # Per data id: skipped, decoded natively or left to Python (unknown ids, which the Python parser
+    # reports, and ids with a handler registered by someone else)
+    modes = np.full(65536, _IN_PYTHON if data_ids is None else _SKIP, dtype=np.uint8)
+    if data_ids is not None:
+        modes[list(data_ids)] = _IN_PYTHON
+    for data_id in NATIVE_DATA_IDS:
+        entry = DataPacketParser.data_id_handlers.get(data_id)
+        if modes[data_id] != _SKIP and entry is not None and entry[1].__module__ == 'DataPacketParser':
+            modes[data_id] = _DECODE
+    return modes
+
+
+class RecordDecoder:
+    # feed_bytes(data) returns (records, frame offsets) for the MTData2 frames completed by data:
+    # a numpy array of SharedRing.record_dtype(data_ids) with seq counting the frames from 1, and the
+    # position of every frame in the stream. Other messages go to on_message(frame) like in XbusPacket.
+    # native=None uses the library when it's available, capacity is the size of its record buffer.
+    def __init__(self, data_ids=None, native=None, capacity=4096, on_message=None):
+        self.data_ids = None if data_ids is None else frozenset(data_ids)
+        self.packer = RecordPacker(normalize_data_ids(data_ids))
+        self.dtype = self.packer.dtype
+        self.on_message = on_message
+        self.count = 0
+        self.parser = LayoutParser(data_ids=self.data_ids)
+        self.library = native_library() if native is None or native else None
+        if native and self.library is None:
+            raise RuntimeError("The native decoder isn't built, see NativeDecoder.build().")
+        self.native = self.library is not None
+        if self.native:
+            self._init_native(capacity)
+        else:
+            self.framer = XbusPacket(on_data_available=self._on_frame, on_message=on_message)
+            # Counts checksum failures instead of printing them
+            self.framer.metrics = Metrics()
+            self.framer.stream_offset = 0
+            self.parts = []
+            self.offsets = []
+
+    @property
+    def stream_offset(self):
+        # Position of the first byte that isn't framed yet
+        return self.stream_offset_native if self.native else self.framer.stream_offset
+
+    @stream_offset.setter
+    def stream_offset(self, offset):
+        if self.native:
+            self.stream_offset_native = offset
+        else:
+            self.framer.stream_offset = offset
+
+    @property
+    def checksum_failures(self):
+        return self.failures.value if self.native else self.framer.metrics.checksum_failures
+
+    def _init_native(self, capacity):
+        dtype = self.dtype
+        self.capacity = capacity
+        self.records = np.zeros(capacity, dtype=dtype)
+        self.frame_starts = np.zeros(capacity, dtype=np.uint64)
+        self.in_python = np.zeros(capacity, dtype=np.uint8)
+        self.modes = _item_modes(self.data_ids)
+        self.field_offsets = np.full(65536, -1, dtype=np.int32)
+        for data_id, (name, _, _, _) in COLUMNS.items():
+            if name in dtype.fields:
+                self.field_offsets[data_id] = dtype.fields[name][1]
+        self.euler_offset = dtype.fields['euler'][1] if 'euler' in dtype.fields else -1
+        self.present_offset = dtype.fields['present'][1]
+        self.template = self.packer.struct.pack(0, 0, *[value for _, _, _, missing in self.packer.fields for value in missing])
+        self.buffer = bytearray()
+        self.stream_offset_native = 0
+        self.failures = ctypes.c_uint64(0)
+        self.pos = ctypes.c_size_t(0)
+        self.message_end = ctypes.c_size_t(0)
+        self.result = ctypes.c_int(0)
+
+    def feed_bytes(self, data):
+        if self.native:
+            records, offsets = self._feed_native(data)
+        else:
+            self.framer.feed_bytes(data)
+            records = np.frombuffer(bytearray(b''.join(self.parts)), dtype=self.dtype)
+            offsets = np.array(self.offsets, dtype=np.uint64)
+            self.parts = []
+            self.offsets = []
+        records['seq'] = np.arange(self.count + 1, self.count + 1 + len(records))
+        self.count += len(records)
+        return records, offsets
+
+    def _on_frame(self, frame):
+        xbus_data = XsDataPacket()
+        self.parser.parse_data_packet(frame, xbus_data)
+        self.parts.append(self.packer.struct.pack(0, xbus_data.present, *self.packer.values(xbus_data)))
+        self.offsets.append(self.framer.frame_offset)
+
+    def _feed_native(self, data):
+        buffer = self.buffer
+        buffer += data
+        size = len(buffer)
+        parts = []
+        offsets = []
+        self.pos.value = 0
+        address = ctypes.c_char.from_buffer(buffer) if size else None
+        try:
+            while True:
+                count = self.library.xbus_decode(
+                    ctypes.addressof(address) if size else None, size, self.pos, self.message_end, self.result,
+                    self.records.ctypes.data, self.dtype.itemsize, self.capacity, self.template,
+                    self.modes.ctypes.data, self.field_offsets.ctypes.data, self.euler_offset, self.present_offset,
+                    self.frame_starts.ctypes.data, self.in_python.ctypes.data, self.failures)
+                if count:
+                    records = self.records[:count].copy()
+                    starts = self.frame_starts[:count]
+                    for i in np.flatnonzero(self.in_python[:count]):
+                        # Frames with something the Python parser reports, decoded by it
+                        start = int(starts[i])
+                        frame = bytes(buffer[start:XbusPacket.payload_bounds(buffer, start)[1] + 1])
+                        xbus_data = XsDataPacket()
+                        self.parser.parse_data_packet(frame, xbus_data)
+                        records[i:i + 1] = np.frombuffer(self.packer.struct.pack(0, xbus_data.present, *self.packer.values(xbus_data)), dtype=self.dtype)
+                    parts.append(records)
+                    offsets.append(starts + np.uint64(self.stream_offset_native))
+                if self.result.value == _MESSAGE:
+                    start, end = self.pos.value, self.message_end.value
+                    if self.on_message is not None:
+                        frame = memoryview(buffer)[start:end]
+                        try:
+                            self.on_message(frame)
+                        finally:
+                            frame.release()
+                    self.pos.value = end
+                elif self.result.value != _FULL:
+                    break
+        finally:
+            del address
+        pos = self.pos.value
+        if pos:
+            del buffer[:pos]
+            self.stream_offset_native += pos
+        if not parts:
+            return self.records[:0].copy(), np.zeros(0, dtype=np.uint64)
+        return np.concatenate(parts), np.concatenate(offsets)
+
+
+def decode_bytes(data, data_ids=None, native=None):
+    # Records and frame offsets of all frames in data, see RecordDecoder
+    return RecordDecoder(data_ids, native).feed_bytes(data)
+
+
+def benchmark(count=100000, serial_chunk=1024):
+    # Framers with serial sized chunks, record decoders with 64 KB chunks
+    from PacketGenerator import PacketGenerator
+    from SetOutput import option1_gnssins_quat_400hz
+    data = PacketGenerator(option1_gnssins_quat_400hz).stream(count)
+    for native in (False, True):
+        if native and native_library() is None:
+            print("The native decoder isn't built, see --build.")
+            break
+        name = 'native' if native else 'python'
+        framer = make_framer(lambda frame: None, native=native)
+        start = time.perf_counter()
+        for pos in range(0, len(data), serial_chunk):
+            framer.feed_bytes(data[pos:pos + serial_chunk])
+        elapsed = time.perf_counter() - start
+        print(f"{name} framer: {count / elapsed:,.0f} packets/s")
+        decoder = RecordDecoder(native=native)
+        start = time.perf_counter()
+        for pos in range(0, len(data), 65536):
+            decoder.feed_bytes(data[pos:pos + 65536])
+        elapsed = time.perf_counter() - start
+        print(f"{name} records: {count / elapsed:,.0f} packets/s")
+
+
+def main():
+    # The native and the Python decoders are compared by test_NativeDecoder.py
+    parser = argparse.ArgumentParser(description="Build the native decoder and compare its speed with the Python one.")
+    parser.add_argument('--build', action='store_true', help="compile xbus_native.c first")
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+    if args.build and not build():
+        raise SystemExit(1)
+    benchmark(args.count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+import sys
+from time import perf_counter_ns
+
+from XbusPacket import XbusPacket
+
+try:
+    import ctypes
+except ImportError:
+    # Python builds without ctypes use the Python framer
+    ctypes = None
+
+
+# Loader of the optional native library (xbus_native.c) and NativeFramer, a drop-in XbusPacket that finds
+# the frames and checks their checksums in C. make_framer() returns it when the library is there and an
+# XbusPacket otherwise. Only needs the standard library, the serial reader doesn't depend on numpy
+# through it. NativeDecoder.RecordDecoder decodes whole records with the same library.
+# Build it with `python NativeDecoder.py --build`, set XSENS_NO_NATIVE=1 to use the Python path anyway.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(_HERE, 'xbus_native.c')
+LIBRARY = os.path.join(_HERE, 'xbus_native.dll' if sys.platform == 'win32' else 'xbus_native.so')
+
+# Event kinds of xbus_frame
+_FRAME = 0
+_BAD_CHECKSUM = 1
+
+_native = None
+
+
+def build():
+    # Compiles xbus_native.c with the C compiler in $CC (cc by default), returns whether it worked
+    import subprocess
+    command = [os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC', '-ffp-contract=off', '-o', LIBRARY, SOURCE, '-lm']
+    try:
+        subprocess.run(command, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not build the native decoder: {e}")
+        return False
+    global _native
+    _native = None
+    return True
+
+
+def native_library():
+    # The loaded library, None when it isn't built, can't be loaded or is switched off
+    global _native
+    if _native is None:
+        _native = False
+        if ctypes is None or os.environ.get('XSENS_NO_NATIVE') or sys.byteorder != 'little' or not os.path.exists(LIBRARY):
+            return None
+        try:
+            library = ctypes.CDLL(LIBRARY)
+        except OSError as e:
+            print(f"Could not load {LIBRARY}, using the Python decoder: {e}")
+            return None
+        size_p = ctypes.POINTER(ctypes.c_size_t)
+        library.xbus_decode.restype = ctypes.c_long
+        library.xbus_decode.argtypes = [
+            ctypes.c_void_p, ctypes.c_size_t, size_p, size_p, ctypes.POINTER(ctypes.c_int),
+            ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_char_p,
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int32, ctypes.c_int32,
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint64)]
+        try:
+            library.xbus_frame.restype = ctypes.c_long
+        except AttributeError:
+            print(f"{LIBRARY} is outdated, using the Python decoder. Rebuild it with `python NativeDecoder.py --build`.")
+            return None
+        library.xbus_frame.argtypes = [ctypes.c_void_p, ctypes.c_size_t, size_p, ctypes.c_void_p, ctypes.c_size_t]
+        _native = library
+    return _native or None
+
+
+class NativeFramer(XbusPacket):
+    # XbusPacket whose feed_bytes finds the frames and checks their checksums in xbus_native.c, one call
+    # per chunk instead of a find and a sum per frame in Python. Callbacks, mid_handlers, frame_offset,
+    # metrics and checksum failures behave exactly like XbusPacket's. capacity is the number of frames
+    # (and rejected frames) returned per call. Chunks that leave fewer than min_size bytes in the buffer
+    # (about one frame) are framed by XbusPacket, the ctypes call costs more than it saves there.
+    def __init__(self, on_data_available=None, on_message=None, capacity=256, min_size=256):
+        super().__init__(on_data_available, on_message)
+        self.library = native_library()
+        if self.library is None:
+            raise RuntimeError("The native decoder isn't built, see NativeDecoder.build().")
+        self.capacity = capacity
+        self.min_size = min_size
+        # (kind, start, end) of every event
+        self.events = (ctypes.c_uint64 * (3 * capacity))()
+        self.events_address = ctypes.addressof(self.events)
+        self.pos = ctypes.c_size_t(0)
+
+    def feed_bytes(self, data):
+        if len(self.buffer) + len(data) < self.min_size:
+            XbusPacket.feed_bytes(self, data)
+            return
+        metrics = self.metrics
+        if metrics is not None:
+            read_ns = perf_counter_ns()
+            metrics.bytes_read += len(data)
+            metrics.chunks += 1
+        buffer = self.buffer
+        buffer += data
+        size = len(buffer)
+        capacity = self.capacity
+        self.pos.value = 0
+        # Position after the previous frame, for the resync metrics and where to trim when a callback raises
+        last = 0
+        pos = 0
+        address = ctypes.c_char.from_buffer(buffer)
+        view = memoryview(buffer)
+        try:
+            while True:
+                count = self.library.xbus_frame(ctypes.addressof(address), size, self.pos, self.events_address, capacity)
+                events = iter(self.events[:3 * count])
+                for kind, start, end in zip(events, events, events):
+                    if metrics is not None and start > last:
+                        metrics.resyncs += 1
+                        metrics.bytes_skipped += start - last
+                    if kind != _FRAME:
+                        if kind == _BAD_CHECKSUM:
+                            self._checksum_failed(start, end)
+                        last = start + 1
+                        continue
+
+                    frame = view[start:end]
+                    self.frame_offset = self.stream_offset + start
+                    last = pos = end
+                    try:
+                        mid = buffer[start + 2]
+                        if mid == self.MTDATA2:
+                            callback = self.on_data_available
+                            if metrics is not None:
+                                self.read_ns = read_ns
+                                self.frame_ns = metrics.frame_complete(read_ns)
+                        else:
+                            callback = self.mid_handlers.get(mid, self.on_message)
+                            if metrics is not None:
+                                metrics.messages += 1
+                        if callback is not None:
+                            callback(frame)
+                    finally:
+                        frame.release()
+                if count < capacity:
+                    break
+            pos = self.pos.value
+            if metrics is not None and pos > last:
+                # Either no preamble after the last frame (the last byte is kept) or the start of an incomplete one
+                if pos != size - 1:
+                    metrics.resyncs += 1
+                metrics.bytes_skipped += pos - last
+        finally:
+            view.release()
+            del address
+            # As in XbusPacket.feed_bytes, a callback that raised doesn't get its frame again
+            if pos:
+                del buffer[:pos]
+                self.stream_offset += pos
+
+
+def make_framer(on_data_available=None, on_message=None, native=None):
+    # The framer for live data: a NativeFramer when the library is available, an XbusPacket otherwise.
+    # native=False always returns an XbusPacket, native=True raises when the library isn't built.
+    if native or (native is None and native_library() is not None):
+        return NativeFramer(on_data_available, on_message)
+    return XbusPacket(on_data_available, on_message)
@@ -0,0 +1,109 @@
+import math
+import random
+from datetime import datetime, timezone
+from struct import Struct, pack
+
+
+def build_frame(mid, payload):
+    # Complete Xbus frame with preamble, bus id, (extended) length and checksum
+    length = len(payload)
+    if length < 0xFF:
+        body = bytes((0xFF, mid, length)) + payload
+    else:
+        body = bytes((0xFF, mid, 0xFF, length >> 8, length & 0xFF)) + payload
+    return b'\xfa' + body + bytes(((-sum(body)) & 0xFF,))
+
+
+def _fp1632(value):
+    fp_i64 = int(round(value * 4294967296.0))
+    return pack('>Ih', fp_i64 & 0xffffffff, fp_i64 >> 32)
+
+
+def _utc(t):
+    seconds = int(t)
+    utc = datetime.fromtimestamp(seconds, timezone.utc)
+    return pack('>IHBBBBBB', int((t - seconds) * 1e9), utc.year, utc.month, utc.day,
+                utc.hour, utc.minute, utc.second, 0x37)
+
+
+_float3 = Struct('>3f')
+_float4 = Struct('>4f')
+
+
+class PacketGenerator:
+    # Builds valid, checksummed MTData2 frames for the items of a SetOutputConfiguration message
+    # (see SetOutput.OUTPUT_CONFIGURATIONS). Items configured at a lower rate than the fastest one
+    # are only present in every n-th packet, like on the sensor. Unknown data ids are left out.
+    def __init__(self, configuration, seed=0, start_time=1700000000.0):
+        if isinstance(configuration, str):
+            configuration = bytes.fromhex(configuration)
+        self.random = random.Random(seed)
+        self.start_time = start_time
+
+        items = []
+        for pos in range(4, 4 + configuration[3], 4):
+            data_id = (configuration[pos] << 8) | configuration[pos + 1]
+            rate = (configuration[pos + 2] << 8) | configuration[pos + 3]
+            if data_id in self.ENCODERS:
+                items.append((data_id, None if rate >= 0xFFFE else rate))
+        self.rate = max([rate for _, rate in items if rate] or [400])
+        self.items = [(data_id, 1 if not rate else max(1, self.rate // rate)) for data_id, rate in items]
+
+    def payload(self, i):
+        t = i / self.rate
+        payload = []
+        for data_id, every in self.items:
+            if i % every == 0:
+                data = self.ENCODERS[data_id](self, i, t)
+                payload.append(pack('>HB', data_id, len(data)) + data)
+        return b''.join(payload)
+
+    def frame(self, i):
+        return build_frame(0x36, self.payload(i))
+
+    def frames(self, count):
+        return [self.frame(i) for i in range(count)]
+
+    def stream(self, count, noise=0.0, corruption=0.0):
+        # count frames as one byte string, with probability noise a few random bytes are inserted
+        # before a frame and with probability corruption one byte of a frame is flipped
+        rnd = self.random
+        parts = []
+        for i in range(count):
+            if noise and rnd.random() < noise:
+                parts.append(bytes(rnd.randrange(256) for _ in range(rnd.randint(1, 16))))
+            frame = self.frame(i)
+            if corruption and rnd.random() < corruption:
+                frame = bytearray(frame)
+                frame[rnd.randrange(4, len(frame))] ^= 1 << rnd.randrange(8)
+                frame = bytes(frame)
+            parts.append(frame)
+        return b''.join(parts)
+
+    def _quat(self, i, t):
+        yaw = 0.1 * t
+        return _float4.pack(math.cos(yaw / 2), 0.0, 0.0, math.sin(yaw / 2))
+
+    def _vector(self, scale, z=0.0):
+        rnd = self.random
+        return _float3.pack(rnd.gauss(0, scale), rnd.gauss(0, scale), z + rnd.gauss(0, scale))
+
+    ENCODERS = {
+        0x1020: lambda self, i, t: pack('>H', i & 0xFFFF),
+        0x1060: lambda self, i, t: pack('>I', (i * 10000 // self.rate) & 0xFFFFFFFF),
+        0x1010: lambda self, i, t: _utc(self.start_time + t),
+        0x2030: lambda self, i, t: _float3.pack(1.0, -2.0, (5.7 * t) % 360 - 180),
+        0x2010: _quat,
+        0x4020: lambda self, i, t: self._vector(0.05, 9.81),
+        0x4030: lambda self, i, t: self._vector(0.05),
+        0x8020: lambda self, i, t: self._vector(0.01),
+        0xC020: lambda self, i, t: _float3.pack(0.3, 0.0, -0.9),
+        0x5042: lambda self, i, t: _fp1632(52.0 + 1e-6 * t) + _fp1632(4.0 - 1e-6 * t),
+        0x5022: lambda self, i, t: _fp1632(50.0 + 0.01 * t),
+        0xE020: lambda self, i, t: pack('>I', 0x00000007),
+        0xD012: lambda self, i, t: _fp1632(0.5) + _fp1632(-0.25) + _fp1632(0.0),
+        0x0810: lambda self, i, t: pack('>f', 25.0),
+        0x3010: lambda self, i, t: pack('>I', 101325),
+        0x4010: lambda self, i, t: self._vector(0.001),
+        0x8030: lambda self, i, t: _float4.pack(1.0, 0.0, 0.0, 0.0),
+    }
@@ -0,0 +1,131 @@
+import argparse
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Decodes a raw Xbus capture in chunks on all cores. A worker starts its framer at the beginning of its
+# chunk, which may be in the middle of a frame: it resynchronizes on the next preamble with a valid
+# checksum, exactly like the serial framer after a corrupted frame. Frames are assigned to the chunk
+# their first byte is in, a frame that runs over the end of the chunk is completed from the bytes after it.
+# Past its chunk a worker keeps framing for SYNC_BYTES without decoding, and the merge checks that the
+# next worker found the same first frame. Once two framers agree on a frame they agree on everything
+# after it, so the merged output is the same as from one framer over the whole file. When they don't
+# agree (the next chunk starts in a long stretch of noise) that chunk is decoded again from a position
+# on the previous worker's frame chain.
+
+CHUNK_BYTES = 16 * 1024 * 1024
+SYNC_BYTES = 64 * 1024
+_FEED_BYTES = 1024 * 1024
+
+
+def _decode_range(path, start, end, data_ids, sync_bytes=SYNC_BYTES):
+    # Decodes the MTData2 frames starting in [start, end) and lists the frames starting in
+    # [end, end + sync_bytes). Returns (offsets, records bytes, tail offsets, resume), resume is the
+    # position the framer would continue from when no frame starts after end.
+    # Uses the native decoder when it's built, see NativeDecoder.
+    from NativeDecoder import RecordDecoder
+    decoder = RecordDecoder(data_ids)
+    decoder.stream_offset = start
+    parts = []
+    frame_offsets = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        stop = min(size, end + sync_bytes)
+        if start >= stop:
+            return [], b'', [], start
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            for pos in range(start, stop, _FEED_BYTES):
+                records, offsets = decoder.feed_bytes(view[pos:min(pos + _FEED_BYTES, stop)])
+                parts.append(records)
+                frame_offsets.append(offsets)
+            view.release()
+    records = np.concatenate(parts)
+    offsets = np.concatenate(frame_offsets)
+    # Frames past the chunk are only needed for the merge
+    count = int(np.searchsorted(offsets, end))
+    return offsets[:count].tolist(), records[:count].tobytes(), offsets[count:].tolist(), decoder.stream_offset
+
+
+def decode_capture(path, data_ids=None, workers=None, chunk_bytes=CHUNK_BYTES):
+    # Every MTData2 frame of the capture as one numpy record (see SharedRing.record_dtype), in file
+    # order, which is packetCounter order across its wrap. seq numbers the frames from 1.
+    # workers is the number of processes, all cores by default, 1 decodes in this process.
+    from SharedRing import record_dtype, normalize_data_ids
+    dtype = record_dtype(normalize_data_ids(data_ids))
+    size = os.path.getsize(path)
+    # Chunks have to be longer than the frames the next worker may skip while resynchronizing
+    chunk_bytes = max(chunk_bytes, SYNC_BYTES)
+    ranges = [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+    workers = os.cpu_count() if workers is None else workers
+    if workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(min(workers, len(ranges))) as executor:
+            results = list(executor.map(_decode_range, [path] * len(ranges), [start for start, _ in ranges],
+                                        [end for _, end in ranges], [data_ids] * len(ranges)))
+    else:
+        results = [_decode_range(path, start, end, data_ids) for start, end in ranges]
+
+    parts = []
+    previous = None
+    for (start, end), result in zip(ranges, results):
+        offsets, records, tail, resume = result
+        if previous is not None:
+            previous_tail, previous_resume = previous
+            sync = previous_tail[0] if previous_tail else None
+            if sync is not None and sync in set(offsets) | set(tail):
+                # Frames the worker found before the first frame of the previous chain aren't frames
+                skip = next((i for i, offset in enumerate(offsets) if offset >= sync), len(offsets))
+                records = records[skip * dtype.itemsize:]
+            else:
+                # Decoded again from a position where the serial framer would be
+                offsets, records, tail, resume = _decode_range(path, previous_resume if sync is None else sync, end, data_ids)
+        parts.append(records)
+        previous = (tail, resume)
+
+    records = np.frombuffer(b''.join(parts), dtype=dtype).copy()
+    records['seq'] = np.arange(1, len(records) + 1)
+    return records
+
+
+def _check(path, workers, chunk_bytes):
+    start = time.perf_counter()
+    serial = decode_capture(path, workers=1, chunk_bytes=os.path.getsize(path) + 1)
+    serial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel = decode_capture(path, workers=workers, chunk_bytes=chunk_bytes)
+    parallel_time = time.perf_counter() - start
+    # Byte for byte, so NaNs of missing fields compare equal
+    identical = serial.tobytes() == parallel.tobytes()
+    print(f"{path}: {len(serial)} frames, serial {serial_time:.2f} s, {workers} workers {parallel_time:.2f} s, "
+          f"{'identical' if identical else 'DIFFERENT'}")
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode captures on all cores and compare with the serial decoder.")
+    parser.add_argument('paths', nargs='*', help="raw Xbus captures, a generated one with noise when left out")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-bytes', type=int, default=CHUNK_BYTES)
+    args = parser.parse_args()
+    paths = args.paths
+    if not paths:
+        from PacketGenerator import PacketGenerator
+        from SetOutput import option4_gnssins_euler_pvt_100hz
+        path = 'parallel_decoder_check.xbus'
+        with open(path, 'wb') as f:
+            f.write(PacketGenerator(option4_gnssins_euler_pvt_100hz).stream(200000, noise=0.01, corruption=0.01))
+        paths = [path]
+        # Small chunks so many chunk boundaries fall inside frames and noise
+        args.chunk_bytes = min(args.chunk_bytes, 256 * 1024)
+    ok = all([_check(path, args.workers, args.chunk_bytes) for path in paths])
+    if not args.paths:
+        os.remove(paths[0])
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import heapq
+import queue
+import threading
+import time
+
+from DataPacketParser import PacketParser, XsDataPacket
+from Metrics import Metrics
+from NativeFramer import make_framer
+
+
+class DeviceClock:
+    # Maps a device's sampleTimeFine (10 kHz ticks, wraps at 2^32) onto host time.
+    # host_time - device_time is fitted as offset + drift * device_time with exponential forgetting,
+    # so the aligned times follow the device clock (no USB/OS jitter) but stay locked to the host.
+    TICKS_PER_SECOND = 10000.0
+
+    def __init__(self, forgetting=0.999):
+        self.forgetting = forgetting
+        self.last_ticks = None
+        self.wraps = 0
+        self.origin = None
+        self.n = self.sx = self.sy = self.sxx = self.sxy = 0.0
+        self.offset = 0.0
+        self.drift = 0.0
+
+    def device_time(self, sample_time_fine):
+        if self.last_ticks is not None and sample_time_fine < self.last_ticks - 0x80000000:
+            self.wraps += 1
+        self.last_ticks = sample_time_fine
+        return (sample_time_fine + self.wraps * 0x100000000) / self.TICKS_PER_SECOND
+
+    def update(self, sample_time_fine, host_time):
+        # Adds one observation, returns the aligned host time of the sample
+        t = self.device_time(sample_time_fine)
+        if self.origin is None:
+            self.origin = t
+            self.offset = host_time - t
+        x = t - self.origin
+        y = host_time - t
+        f = self.forgetting
+        self.n = self.n * f + 1.0
+        self.sx = self.sx * f + x
+        self.sy = self.sy * f + y
+        self.sxx = self.sxx * f + x * x
+        self.sxy = self.sxy * f + x * y
+        denominator = self.n * self.sxx - self.sx * self.sx
+        if denominator > 1e-9:
+            self.drift = (self.n * self.sxy - self.sx * self.sy) / denominator
+            self.offset = (self.sy - self.drift * self.sx) / self.n - self.drift * self.origin
+        else:
+            self.offset = self.sy / self.n
+        return t + self.offset + self.drift * t
+
+
+class CaptureSource:
+    # Makes a CaptureFile.CaptureReader look like a SerialHandler for the hub, one frame per read.
+    # host_time is the recorded receive time, speed as in CaptureReader.replay.
+    def __init__(self, reader, speed=None):
+        self.reader = reader
+        self.speed = speed
+        self.next = 0
+        self.pos = int(reader.index[0]['offset']) if len(reader) else 0
+        self.host_time = None
+        self.wall_start = None
+
+    def read_bytes(self):
+        if self.next >= len(self.reader):
+            raise EOFError("End of capture.")
+        record = self.reader.index[self.next]
+        self.next += 1
+        self.host_time = float(record['hostTime'])
+        if self.speed is not None and self.host_time == self.host_time:
+            if self.wall_start is None:
+                self.wall_start = (time.monotonic(), self.host_time)
+            delay = (self.host_time - self.wall_start[1]) / self.speed - (time.monotonic() - self.wall_start[0])
+            if delay > 0:
+                time.sleep(delay)
+        end = int(record['offset']) + int(record['length'])
+        data = bytes(self.reader.data[self.pos:end])
+        self.pos = end
+        return data
+
+
+class _Device:
+    def __init__(self, index, source, metrics=False):
+        self.index = index
+        self.source = source
+        self.clock = DeviceClock()
+        self.framer = make_framer()
+        self.metrics = Metrics() if metrics else None
+        self.framer.metrics = self.metrics
+        self.parser = PacketParser(self.metrics)
+        self.thread = None
+        self.packets = 0
+        self.aligned_time = None
+        self.latest_time = None
+        self.latest_wall = 0.0
+        self.finished = False
+
+
+class SensorHub:
+    # Reads several devices at once, one reader thread per source (SerialHandler or CaptureSource),
+    # and calls on_packet(device_index, aligned_time, xbus_data) in time order from the merge thread.
+    # aligned_time is utcTime when time_source='utc' and the packet has it, otherwise the
+    # sampleTimeFine mapped onto host time by the device's DeviceClock.
+    # A packet is released once every device has produced a later one, or after max_wait seconds
+    # for devices that stopped sending.
+    # With metrics every device counts its frames, parse errors and packetCounter gaps in its own
+    # Metrics.Metrics (self.devices[i].metrics), stats() includes the counters.
+    def __init__(self, sources, on_packet, time_source='sampleTimeFine', max_wait=0.2, metrics=False):
+        self.on_packet = on_packet
+        self.time_source = time_source
+        self.max_wait = max_wait
+        self.devices = [_Device(i, source, metrics) for i, source in enumerate(sources)]
+        self.queue = queue.Queue()
+        self.running = False
+        self.merge_thread = None
+
+    def start(self):
+        self.running = True
+        now = time.monotonic()
+        for device in self.devices:
+            device.latest_wall = now
+            device.framer.on_data_available = lambda frame, device=device: self._on_frame(device, frame)
+            device.thread = threading.Thread(target=self._read, args=(device,), name=f'xbus-hub-{device.index}', daemon=True)
+            device.thread.start()
+        self.merge_thread = threading.Thread(target=self._merge, name='xbus-hub-merge', daemon=True)
+        self.merge_thread.start()
+
+    def stop(self, timeout=2.0):
+        self.running = False
+        for device in self.devices:
+            cancel_read = getattr(getattr(device.source, 'serial_port', None), 'cancel_read', None)
+            if cancel_read is not None:
+                cancel_read()
+        for device in self.devices:
+            if device.thread is not None:
+                device.thread.join(timeout)
+        self.queue.put(None)
+        if self.merge_thread is not None:
+            self.merge_thread.join(timeout)
+
+    def join(self):
+        # Waits until all sources are exhausted (capture replay) and every packet was delivered
+        for device in self.devices:
+            device.thread.join()
+        self.stop()
+
+    def stats(self):
+        stats = []
+        for device in self.devices:
+            device_stats = {
+                'packets': device.packets,
+                'offset': device.clock.offset,
+                'drift_ppm': device.clock.drift * 1e6,
+                'finished': device.finished,
+            }
+            if device.metrics is not None:
+                device_stats.update((name, getattr(device.metrics, name)) for name in Metrics.COUNTERS)
+            stats.append(device_stats)
+        return stats
+
+    def _read(self, device):
+        source = device.source
+        try:
+            while self.running:
+                data = source.read_bytes()
+                if data:
+                    device.framer.feed_bytes(data)
+        except EOFError:
+            pass
+        finally:
+            # Marks the device finished once its packets queued before this are merged
+            self.queue.put((None, device.index, None))
+
+    def _on_frame(self, device, frame):
+        host_time = getattr(device.source, 'host_time', None)
+        if host_time is None:
+            host_time = time.time()
+        xbus_data = XsDataPacket()
+        device.parser.parse_data_packet(frame, xbus_data)
+        if device.metrics is not None:
+            device.metrics.packet_parsed(xbus_data)
+        if self.time_source == 'utc' and xbus_data.utcTimeAvailable:
+            aligned_time = xbus_data.utcTime
+        elif xbus_data.sampleTimeFineAvailable:
+            aligned_time = device.clock.update(xbus_data.sampleTimeFine, host_time)
+        else:
+            aligned_time = host_time
+        # The clock is refitted with every sample, early on that can map a sample before the previous
+        # one. The merge releases up to the oldest device's latest time, so a device's times must not go back.
+        if device.aligned_time is not None and aligned_time < device.aligned_time:
+            aligned_time = device.aligned_time
+        device.aligned_time = aligned_time
+        device.packets += 1
+        self.queue.put((aligned_time, device.index, xbus_data))
+
+    def _merge(self):
+        heap = []
+        sequence = 0
+        while True:
+            try:
+                item = self.queue.get(timeout=self.max_wait)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            now = time.monotonic()
+            if item:
+                aligned_time, index, xbus_data = item
+                device = self.devices[index]
+                if xbus_data is None:
+                    device.finished = True
+                else:
+                    device.latest_time = aligned_time
+                    device.latest_wall = now
+                    heapq.heappush(heap, (aligned_time, sequence, index, xbus_data))
+                    sequence += 1
+
+            # Only devices that are still sending hold packets back
+            waiting = [device.latest_time for device in self.devices
+                       if not device.finished and now - device.latest_wall < self.max_wait]
+            if None in waiting:
+                # A device hasn't sent its first packet yet
+                continue
+            watermark = min(waiting) if waiting else float('inf')
+            while heap and heap[0][0] <= watermark:
+                aligned_time, _, index, xbus_data = heapq.heappop(heap)
+                self.on_packet(index, aligned_time, xbus_data)
+
+        while heap:
+            aligned_time, _, index, xbus_data = heapq.heappop(heap)
+            self.on_packet(index, aligned_time, xbus_data)
@@ -21,6 +21,18 @@ class SerialHandler:
         except Exception as e:
             print(f"Error reading byte: {e}")
 
+    def read_bytes(self, max_bytes=4096):
+        # One read for everything already waiting in the OS buffer, blocks for at least one byte
+        try:
+            data = self.serial_port.read(max(1, min(self.serial_port.in_waiting, max_bytes)))
+            if not data:
+                raise RuntimeError("Failed to read from the serial port.")
+            return data
+        except serial.SerialTimeoutException:
+            print("Read timeout occurred.")
+        except Exception as e:
+            print(f"Error reading bytes: {e}")
+
     def send_bytes(self, bytes_data):
         # Debugging: Print the bytes in hex format
         print("Sending bytes:", " ".join(f"{byte:02X}" for byte in bytes_data))
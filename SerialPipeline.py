@@ -0,0 +1,125 @@
+import queue
+import threading
+
+from DataPacketParser import DataPacketParser, PacketParser, XsDataPacket
+from NativeFramer import make_framer
+
+
+class SerialPipeline:
+    # Reads and frames on its own thread so the UART is always drained, parsing and the
+    # on_packet callback (e.g. CsvLogger.write) run on a second thread.
+    # Frames are passed through a bounded queue, when the consumer falls behind new frames
+    # are dropped and counted instead of blocking the reader.
+    def __init__(self, serial, on_packet, queue_size=4096, on_bytes=None, reuse_packet=False, metrics=None,
+                 parser=DataPacketParser, framer=None):
+        # on_bytes(data) is called on the reader thread with every raw chunk, e.g. CaptureWriter.write
+        # With reuse_packet the same XsDataPacket is passed to every on_packet call, so on_packet
+        # must not keep a reference to it (CsvLogger.write copies the values)
+        # metrics (Metrics.Metrics) is attached to the framer and the parser (parser.metrics) and gets the
+        # stage latencies, so one device's counters aren't mixed with another pipeline's
+        # parser is anything with parse_data_packet(frame, xbus_data), e.g. a LayoutParser
+        # framer is an XbusPacket to feed instead of a new one (NativeFramer.make_framer(), the native framer
+        # when it's built), its MTData2 frames go to the queue while other handlers (e.g. a CommandChannel's)
+        # stay attached. self.framer is the one that gets the bytes.
+        self.serial = serial
+        self.on_packet = on_packet
+        self.on_bytes = on_bytes
+        if metrics is not None:
+            if parser is DataPacketParser:
+                parser = PacketParser()
+            parser.metrics = metrics
+        self.parser = parser
+        self.packet = XsDataPacket() if reuse_packet else None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.framer = make_framer() if framer is None else framer
+        self.framer.on_data_available = self._on_frame
+        self.metrics = metrics
+        if metrics is not None:
+            self.framer.metrics = metrics
+        self.running = False
+        self.reader_thread = None
+        self.consumer_thread = None
+
+        self.bytes_read = 0
+        self.frames_queued = 0
+        self.frames_dropped = 0
+        self.packets_parsed = 0
+        self.consumer_errors = 0
+        self.queue_high_water = 0
+
+    def start(self):
+        self.running = True
+        self.consumer_thread = threading.Thread(target=self._consume, name='xbus-consumer', daemon=True)
+        self.reader_thread = threading.Thread(target=self._read, name='xbus-reader', daemon=True)
+        self.consumer_thread.start()
+        self.reader_thread.start()
+
+    def stop(self, timeout=2.0):
+        # Stops reading, the consumer finishes the frames already queued
+        self.running = False
+        cancel_read = getattr(self.serial.serial_port, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
+        if self.reader_thread is not None:
+            self.reader_thread.join(timeout)
+        self.queue.put(None)
+        if self.consumer_thread is not None:
+            self.consumer_thread.join(timeout)
+
+    def stats(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'frames_queued': self.frames_queued,
+            'frames_dropped': self.frames_dropped,
+            'packets_parsed': self.packets_parsed,
+            'consumer_errors': self.consumer_errors,
+            'queue_size': self.queue.qsize(),
+            'queue_high_water': self.queue_high_water,
+        }
+
+    def _read(self):
+        while self.running:
+            data = self.serial.read_bytes()
+            if data:
+                self.bytes_read += len(data)
+                if self.on_bytes is not None:
+                    self.on_bytes(data)
+                self.framer.feed_bytes(data)
+
+    def _on_frame(self, frame):
+        # The framer's memoryview is only valid during the callback, the queue gets a copy
+        try:
+            self.queue.put_nowait((bytes(frame), self.framer.frame_ns))
+        except queue.Full:
+            self.frames_dropped += 1
+            if self.metrics is not None:
+                self.metrics.frames_dropped += 1
+            return
+        self.frames_queued += 1
+        size = self.queue.qsize()
+        if size > self.queue_high_water:
+            self.queue_high_water = size
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, frame_ns = item
+            try:
+                xbus_data = self.packet
+                if xbus_data is None:
+                    xbus_data = XsDataPacket()
+                else:
+                    xbus_data.reset()
+                self.parser.parse_data_packet(frame, xbus_data)
+                self.packets_parsed += 1
+                if self.metrics is None:
+                    self.on_packet(xbus_data)
+                else:
+                    parsed_ns = self.metrics.packet_parsed(xbus_data, frame_ns)
+                    self.on_packet(xbus_data)
+                    self.metrics.packet_sunk(parsed_ns)
+            except Exception as e:
+                self.consumer_errors += 1
+                print(f"Error handling packet: {e}")
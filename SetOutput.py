@@ -1,7 +1,28 @@
 ### Ref: https://mtidocs.movella.com/messages
 ### You could also get this message from MT Manager - Device Data View, select "SetOutputConfiguration", then click "edit" to select some message
 
-def set_output_conf(serial):
+option1_gnssins_quat_400hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF 50 42 01 90 50 22 01 90 D0 12 01 90'
+option2_gnssins_euler_400hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF 50 42 01 90 50 22 01 90 D0 12 01 90'
+option3_gnssins_euler_100hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF 50 42 00 64 50 22 FF FF D0 12 00 64'
+option4_gnssins_euler_pvt_100hz = 'FA FF C0 34 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF 50 42 00 64 50 22 FF FF D0 12 00 64 70 10 FF FF '
+option5_ahrs_quat_400hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 10 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF'
+option6_ahrs_euler_400hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF'
+option7_ahrs_euler_100hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF'
+option8_ahrs_quat_100hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 10 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF'
+
+# Examples above by short name, e.g. for the benchmark and the packet generator
+OUTPUT_CONFIGURATIONS = {
+    'option1': option1_gnssins_quat_400hz,
+    'option2': option2_gnssins_euler_400hz,
+    'option3': option3_gnssins_euler_100hz,
+    'option4': option4_gnssins_euler_pvt_100hz,
+    'option5': option5_ahrs_quat_400hz,
+    'option6': option6_ahrs_euler_400hz,
+    'option7': option7_ahrs_euler_100hz,
+    'option8': option8_ahrs_quat_100hz,
+}
+
+def set_output_conf(serial, configuration=option4_gnssins_euler_pvt_100hz):
     """Configures the Imu to the following:
     example1. configure for MTi-680(GNSS/INS)
     FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FF 20 10 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF 50 42 01 90 50 22 01 90 D0 12 01 90
@@ -39,14 +60,6 @@ def set_output_conf(serial):
     example7 configuration for MTi-630 or MTi-3(AHRS), 100Hz, packetCounter + sampleTimeFine + Quaternion + Acc + FreeAcc + RateOfTurn + MagneticField + StatusWord
     FA FF C0 20 10 20 FF FF 10 60 FF FF 20 10 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF
     """
-    option1_gnssins_quat_400hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF 50 42 01 90 50 22 01 90 D0 12 01 90'
-    option2_gnssins_euler_400hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF 50 42 01 90 50 22 01 90 D0 12 01 90'
-    option3_gnssins_euler_100hz = 'FA FF C0 30 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF 50 42 00 64 50 22 FF FF D0 12 00 64'
-    option4_gnssins_euler_pvt_100hz = 'FA FF C0 34 10 20 FF FF 10 60 FF FF 10 10 FF FE 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF 50 42 00 64 50 22 FF FF D0 12 00 64 70 10 FF FF '
-    option5_ahrs_quat_400hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 10 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF'
-    option6_ahrs_euler_400hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 30 01 90 40 20 01 90 40 30 01 90 80 20 01 90 C0 20 00 64 E0 20 FF FF'
-    option7_ahrs_euler_100hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 30 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF'
-    option8_ahrs_quat_100hz = 'FA FF C0 20 10 20 FF FF 10 60 FF FF 20 10 00 64 40 20 00 64 40 30 00 64 80 20 00 64 C0 20 00 64 E0 20 FF FF'
-
-    serial.send_with_checksum(bytes.fromhex(option4_gnssins_euler_pvt_100hz))
+
+    serial.send_with_checksum(bytes.fromhex(configuration))
 
@@ -0,0 +1,221 @@
+import time
+from multiprocessing import shared_memory
+from struct import Struct
+
+import numpy as np
+
+from columnar_logging import COLUMNS, schema_from_data_ids
+
+
+_MAGIC = 0x42525858  # 'XXRB'
+_MAX_DATA_IDS = 32
+# magic, capacity, record size, number of data ids, head (sequence number of the newest record), data ids
+_header = Struct(f'<IIIIQ{_MAX_DATA_IDS}H')
+_head = Struct('<Q')
+_HEADER_SIZE = 128
+_FORMATS = {np.uint16: 'H', np.uint32: 'I', np.float32: 'f', np.float64: 'd'}
+
+
+def record_dtype(data_ids):
+    # Record of one packet: seq (1, 2, ...), the XsDataPacket.present bits and one field per column,
+    # missing floats are NaN as in ColumnarLogger
+    fields = [('seq', '<u8'), ('present', '<u4')]
+    for name, dtype, width, _ in schema_from_data_ids(data_ids):
+        fields.append((name, np.dtype(dtype).newbyteorder('<')) if width == 1 else (name, np.dtype(dtype).newbyteorder('<'), (width,)))
+    return np.dtype(fields)
+
+
+def normalize_data_ids(data_ids):
+    # Known data ids in order, all of them for None
+    return list(COLUMNS) if data_ids is None else [data_id for data_id in data_ids if data_id in COLUMNS]
+
+
+class RecordPacker:
+    # Packs XsDataPackets into records of record_dtype(data_ids) with a single Struct.pack_into
+    def __init__(self, data_ids):
+        self.dtype = record_dtype(data_ids)
+        fmt = '<QI'
+        self.fields = []
+        for name, dtype, width, bit in schema_from_data_ids(data_ids):
+            fmt += f'{width}{_FORMATS[dtype]}'
+            missing = (float('nan') if np.dtype(dtype).kind == 'f' else 0,) * width
+            self.fields.append((name, width, bit, missing))
+        self.struct = Struct(fmt)
+        assert self.struct.size == self.dtype.itemsize
+        self.size = self.struct.size
+
+    def values(self, data):
+        # Field values of an XsDataPacket in record order, missing fields as NaN or 0
+        present = data.present
+        values = []
+        for name, width, bit, missing in self.fields:
+            if not present & bit:
+                values += missing
+            elif width == 1:
+                values.append(getattr(data, name))
+            else:
+                values += getattr(data, name)
+        return values
+
+    def pack_into(self, buffer, offset, seq, data):
+        self.struct.pack_into(buffer, offset, seq, data.present, *self.values(data))
+
+
+# Blocks created by RingPublishers of this process
+_published = set()
+
+
+def _open_shared_memory(name):
+    # Attaching must not unlink the block when this process exits, that's up to the publisher
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attached block with the resource tracker
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name not in _published:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class RingPublisher:
+    # Writes decoded packets as fixed size records into a multiprocessing.shared_memory ring
+    # for other processes on the same machine, see RingSubscriber.
+    # The writer never waits for readers: every slot has a sequence number that is cleared before
+    # the record is written and set afterwards, readers use it to detect records that were
+    # overwritten while they copied them. The newest sequence number is in the header.
+    def __init__(self, name, capacity=4096, data_ids=None):
+        # data_ids selects the fields, all known fields by default
+        data_ids = normalize_data_ids(data_ids)
+        if len(data_ids) > _MAX_DATA_IDS:
+            raise ValueError(f"At most {_MAX_DATA_IDS} data ids fit in the ring header.")
+        self.packer = RecordPacker(data_ids)
+        self.dtype = self.packer.dtype
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER_SIZE + capacity * self.dtype.itemsize)
+        self.name = self.shm.name
+        _published.add(self.name)
+        _header.pack_into(self.shm.buf, 0, _MAGIC, capacity, self.dtype.itemsize, len(data_ids), 0,
+                          *data_ids, *[0] * (_MAX_DATA_IDS - len(data_ids)))
+        self.seq = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        # data is an XsDataPacket, the values are copied so the packet can be reused
+        seq = self.seq + 1
+        buf = self.shm.buf
+        offset = _HEADER_SIZE + (seq % self.capacity) * self.packer.size
+        # Cleared sequence number marks the slot as being written
+        _head.pack_into(buf, offset, 0)
+        self.packer.pack_into(buf, offset, 0, data)
+        _head.pack_into(buf, offset, seq)
+        _head.pack_into(buf, 16, seq)
+        self.seq = seq
+
+    def close(self, unlink=True):
+        if self.shm is None:
+            return
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        _published.discard(self.name)
+        self.shm = None
+
+
+class RingSubscriber:
+    # Reads a RingPublisher's ring from another process. latest() returns the newest record,
+    # read() every record since the previous read(). Records come back as numpy structured arrays
+    # with the field names of XsDataPacket. When the reader falls more than the ring's capacity
+    # behind, the overwritten records are skipped and counted in lost.
+    def __init__(self, name):
+        self.shm = _open_shared_memory(name)
+        magic, capacity, record_size, count, _, *data_ids = _header.unpack_from(self.shm.buf, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{name} is not a packet ring.")
+        self.dtype = record_dtype(data_ids[:count])
+        if self.dtype.itemsize != record_size:
+            raise ValueError(f"Record size of {name} doesn't match its fields.")
+        self.capacity = capacity
+        self.records = np.ndarray((capacity,), dtype=self.dtype, buffer=self.shm.buf, offset=_HEADER_SIZE)
+        # Start with the records written from now on
+        self.seq = self.head()
+        self.lost = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def head(self):
+        # Sequence number of the newest record, 0 before the first one
+        return _head.unpack_from(self.shm.buf, 16)[0]
+
+    def latest(self):
+        # Copy of the newest record, None before the first one
+        while True:
+            seq = self.head()
+            if seq == 0:
+                return None
+            slot = seq % self.capacity
+            record = self.records[slot].copy()
+            # seq is copied first, so it's read again from the ring: a record that was overwritten
+            # while copying has a newer (or cleared) sequence number by now
+            if record['seq'] == seq and self.records['seq'][slot] == seq:
+                return record
+            # Overwritten while copying, the head has moved on
+
+    def read(self, max_records=None):
+        # Copies of the records since the last read(), oldest first
+        head = self.head()
+        first = self.seq + 1
+        if head - first + 1 > self.capacity:
+            # Keep a margin of one slot, the writer may be filling the oldest one
+            skipped = head - self.capacity + 2 - first
+            self.lost += skipped
+            first += skipped
+        if max_records is not None:
+            head = min(head, first + max_records - 1)
+        if head < first:
+            return self.records[:0].copy()
+
+        start = first % self.capacity
+        end = head % self.capacity + 1
+        if start < end:
+            records = self.records[start:end].copy()
+            after = self.records['seq'][start:end].copy()
+        else:
+            records = np.concatenate((self.records[start:], self.records[:end]))
+            after = np.concatenate((self.records['seq'][start:], self.records['seq'][:end]))
+
+        # Records that were overwritten while copying have a newer (or cleared) sequence number.
+        # seq is the first field of a record, so it's checked again in the ring after the copy.
+        expected = np.arange(first, head + 1, dtype=np.uint64)
+        valid = (records['seq'] == expected) & (after == expected)
+        if not valid.all():
+            self.lost += int(len(valid) - valid.sum())
+            records = records[valid]
+        self.seq = head
+        return records
+
+    def wait(self, timeout=None, poll_interval=0.0002):
+        # Blocks until a record newer than the last read() is available, returns whether there is one
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.head() <= self.seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def close(self):
+        if self.shm is None:
+            return
+        # The numpy view has to go before the buffer can be released
+        self.records = None
+        self.shm.close()
+        self.shm = None
@@ -0,0 +1,455 @@
+import argparse
+import errno
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from struct import Struct
+
+import numpy as np
+
+from XbusPacket import XbusPacket
+from SharedRing import RecordPacker, normalize_data_ids, record_dtype
+
+
+_MAGIC = 0x54534258  # 'XBST'
+# Message kinds: fixed size records (see SharedRing.record_dtype) or Xbus frames as received
+RECORDS = 0
+RAW_FRAMES = 1
+# magic, message length, kind, number of data ids, number of samples, sequence number of the first sample,
+# send time (time.time()), followed by the data ids (uint16) and the samples
+_header = Struct('<IIBBHQd')
+_MAX_DATAGRAM = 65507
+
+_dtypes = {}
+
+
+def decode_message(message):
+    # (kind, first sequence number, send time, samples) of one message. samples is a numpy structured
+    # array with XsDataPacket field names for RECORDS, a list of frames (bytes) for RAW_FRAMES
+    magic, length, kind, count_ids, count, first_seq, sent = _header.unpack_from(message, 0)
+    if magic != _MAGIC or length != len(message):
+        raise ValueError("Not a stream message.")
+    pos = _header.size + 2 * count_ids
+    if kind == RECORDS:
+        data_ids = tuple(Struct(f'<{count_ids}H').unpack_from(message, _header.size))
+        dtype = _dtypes.get(data_ids)
+        if dtype is None:
+            dtype = _dtypes[data_ids] = record_dtype(data_ids)
+        samples = np.frombuffer(message, dtype=dtype, count=count, offset=pos)
+    else:
+        samples = []
+        for _ in range(count):
+            end = XbusPacket.payload_bounds(message, pos)[1] + 1
+            samples.append(bytes(message[pos:end]))
+            pos = end
+    return kind, first_seq, sent, samples
+
+
+class _Client:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        # Messages still to send, shared with every other client, the first one may be partly sent
+        self.queue = deque()
+        self.offset = 0
+        self.pending = 0
+        self.dropped = 0
+        self.writing = False
+
+
+class StreamServer:
+    # Streams packets to other hosts. Samples are batched, a message goes out every batch_size samples,
+    # max_bytes bytes or batch_interval seconds, whichever comes first. Each message is built once and
+    # the same bytes are sent to every UDP target and queued for every TCP client.
+    # With raw=False write(xbus_data) sends fixed size records of the data_ids fields (all known fields
+    # by default), with raw=True write_frame(frame) forwards the Xbus frames untouched.
+    # Sending to TCP clients happens on the server's thread with non-blocking sockets. A client that
+    # falls more than max_pending bytes behind loses its oldest queued messages, a UDP message that
+    # doesn't fit in the socket buffer is dropped, the serial reader is never blocked. Receive with StreamClient or decode_message().
+    def __init__(self, udp_targets=(), tcp_address=None, data_ids=None, raw=False, batch_size=8,
+                 batch_interval=0.01, max_bytes=1400, max_pending=1 << 20):
+        self.raw = raw
+        data_ids = [] if raw else normalize_data_ids(data_ids)
+        self.packer = None if raw else RecordPacker(data_ids)
+        self.ids = Struct(f'<{len(data_ids)}H').pack(*data_ids)
+        self.kind = RAW_FRAMES if raw else RECORDS
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+
+        self.lock = threading.Lock()
+        self.batch = bytearray()
+        self.count = 0
+        self.seq = 0
+        self.batch_started = 0.0
+
+        self.udp_targets = list(udp_targets)
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if self.udp_targets else None
+        if self.udp is not None:
+            # sendto runs on the caller's (serial reader) thread, a full socket buffer drops the message
+            self.udp.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ, 'wake')
+        self.listener = None
+        if tcp_address is not None:
+            self.listener = socket.create_server(tcp_address)
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ, 'accept')
+        self.clients = []
+        self.running = False
+        self.thread = None
+
+        self.messages_sent = 0
+        self.samples_sent = 0
+        self.udp_errors = 0
+        self.messages_dropped = 0
+
+    @property
+    def tcp_address(self):
+        return self.listener.getsockname() if self.listener is not None else None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='xbus-stream', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.flush()
+        self.running = False
+        self._wake()
+        if self.thread is not None:
+            self.thread.join(2.0)
+        for client in self.clients:
+            client.sock.close()
+        for sock in (self.listener, self.udp, self.wake_reader, self.wake_writer):
+            if sock is not None:
+                sock.close()
+        self.selector.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        return {
+            'messages_sent': self.messages_sent,
+            'samples_sent': self.samples_sent,
+            'udp_errors': self.udp_errors,
+            'tcp_clients': len(self.clients),
+            'messages_dropped': self.messages_dropped,
+        }
+
+    def write(self, data):
+        # XsDataPacket, packed right away so the packet can be reused
+        if self.packer is None:
+            raise TypeError("A raw StreamServer forwards frames, use write_frame(frame).")
+        with self.lock:
+            self.seq += 1
+            if not self.count:
+                self.batch_started = time.monotonic()
+            self.batch += self.packer.struct.pack(self.seq, data.present, *self.packer.values(data))
+            self._added()
+
+    def write_frame(self, frame):
+        with self.lock:
+            self.seq += 1
+            if not self.count:
+                self.batch_started = time.monotonic()
+            self.batch += frame
+            self._added()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _added(self):
+        self.count += 1
+        if (self.count >= self.batch_size or len(self.batch) >= self.max_bytes
+                or time.monotonic() - self.batch_started >= self.batch_interval):
+            self._flush()
+
+    def _flush(self):
+        # Called with the lock held
+        if not self.count:
+            return
+        length = _header.size + len(self.ids) + len(self.batch)
+        message = _header.pack(_MAGIC, length, self.kind, len(self.ids) // 2, self.count,
+                               self.seq - self.count + 1, time.time()) + self.ids + self.batch
+        self.messages_sent += 1
+        self.samples_sent += self.count
+        self.batch = bytearray()
+        self.count = 0
+
+        if self.udp is not None:
+            if length > _MAX_DATAGRAM:
+                self.udp_errors += len(self.udp_targets)
+            else:
+                for target in self.udp_targets:
+                    try:
+                        self.udp.sendto(message, target)
+                    except (BlockingIOError, InterruptedError):
+                        self.messages_dropped += 1
+                    except OSError as e:
+                        if e.errno == errno.ENOBUFS:
+                            self.messages_dropped += 1
+                        else:
+                            self.udp_errors += 1
+
+        if self.clients:
+            for client in self.clients:
+                client.queue.append(message)
+                client.pending += length
+                # Drop the oldest whole messages, the first one may already be partly sent
+                while client.pending > self.max_pending and len(client.queue) > 2:
+                    client.pending -= len(client.queue[1])
+                    del client.queue[1]
+                    client.dropped += 1
+                    self.messages_dropped += 1
+            self._wake()
+
+    def _wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Already woken up
+            pass
+
+    def _run(self):
+        while self.running:
+            for key, mask in self.selector.select(self.batch_interval):
+                if key.data == 'wake':
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.data == 'accept':
+                    self._accept()
+                elif mask & selectors.EVENT_READ:
+                    # Clients don't send anything, a read means the connection closed
+                    try:
+                        closed = not key.data.sock.recv(4096)
+                    except BlockingIOError:
+                        closed = False
+                    except OSError:
+                        closed = True
+                    if closed:
+                        self._remove(key.data)
+
+            with self.lock:
+                if self.count and time.monotonic() - self.batch_started >= self.batch_interval:
+                    self._flush()
+            for client in list(self.clients):
+                self._send(client)
+
+    def _accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, address)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        with self.lock:
+            self.clients.append(client)
+
+    def _remove(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        self.selector.unregister(client.sock)
+        client.sock.close()
+
+    def _send(self, client):
+        while True:
+            with self.lock:
+                if not client.queue:
+                    break
+                message = client.queue[0]
+            try:
+                sent = client.sock.send(memoryview(message)[client.offset:])
+            except BlockingIOError:
+                break
+            except OSError:
+                self._remove(client)
+                return
+            client.offset += sent
+            if client.offset == len(message):
+                with self.lock:
+                    client.queue.popleft()
+                    client.pending -= len(message)
+                client.offset = 0
+
+        # Only ask for writability while there is something left to send
+        writing = bool(client.queue)
+        if writing != client.writing:
+            client.writing = writing
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self.selector.modify(client.sock, events, client)
+
+
+class StreamClient:
+    # Receives a StreamServer's messages, over UDP on udp_port or from a TCP server at tcp_address.
+    # receive() returns decode_message()'s (kind, first sequence number, send time, samples), or None
+    # after timeout seconds without data. lost counts samples missing from the sequence numbers.
+    def __init__(self, udp_port=None, tcp_address=None, timeout=1.0, host='0.0.0.0'):
+        if tcp_address is not None:
+            self.sock = socket.create_connection(tcp_address, timeout)
+            self.tcp = True
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+            self.sock.bind((host, udp_port or 0))
+            self.tcp = False
+        self.sock.settimeout(timeout)
+        self.buffer = bytearray()
+        self.next_seq = None
+        self.messages = 0
+        self.samples = 0
+        self.lost = 0
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def receive(self):
+        try:
+            message = self._receive_tcp() if self.tcp else self.sock.recv(_MAX_DATAGRAM)
+        except socket.timeout:
+            return None
+        if message is None:
+            return None
+        kind, first_seq, sent, samples = decode_message(message)
+        if self.next_seq is not None and first_seq > self.next_seq:
+            self.lost += first_seq - self.next_seq
+        self.next_seq = first_seq + len(samples)
+        self.messages += 1
+        self.samples += len(samples)
+        return kind, first_seq, sent, samples
+
+    def _receive_tcp(self):
+        # One length-prefixed message from the stream, None when the server closed the connection
+        buffer = self.buffer
+        while True:
+            if len(buffer) >= _header.size:
+                length = _header.unpack_from(buffer, 0)[1]
+                if len(buffer) >= length:
+                    message = bytes(buffer[:length])
+                    del buffer[:length]
+                    return message
+            data = self.sock.recv(1 << 16)
+            if not data:
+                return None
+            buffer += data
+
+    def close(self):
+        self.sock.close()
+
+
+def _percentile(values, p):
+    return float(np.percentile(values, p)) * 1e3 if values else float('nan')
+
+
+def self_check(option='option5', packets=20000, batch_size=8, rate=None):
+    # Streams generated packets over loopback UDP and TCP (records) and TCP (raw frames), checks
+    # the received samples against the sent ones and prints throughput and latency
+    from DataPacketParser import DataPacketParser, XsDataPacket
+    from PacketGenerator import PacketGenerator
+    from SetOutput import OUTPUT_CONFIGURATIONS
+
+    frames = PacketGenerator(OUTPUT_CONFIGURATIONS[option]).frames(packets)
+    parsed = []
+    for frame in frames:
+        xbus_data = XsDataPacket()
+        DataPacketParser.parse_data_packet(frame, xbus_data)
+        parsed.append(xbus_data)
+
+    ok = True
+    for raw in (False, True):
+        udp_client = None if raw else StreamClient(udp_port=0, host='127.0.0.1')
+        server = StreamServer(udp_targets=[] if raw else [('127.0.0.1', udp_client.port)],
+                              tcp_address=('127.0.0.1', 0), raw=raw, batch_size=batch_size)
+        server.start()
+        tcp_client = StreamClient(tcp_address=server.tcp_address)
+        while not server.clients:
+            time.sleep(0.001)
+
+        results = {}
+
+        def receive(name, client):
+            received = []
+            latencies = []
+            while client.samples + client.lost < packets:
+                message = client.receive()
+                if message is None:
+                    break
+                latencies.append(time.time() - message[2])
+                received.append(message[3])
+            results[name] = (received, latencies, client.lost)
+
+        clients = [('tcp', tcp_client)] + ([] if udp_client is None else [('udp', udp_client)])
+        threads = [threading.Thread(target=receive, args=client) for client in clients]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        for i in range(packets):
+            if raw:
+                server.write_frame(frames[i])
+            else:
+                server.write(parsed[i])
+            if rate:
+                delay = start + (i + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        server.flush()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        for name, (received, latencies, lost) in results.items():
+            if raw:
+                samples = [frame for message in received for frame in message]
+                match = samples == [frames[i] for i in range(len(samples))] if not lost else True
+            else:
+                samples = np.concatenate(received) if received else np.zeros(0)
+                match = len(samples) > 0 and bool(
+                    np.all(samples['packetCounter'] == [parsed[int(seq) - 1].packetCounter for seq in samples['seq']]))
+                if match and 'acc' in samples.dtype.names:
+                    expected = [parsed[int(seq) - 1].acc for seq in samples['seq']]
+                    match = bool(np.allclose(samples['acc'], np.array(expected, dtype=np.float32)))
+            ok = ok and match and len(samples) + lost == packets
+            print(f"{'raw' if raw else 'records':<8}{name}: {len(samples)} samples, {lost} lost, "
+                  f"{len(samples) / elapsed:.0f} samples/s, latency p50 {_percentile(latencies, 50):.2f} ms "
+                  f"p99 {_percentile(latencies, 99):.2f} ms, {'ok' if match else 'MISMATCH'}")
+        print(f"{'':<8}server: {server.stats()}")
+        server.close()
+        tcp_client.close()
+        if udp_client is not None:
+            udp_client.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loopback self check and throughput of the stream server.')
+    parser.add_argument('--option', default='option5', help='output configuration from SetOutput.OUTPUT_CONFIGURATIONS')
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None, help='packets per second, as fast as possible by default')
+    args = parser.parse_args()
+    if not self_check(args.option, args.packets, args.batch_size, args.rate):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
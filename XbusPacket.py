@@ -1,77 +1,175 @@
+from collections import deque
+from time import perf_counter_ns
+
+
 class XbusPacket:
-    def __init__(self, on_data_available=None):
+    # FA (preamble), FF (bus id), 36 (MTData2 message id)
+    PREAMBLE = b'\xfa\xff\x36'
+    BUS_PREAMBLE = b'\xfa\xff'
+    MTDATA2 = 0x36
+    # LEN 0xFF means a 2 byte extended length follows, payloads are never longer than this
+    EXTENDED_LENGTH = 0xFF
+    MAX_PAYLOAD_LENGTH = 2048
+    # Number of failed frames kept in failed_frames for inspection
+    FAILED_FRAME_SAMPLES = 8
+
+    def __init__(self, on_data_available=None, on_message=None):
+        # on_data_available gets MTData2 frames, on_message(frame) every other message id
+        # that has no handler in mid_handlers (acks, errors, configuration replies)
         self.on_data_available = on_data_available
+        self.on_message = on_message
+        self.mid_handlers = {}
+        # Optional Metrics.Metrics, counts bytes, frames, checksum failures and resyncs
+        self.metrics = None
+        # Checksum failures are counted, the last few failed frames are kept as (stream offset, bytes)
+        self.checksum_failures = 0
+        self.failed_frames = deque(maxlen=self.FAILED_FRAME_SAMPLES)
         self.reset()
 
     def reset(self):
-        self.buffer = []
-        self.expected_length = 0
-        self.length_valid = False
+        self.buffer = bytearray()
+        # Position of buffer[0] in the byte stream, and of the frame passed to the callback
+        self.stream_offset = 0
+        self.frame_offset = 0
+        # With metrics: when the current frame's chunk was read and when the frame was complete
+        self.read_ns = 0
+        self.frame_ns = 0
+
+    def set_mid_handler(self, mid, callback):
+        # Route frames with message id mid to callback(frame), None removes the handler
+        if callback is None:
+            self.mid_handlers.pop(mid, None)
+        else:
+            self.mid_handlers[mid] = callback
+
+    @staticmethod
+    def payload_bounds(frame, offset=0):
+        # (start, end) of the payload of the frame at offset, for standard and extended length frames
+        length = frame[offset + 3]
+        if length == XbusPacket.EXTENDED_LENGTH:
+            return offset + 6, offset + 6 + ((frame[offset + 4] << 8) | frame[offset + 5])
+        return offset + 4, offset + 4 + length
 
     def feed_byte(self, byte):
-        # Start a new packet when we see 0xFA
-        if len(self.buffer) == 0 and byte == b'\xfa':
-            self.buffer.append(byte)
-            return
-
-        # Expecting 0xFF after 0xFA
-        if len(self.buffer) == 1 and byte == b'\xff':
-            self.buffer.append(byte)
-            return
-
-        # Expecting 0x36 after 0xFA 0xFF
-        if len(self.buffer) == 2 and byte == b'\x36':
-            self.buffer.append(byte)
-            return
-
-        # We should now be expecting the data length
-        if len(self.buffer) == 3:
-            self.buffer.append(byte)
-            self.expected_length = byte[0]  # Get the data length as an integer
-            self.length_valid = True
-            return
-
-        # Now we're expecting data bytes
-        if self.length_valid and len(self.buffer) >= 4:
-            self.buffer.append(byte)
-
-            # Check if we have received all expected bytes
-            total_length = 3 + 1 + self.expected_length + 1  # Header + length + data + checksum
-            if len(self.buffer) == total_length:
-                # Validate checksum
-                # print("Packet is complete, current buffer:", " ".join(f"{b.hex().upper()}" for b in self.buffer))
-                if self.validate_checksum():
-                    self.on_data_available(self.buffer)
+        # Kept for backwards compatibility, feeding whole chunks with feed_bytes() is much faster
+        self.feed_bytes(byte)
+
+    def feed_bytes(self, data):
+        # Append a chunk of any size and hand every complete frame to its callback.
+        # The frame is a memoryview into the internal buffer and is only valid during the callback,
+        # copy it with bytes(frame) if it has to be kept. An exception from a callback is passed on,
+        # the frames up to and including that one are consumed and the rest stay buffered.
+        metrics = self.metrics
+        if metrics is not None:
+            read_ns = perf_counter_ns()
+            metrics.bytes_read += len(data)
+            metrics.chunks += 1
+        buffer = self.buffer
+        buffer += data
+        size = len(buffer)
+        pos = 0
+        view = memoryview(buffer)
+        try:
+            while True:
+                start = buffer.find(self.BUS_PREAMBLE, pos)
+                if start < 0:
+                    # Keep the last byte, it may be the preamble of the next frame
+                    if metrics is not None and size - 1 > pos:
+                        metrics.bytes_skipped += size - 1 - pos
+                    pos = max(pos, size - 1)
+                    break
+                if metrics is not None and start > pos:
+                    metrics.resyncs += 1
+                    metrics.bytes_skipped += start - pos
+
+                # Wait for the length byte
+                if start + 4 > size:
+                    pos = start
+                    break
+
+                length = buffer[start + 3]
+                if length != self.EXTENDED_LENGTH:
+                    end = start + 4 + length + 1  # Header + length + data + checksum
                 else:
-                    print("Checksum validation failed.")
-                self.reset()  # Reset for the next packet
-                return
+                    if start + 6 > size:
+                        pos = start
+                        break
+                    length = (buffer[start + 4] << 8) | buffer[start + 5]
+                    if length > self.MAX_PAYLOAD_LENGTH:
+                        # Not a real frame, look for the next preamble
+                        pos = start + 1
+                        continue
+                    end = start + 6 + length + 1
+                if end > size:
+                    pos = start
+                    break
+
+                # Every byte after the preamble including the checksum sums to 0, summed from the
+                # memoryview so the frame isn't copied
+                if sum(view[start + 1:end]) & 0xFF:
+                    self._checksum_failed(start, end)
+                    # The preamble may have been a data byte, rescan right after it
+                    pos = start + 1
+                    continue
 
-        # If we get here, the packet is still incomplete
-        # print("Packet not complete, current buffer:", " ".join(f"{b.hex().upper()}" for b in self.buffer))
+                frame = view[start:end]
+                self.frame_offset = self.stream_offset + start
+                # Past the frame before its callback runs, a callback that raises doesn't get it again
+                pos = end
+                try:
+                    mid = buffer[start + 2]
+                    if mid == self.MTDATA2:
+                        callback = self.on_data_available
+                        if metrics is not None:
+                            self.read_ns = read_ns
+                            self.frame_ns = metrics.frame_complete(read_ns)
+                    else:
+                        callback = self.mid_handlers.get(mid, self.on_message)
+                        if metrics is not None:
+                            metrics.messages += 1
+                    if callback is not None:
+                        callback(frame)
+                finally:
+                    frame.release()
+        finally:
+            view.release()
+            # Drop what was handled, also when a callback raised
+            if pos:
+                del buffer[:pos]
+                self.stream_offset += pos
+
+    def _checksum_failed(self, start, end):
+        self.checksum_failures += 1
+        self.failed_frames.append((self.stream_offset + start, bytes(self.buffer[start:end])))
+        if self.metrics is not None:
+            self.metrics.checksum_failures += 1
+        elif self.checksum_failures & (self.checksum_failures - 1) == 0:
+            # Only the 1st, 2nd, 4th, 8th, ... failure is reported, see failed_frames for the bytes
+            print(f"Checksum validation failed ({self.checksum_failures} frames so far).")
 
     def is_packet_complete(self):
-        # Ensure expected_length is an integer
-        return self.length_valid and len(self.buffer) == (3 + 1 + self.expected_length + 1)
+        # Whether the buffer starts with a whole frame. feed_bytes() passes complete frames on right away,
+        # kept for code written against the byte by byte framer.
+        buffer = self.buffer
+        if len(buffer) < 4 or buffer[:2] != self.BUS_PREAMBLE:
+            return False
+        if buffer[3] == self.EXTENDED_LENGTH and len(buffer) < 6:
+            return False
+        return len(buffer) > self.payload_bounds(buffer)[1]
 
     def compute_checksum(self, packet):
-        total = 0
-        for byte in packet[1:-1]:  # Start from the second byte till the second last byte
-            total += byte[0]  # Convert bytes to integer
-        return (-total) & 0xFF
+        # Start from the second byte till the second last byte. packet is bytes-like, or a list of
+        # 1 byte bytes objects as kept by the byte by byte framer.
+        if packet and isinstance(packet[0], bytes):
+            packet = b''.join(packet)
+        return (-sum(packet[1:-1])) & 0xFF
 
-    def validate_checksum(self):
-        if not self.is_packet_complete():
-            return False
-        # print("Validating checksum...")
-        checksum = self.compute_checksum(self.buffer)
-        #print the checksum in hex uppercase
-        # print("Checksum:", f"{checksum:02X}")
-        #return checksum == self.buffer[-1][0]
-        if checksum == self.buffer[-1][0]:
-            return True
-        else:
-            #print the self.buffer and checksum in hex uppercase
-            print("Checksum failed. Buffer:", " ".join(f"{b.hex().upper()}" for b in self.buffer))
-            print("Checksum:", f"{checksum:02X}")
-            return False
\ No newline at end of file
+    def validate_checksum(self, packet=None):
+        # packet defaults to the frame at the start of the buffer, False while it's incomplete
+        if packet is None:
+            if not self.is_packet_complete():
+                return False
+            packet = self.buffer[:self.payload_bounds(self.buffer)[1] + 1]
+        elif packet and isinstance(packet[0], bytes):
+            packet = b''.join(packet)
+        return self.compute_checksum(packet) == packet[-1]
@@ -0,0 +1,71 @@
+/*
+ * Counts the allocations of the Python memory allocators (PyMem_* and PyObject_*), used by benchmark.py
+ * for allocations per packet. Compiled and loaded with ctypes.PyDLL by benchmark.py, which keeps the
+ * GIL held during the calls as PyMem_SetAllocator requires.
+ * Build: cc -O2 -shared -fPIC -I<python include dir> -o alloc_counter.so alloc_counter.c
+ */
+#include <Python.h>
+
+static PyMemAllocatorEx original_mem;
+static PyMemAllocatorEx original_obj;
+static unsigned long long allocations;
+static int counting;
+
+static void *count_malloc(void *ctx, size_t size)
+{
+    PyMemAllocatorEx *original = ctx;
+    allocations++;
+    return original->malloc(original->ctx, size);
+}
+
+static void *count_calloc(void *ctx, size_t count, size_t size)
+{
+    PyMemAllocatorEx *original = ctx;
+    allocations++;
+    return original->calloc(original->ctx, count, size);
+}
+
+static void *count_realloc(void *ctx, void *ptr, size_t size)
+{
+    /* Growing a buffer in place or moving it is one more allocation too */
+    PyMemAllocatorEx *original = ctx;
+    allocations++;
+    return original->realloc(original->ctx, ptr, size);
+}
+
+static void count_free(void *ctx, void *ptr)
+{
+    PyMemAllocatorEx *original = ctx;
+    original->free(original->ctx, ptr);
+}
+
+/* Starts counting from 0, does nothing when already counting */
+void alloc_counter_start(void)
+{
+    if (counting)
+        return;
+    PyMemAllocatorEx hook;
+    PyMem_GetAllocator(PYMEM_DOMAIN_MEM, &original_mem);
+    PyMem_GetAllocator(PYMEM_DOMAIN_OBJ, &original_obj);
+    hook.malloc = count_malloc;
+    hook.calloc = count_calloc;
+    hook.realloc = count_realloc;
+    hook.free = count_free;
+    hook.ctx = &original_mem;
+    PyMem_SetAllocator(PYMEM_DOMAIN_MEM, &hook);
+    hook.ctx = &original_obj;
+    PyMem_SetAllocator(PYMEM_DOMAIN_OBJ, &hook);
+    allocations = 0;
+    counting = 1;
+}
+
+/* Restores the allocators, returns the number of allocations since alloc_counter_start */
+unsigned long long alloc_counter_stop(void)
+{
+    if (counting) {
+        PyMem_SetAllocator(PYMEM_DOMAIN_MEM, &original_mem);
+        PyMem_SetAllocator(PYMEM_DOMAIN_OBJ, &original_obj);
+        counting = 0;
+    }
+    return allocations;
+}
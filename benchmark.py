@@ -0,0 +1,163 @@
+import argparse
+import ctypes
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+from XbusPacket import XbusPacket
+from DataPacketParser import DataPacketParser, XsDataPacket
+from LayoutParser import LayoutParser
+from PacketGenerator import PacketGenerator
+from SetOutput import OUTPUT_CONFIGURATIONS
+from data_logging import CsvLogger, save_data_to_csv
+
+
+_counter = None
+
+
+def allocation_counter():
+    # alloc_counter.c compiled into a temporary folder and loaded, None when there is no C compiler
+    # or no Python headers. The library hooks the Python allocators and counts every allocation.
+    global _counter
+    if _counter is None:
+        _counter = False
+        folder = tempfile.mkdtemp(prefix='xbus_alloc_')
+        library = os.path.join(folder, 'alloc_counter.so')
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alloc_counter.c')
+        command = [os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC', '-I' + sysconfig.get_paths()['include'],
+                   '-o', library, source]
+        try:
+            subprocess.run(command, check=True, capture_output=True)
+            # PyDLL keeps the GIL held during the calls
+            counter = ctypes.PyDLL(library)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Allocations aren't counted, could not build alloc_counter.c: {e}")
+        else:
+            counter.alloc_counter_stop.restype = ctypes.c_ulonglong
+            _counter = counter
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return _counter or None
+
+
+def measure(run, packets, repeat=3):
+    # Best wall time of repeat runs, plus two extra runs for memory:
+    # allocs/packet counts every allocation made during the run (None without allocation_counter()),
+    # retained/packet the memory blocks still allocated after it (leaks, growing buffers).
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    allocations = None
+    counter = allocation_counter()
+    if counter is not None:
+        counter.alloc_counter_start()
+        try:
+            run()
+        finally:
+            allocations = counter.alloc_counter_stop()
+
+    blocks_before = sys.getallocatedblocks()
+    run()
+    retained = sys.getallocatedblocks() - blocks_before
+
+    return {
+        'packets_per_s': packets / best,
+        'us_per_packet': best / packets * 1e6,
+        'allocs_per_packet': None if allocations is None else allocations / packets,
+        'retained_per_packet': retained / packets,
+    }
+
+
+def bench_framer(stream, packets, chunk_size):
+    def run():
+        framer = XbusPacket(on_data_available=lambda frame: None)
+        for pos in range(0, len(stream), chunk_size):
+            framer.feed_bytes(stream[pos:pos + chunk_size])
+    return measure(run, packets)
+
+
+def bench_parser(frames, parser=DataPacketParser):
+    def run():
+        for frame in frames:
+            parser.parse_data_packet(frame, XsDataPacket())
+    return measure(run, len(frames))
+
+
+def bench_sinks(frames, sink_packets):
+    packets = []
+    for frame in frames[:sink_packets]:
+        xbus_data = XsDataPacket()
+        DataPacketParser.parse_data_packet(frame, xbus_data)
+        packets.append(xbus_data)
+
+    folder = tempfile.mkdtemp(prefix='xbus_bench_')
+    results = {}
+    try:
+        runs = [0]
+
+        def csv_logger():
+            runs[0] += 1
+            with CsvLogger(f'logger_{runs[0]}.csv', folder_name=folder) as logger:
+                for xbus_data in packets:
+                    logger.write(xbus_data)
+        results['CsvLogger'] = measure(csv_logger, len(packets))
+
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            def legacy():
+                runs[0] += 1
+                for xbus_data in packets:
+                    save_data_to_csv(xbus_data, f'legacy_{runs[0]}.csv')
+            results['save_data_to_csv'] = measure(legacy, len(packets), repeat=1)
+        finally:
+            os.chdir(cwd)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def print_result(name, result, rate, sensors):
+    budget = rate * sensors
+    allocs = result['allocs_per_packet']
+    allocs = 'n/a' if allocs is None else f'{allocs:.2f}'
+    print(f"  {name:<18} {result['packets_per_s']:>12.0f} pkt/s {result['us_per_packet']:>9.2f} us/pkt"
+          f" {allocs:>8} allocs/pkt {result['retained_per_packet']:>8.2f} retained/pkt"
+          f"  {budget / result['packets_per_s'] * 100:>6.1f}% of {sensors}x{rate} Hz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the framer, parser and sinks on generated packets.')
+    parser.add_argument('--options', nargs='*', default=list(OUTPUT_CONFIGURATIONS),
+                        help='output configurations from SetOutput.OUTPUT_CONFIGURATIONS')
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--sink-packets', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=4096, help='bytes per feed_bytes call')
+    parser.add_argument('--noise', type=float, default=0.0, help='probability of random bytes before a frame')
+    parser.add_argument('--corruption', type=float, default=0.0, help='probability of a flipped bit in a frame')
+    parser.add_argument('--rate', type=int, default=400, help='output rate per sensor for the budget column')
+    parser.add_argument('--sensors', type=int, default=1, help='number of sensors for the budget column')
+    args = parser.parse_args()
+
+    for option in args.options:
+        generator = PacketGenerator(OUTPUT_CONFIGURATIONS[option])
+        stream = generator.stream(args.packets, noise=args.noise, corruption=args.corruption)
+        frames = generator.frames(args.packets)
+        print(f"{option}: {len(frames[0])} byte frames, {len(stream)} bytes")
+        print_result('framer', bench_framer(stream, args.packets, args.chunk_size), args.rate, args.sensors)
+        print_result('parser', bench_parser(frames), args.rate, args.sensors)
+        print_result('layout parser', bench_parser(frames, LayoutParser.from_output_conf(OUTPUT_CONFIGURATIONS[option])),
+                     args.rate, args.sensors)
+        for name, result in bench_sinks(frames, args.sink_packets).items():
+            print_result(name, result, args.rate, args.sensors)
+
+
+if __name__ == '__main__':
+    main()
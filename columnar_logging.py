@@ -0,0 +1,249 @@
+import os
+import time
+
+import numpy as np
+
+from DataPacketParser import XsDataPacket
+from BatchDecoder import quat_to_euler
+
+
+# data id -> (column name, storage dtype, values per sample, presence bit in XsDataPacket.present)
+COLUMNS = {
+    0x1020: ('packetCounter', np.uint16, 1, XsDataPacket.PACKET_COUNTER),
+    0x1060: ('sampleTimeFine', np.uint32, 1, XsDataPacket.SAMPLE_TIME_FINE),
+    0x1010: ('utcTime', np.float64, 1, XsDataPacket.UTC_TIME),
+    0x2030: ('euler', np.float32, 3, XsDataPacket.EULER),
+    0x2010: ('quat', np.float32, 4, XsDataPacket.QUATERNION),
+    0x4020: ('acc', np.float32, 3, XsDataPacket.ACC),
+    0x4030: ('freeAcc', np.float32, 3, XsDataPacket.FREE_ACC),
+    0x8020: ('rot', np.float32, 3, XsDataPacket.ROT),
+    0xC020: ('mag', np.float32, 3, XsDataPacket.MAG),
+    0x5042: ('latlon', np.float64, 2, XsDataPacket.LATLON),
+    0x5022: ('altitude', np.float64, 1, XsDataPacket.ALTITUDE),
+    0xE020: ('statusWord', np.uint32, 1, XsDataPacket.STATUS_WORD),
+    0xD012: ('vel', np.float64, 3, XsDataPacket.VELOCITY),
+    0x0810: ('temperature', np.float32, 1, XsDataPacket.TEMPERATURE),
+    0x3010: ('baropressure', np.uint32, 1, XsDataPacket.BAROPRESSURE),
+    0x4010: ('deltaV', np.float32, 3, XsDataPacket.DELTA_V),
+    0x8030: ('deltaQ', np.float32, 4, XsDataPacket.DELTA_Q),
+}
+
+
+def data_ids_from_output_conf(conf):
+    # Data ids of a SetOutputConfiguration message (bytes or hex string), ids without a column are skipped
+    if isinstance(conf, str):
+        conf = bytes.fromhex(conf)
+    data_ids = [(conf[pos] << 8) | conf[pos + 1] for pos in range(4, 4 + conf[3], 4)]
+    return [data_id for data_id in data_ids if data_id in COLUMNS]
+
+
+def schema_from_data_ids(data_ids):
+    # [(column name, dtype, values per sample, presence bit), ...], the parser also fills euler from a quaternion
+    data_ids = list(data_ids)
+    if 0x2010 in data_ids and 0x2030 not in data_ids:
+        data_ids.append(0x2030)
+    return [COLUMNS[data_id] for data_id in data_ids if data_id in COLUMNS]
+
+
+class _NpzWriter:
+    # One compressed .npz per chunk in a directory, read back with load_npz_columns()
+    def __init__(self, path, schema):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.chunks = len([name for name in os.listdir(path) if name.endswith('.npz')])
+
+    def write(self, columns):
+        np.savez_compressed(os.path.join(self.path, f'chunk_{self.chunks:06d}.npz'), **columns)
+        self.chunks += 1
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter:
+    # Appends one row group per chunk, vector columns are stored as fixed size lists
+    def __init__(self, path, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        fields = [pa.field('present', pa.uint32())]
+        for name, dtype, width, _ in schema:
+            value_type = pa.from_numpy_dtype(np.dtype(dtype))
+            fields.append(pa.field(name, value_type if width == 1 else pa.list_(value_type, width)))
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, columns):
+        pa = self.pa
+        arrays = []
+        for field in self.schema:
+            values = columns[field.name]
+            if values.ndim == 1:
+                arrays.append(pa.array(values))
+            else:
+                arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1]))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _Hdf5Writer:
+    # One resizable dataset per column
+    def __init__(self, path, schema):
+        import h5py
+        self.file = h5py.File(path, 'a')
+        self.datasets = {}
+        for name, dtype, width, _ in [('present', np.uint32, 1, 0)] + schema:
+            if name in self.file:
+                self.datasets[name] = self.file[name]
+            else:
+                shape = (0,) if width == 1 else (0, width)
+                self.datasets[name] = self.file.create_dataset(name, shape=shape, maxshape=(None,) + shape[1:],
+                                                               dtype=dtype, chunks=True)
+
+    def write(self, columns):
+        for name, dataset in self.datasets.items():
+            values = columns[name]
+            start = dataset.shape[0]
+            dataset.resize(start + len(values), axis=0)
+            dataset[start:] = values
+
+    def close(self):
+        self.file.close()
+
+
+_WRITERS = {'npz': ('', _NpzWriter), 'parquet': ('.parquet', _ParquetWriter), 'hdf5': ('.h5', _Hdf5Writer)}
+
+
+class ColumnarLogger:
+    # Typed binary columns instead of CSV text, only for the data ids that are actually configured.
+    # Samples are collected in preallocated arrays and written as one chunk every chunk_rows rows
+    # or flush_interval seconds, and on close(). Floats of a field missing from a packet are NaN,
+    # the 'present' column holds the XsDataPacket.present bits of every row.
+    # format is 'npz' (a directory of chunk files, numpy only), 'parquet' (needs pyarrow)
+    # or 'hdf5' (needs h5py).
+    def __init__(self, filename, data_ids, folder_name='data_logging', format='npz',
+                 chunk_rows=4000, flush_interval=5.0):
+        if format not in _WRITERS:
+            raise ValueError(f"Unknown format {format}, use one of {', '.join(_WRITERS)}.")
+        self.schema = schema_from_data_ids(data_ids)
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+
+        os.makedirs(folder_name, exist_ok=True)
+        extension, writer = _WRITERS[format]
+        name = os.path.splitext(filename)[0]
+        self.path = os.path.join(folder_name, name + extension)
+        self.writer = writer(self.path, self.schema)
+
+        self.present = np.zeros(chunk_rows, dtype=np.uint32)
+        self.buffers = [(name, np.zeros((chunk_rows,) if width == 1 else (chunk_rows, width), dtype=dtype), bit)
+                        for name, dtype, width, bit in self.schema]
+        # Euler angles the parser derives from the quaternion are computed per chunk with quat_to_euler
+        columns = {name: values for name, values, _ in self.buffers}
+        if 'euler' in columns and 'quat' in columns:
+            self.euler_values = columns['euler']
+            self.quat_values = columns['quat']
+            self.derive_euler = np.zeros(chunk_rows, dtype=bool)
+        else:
+            self.derive_euler = None
+        self.row = 0
+        self.pending = []
+        self.pending_rows = 0
+        self.flushed_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        row = self.row
+        present = data.present
+        self.present[row] = present
+        if data.euler_pending and self.derive_euler is not None:
+            self.derive_euler[row] = True
+            present &= ~XsDataPacket.EULER
+        for name, values, bit in self.buffers:
+            if present & bit:
+                values[row] = getattr(data, name)
+            elif values.dtype.kind == 'f':
+                values[row] = np.nan
+            else:
+                values[row] = 0
+        self.row = row + 1
+        if self.row == self.chunk_rows or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def write_columns(self, columns):
+        # Whole decoded columns, e.g. from BatchDecoder.decode, rows without a present column count
+        # as having every given field
+        rows = len(next(iter(columns.values())))
+        if 'quat' in columns and 'euler' not in columns:
+            columns = dict(columns, euler=quat_to_euler(columns['quat']))
+        present_bits = 0
+        chunk = {}
+        for name, dtype, width, bit in self.schema:
+            if name in columns:
+                chunk[name] = np.asarray(columns[name], dtype=dtype)
+                present_bits |= bit
+            else:
+                shape = (rows,) if width == 1 else (rows, width)
+                chunk[name] = np.full(shape, np.nan if np.dtype(dtype).kind == 'f' else 0, dtype=dtype)
+        if 'present' in columns:
+            chunk['present'] = np.asarray(columns['present'], dtype=np.uint32)
+        else:
+            chunk['present'] = np.full(rows, present_bits, dtype=np.uint32)
+        self._take_rows()
+        self.pending.append(chunk)
+        self.pending_rows += rows
+        if self.pending_rows >= self.chunk_rows or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def _take_rows(self):
+        # Moves the rows collected by write() to the pending chunks
+        if self.row:
+            if self.derive_euler is not None:
+                rows = np.flatnonzero(self.derive_euler[:self.row])
+                if len(rows):
+                    self.euler_values[rows] = quat_to_euler(self.quat_values[rows])
+                    self.derive_euler[:self.row] = False
+            chunk = {'present': self.present[:self.row].copy()}
+            for name, values, _ in self.buffers:
+                chunk[name] = values[:self.row].copy()
+            self.pending.append(chunk)
+            self.pending_rows += self.row
+            self.row = 0
+
+    def flush(self):
+        self._take_rows()
+        if self.pending:
+            if len(self.pending) == 1:
+                columns = self.pending[0]
+            else:
+                columns = {name: np.concatenate([chunk[name] for chunk in self.pending]) for name in self.pending[0]}
+            self.writer.write(columns)
+            self.pending = []
+            self.pending_rows = 0
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        self.writer = None
+
+
+def load_npz_columns(path):
+    # All chunks of an npz log directory as one dict of columns
+    names = sorted(name for name in os.listdir(path) if name.endswith('.npz'))
+    chunks = []
+    for name in names:
+        with np.load(os.path.join(path, name)) as chunk:
+            chunks.append({key: chunk[key] for key in chunk.files})
+    if not chunks:
+        return {}
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
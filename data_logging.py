@@ -1,16 +1,10 @@
 import csv
 import os
+import time
 from datetime import datetime
 
-def save_data_to_csv(data, filename, log_position_velocity=True):
-    # Create the subfolder if it doesn't exist
-    folder_name = 'data_logging'
-    if not os.path.exists(folder_name):
-        os.makedirs(folder_name)
-
-    # Construct the full file path
-    file_path = os.path.join(folder_name, filename)
 
+def csv_headers(log_position_velocity=True):
     # Define headers based on the logging preference
     headers = [
         "packetCounter", "sampleTimeFine", "utcTime",
@@ -23,12 +17,71 @@ def save_data_to_csv(data, filename, log_position_velocity=True):
         "FreeAccX", "FreeAccY", "FreeAccZ",
         "BarometricPressure", "Temperature", "StatusWord"
     ]
-    
+
     if log_position_velocity:
         headers += [
             "Latitude", "Longitude", "Altitude",
             "VelocityEast", "VelocityNorth", "VelocityUp",
         ]
+    return headers
+
+
+def csv_row(data, log_position_velocity=True):
+    row = [
+        data.packetCounter if data.packetCounterAvailable else '',
+        data.sampleTimeFine if data.sampleTimeFineAvailable else '',
+        data.utcTime if data.utcTimeAvailable else '',
+        data.euler[0] if data.eulerAvailable else '',
+        data.euler[1] if data.eulerAvailable else '',
+        data.euler[2] if data.eulerAvailable else '',
+        data.quat[0] if data.quaternionAvailable else '',
+        data.quat[1] if data.quaternionAvailable else '',
+        data.quat[2] if data.quaternionAvailable else '',
+        data.quat[3] if data.quaternionAvailable else '',
+        data.rot[0] * data.rad2deg if data.rotAvailable else '',
+        data.rot[1] * data.rad2deg if data.rotAvailable else '',
+        data.rot[2] * data.rad2deg if data.rotAvailable else '',
+        data.acc[0] if data.accAvailable else '',
+        data.acc[1] if data.accAvailable else '',
+        data.acc[2] if data.accAvailable else '',
+        data.mag[0] if data.magAvailable else '',
+        data.mag[1] if data.magAvailable else '',
+        data.mag[2] if data.magAvailable else '',
+        data.deltaV[0] if data.deltaVAvailable else '',
+        data.deltaV[1] if data.deltaVAvailable else '',
+        data.deltaV[2] if data.deltaVAvailable else '',
+        data.deltaQ[0] if data.deltaQAvailable else '',
+        data.deltaQ[1] if data.deltaQAvailable else '',
+        data.deltaQ[2] if data.deltaQAvailable else '',
+        data.deltaQ[3] if data.deltaQAvailable else '',
+        data.freeAcc[0] if data.freeAccAvailable else '',
+        data.freeAcc[1] if data.freeAccAvailable else '',
+        data.freeAcc[2] if data.freeAccAvailable else '',
+        data.baropressure if data.baropressureAvailable else '',
+        data.temperature if data.temperatureAvailable else '',
+        data.statusWord if data.statusWordAvailable else ''
+    ]
+    if log_position_velocity:
+        row += [
+            data.latlon[0] if data.latlonAvailable else '',
+            data.latlon[1] if data.latlonAvailable else '',
+            data.altitude if data.altitudeAvailable else '',
+            data.vel[0] if data.velocityAvailable else '',
+            data.vel[1] if data.velocityAvailable else '',
+            data.vel[2] if data.velocityAvailable else ''
+        ]
+    return row
+
+
+def save_data_to_csv(data, filename, log_position_velocity=True):
+    # Opens and closes the file for every packet, use CsvLogger for continuous logging
+    # Create the subfolder if it doesn't exist
+    folder_name = 'data_logging'
+    if not os.path.exists(folder_name):
+        os.makedirs(folder_name)
+
+    # Construct the full file path
+    file_path = os.path.join(folder_name, filename)
 
     file_exists = os.path.isfile(file_path)
 
@@ -36,50 +89,80 @@ def save_data_to_csv(data, filename, log_position_velocity=True):
         writer = csv.writer(file)
 
         if not file_exists:
-            writer.writerow(headers)  # Write the header only if the file doesn't exist
-
-        row = [
-            data.packetCounter if data.packetCounterAvailable else '',
-            data.sampleTimeFine if data.sampleTimeFineAvailable else '',
-            data.utcTime if data.utcTimeAvailable else '',
-            data.euler[0] if data.eulerAvailable else '',
-            data.euler[1] if data.eulerAvailable else '',
-            data.euler[2] if data.eulerAvailable else '',
-            data.quat[0] if data.quaternionAvailable else '',
-            data.quat[1] if data.quaternionAvailable else '',
-            data.quat[2] if data.quaternionAvailable else '',
-            data.quat[3] if data.quaternionAvailable else '',
-            data.rot[0] * data.rad2deg if data.rotAvailable else '',
-            data.rot[1] * data.rad2deg if data.rotAvailable else '',
-            data.rot[2] * data.rad2deg if data.rotAvailable else '',
-            data.acc[0] if data.accAvailable else '',
-            data.acc[1] if data.accAvailable else '',
-            data.acc[2] if data.accAvailable else '',
-            data.mag[0] if data.magAvailable else '',
-            data.mag[1] if data.magAvailable else '',
-            data.mag[2] if data.magAvailable else '',
-            data.deltaV[0] if data.deltaVAvailable else '',
-            data.deltaV[1] if data.deltaVAvailable else '',
-            data.deltaV[2] if data.deltaVAvailable else '',
-            data.deltaQ[0] if data.deltaQAvailable else '',
-            data.deltaQ[1] if data.deltaQAvailable else '',
-            data.deltaQ[2] if data.deltaQAvailable else '',
-            data.deltaQ[3] if data.deltaQAvailable else '',
-            data.freeAcc[0] if data.freeAccAvailable else '',
-            data.freeAcc[1] if data.freeAccAvailable else '',
-            data.freeAcc[2] if data.freeAccAvailable else '',
-            data.baropressure if data.baropressureAvailable else '',
-            data.temperature if data.temperatureAvailable else '',
-            data.statusWord if data.statusWordAvailable else ''
-        ]
-        if log_position_velocity:
-            row += [
-                data.latlon[0] if data.latlonAvailable else '',
-                data.latlon[1] if data.latlonAvailable else '',
-                data.altitude if data.altitudeAvailable else '',
-                data.vel[0] if data.velocityAvailable else '',
-                data.vel[1] if data.velocityAvailable else '',
-                data.vel[2] if data.velocityAvailable else ''
-            ]
-
-        writer.writerow(row)  # Write the data row
+            writer.writerow(csv_headers(log_position_velocity))  # Write the header only if the file doesn't exist
+
+        writer.writerow(csv_row(data, log_position_velocity))  # Write the data row
+
+
+class CsvLogger:
+    # Same columns as save_data_to_csv, but the file stays open and rows are written in batches.
+    # Rows are flushed every flush_rows rows or flush_interval seconds, and on close(). The interval is
+    # only checked in write(), so when the stream stops the buffered rows stay in memory until the next
+    # write(), flush() or close().
+    # With max_bytes or max_duration (seconds) set, logging continues in a new file
+    # <name>_001.csv, <name>_002.csv, ... once the current one is full.
+    def __init__(self, filename, log_position_velocity=True, folder_name='data_logging',
+                 flush_rows=400, flush_interval=1.0, max_bytes=None, max_duration=None):
+        self.filename = filename
+        self.log_position_velocity = log_position_velocity
+        self.folder_name = folder_name
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+
+        os.makedirs(folder_name, exist_ok=True)
+        self.headers = csv_headers(log_position_velocity)
+        self.rows = []
+        self.file = None
+        self.file_index = 0
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _path(self):
+        if self.file_index == 0:
+            return os.path.join(self.folder_name, self.filename)
+        name, ext = os.path.splitext(self.filename)
+        return os.path.join(self.folder_name, f'{name}_{self.file_index:03d}{ext}')
+
+    def _open(self):
+        self.file_path = self._path()
+        file_exists = os.path.isfile(self.file_path)
+        self.file = open(self.file_path, mode='a', newline='')
+        self.writer = csv.writer(self.file)
+        if not file_exists:
+            self.writer.writerow(self.headers)  # Write the header only if the file doesn't exist
+        self.opened_at = time.monotonic()
+        self.flushed_at = self.opened_at
+
+    def write(self, data):
+        self.rows.append(csv_row(data, self.log_position_velocity))
+        if len(self.rows) >= self.flush_rows or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.file is None:
+            return
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+        self.file.flush()
+        self.flushed_at = time.monotonic()
+
+        if ((self.max_bytes is not None and self.file.tell() >= self.max_bytes) or
+                (self.max_duration is not None and self.flushed_at - self.opened_at >= self.max_duration)):
+            self.file.close()
+            self.file_index += 1
+            self._open()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
@@ -0,0 +1,401 @@
+import argparse
+import csv
+import json
+import math
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_logging import csv_headers, csv_row
+
+
+# Offline analysis of recorded sessions: packet loss from packetCounter, sample interval jitter
+# and clock drift from sampleTimeFine against utcTime, and min/max/mean/percentiles of every field.
+# A file is split into chunks (whole CSV lines or index ranges of a capture) that are summarised
+# in parallel worker processes, each holding one chunk at a time. The chunk summaries are merged
+# in order and kept in a sidecar <file>.analytics.json, so when a log has grown only the chunks
+# after the previously complete ones are read again.
+
+CHUNK_BYTES = 16 * 1024 * 1024      # CSV chunk size
+CHUNK_FRAMES = 50000                # capture chunk size
+CACHE_VERSION = 1
+QUANTILES = np.linspace(0.0, 1.0, 101)
+# Columns analysed as timing instead of as fields
+TIMING_COLUMNS = ('packetCounter', 'sampleTimeFine', 'utcTime')
+SKIPPED_COLUMNS = TIMING_COLUMNS + ('StatusWord',)
+TICKS_PER_SECOND = 10000.0          # sampleTimeFine runs at 10 kHz
+_TAIL_CHECK_BYTES = 4096
+
+
+def cache_path(path):
+    return path + '.analytics.json'
+
+
+def _tail_check(f, end):
+    # CRC of the last bytes of a chunk, tells whether a cached chunk still matches the file
+    start = max(0, end - _TAIL_CHECK_BYTES)
+    f.seek(start)
+    return zlib.crc32(f.read(end - start))
+
+
+# Chunks
+
+def csv_chunks(path, chunk_bytes=CHUNK_BYTES):
+    # Header columns and (start, end) byte ranges of whole lines. The boundaries only depend on
+    # the bytes before them, so they stay the same when the file grows. A last line without its
+    # newline is still being written and left for the next run.
+    with open(path, 'rb') as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        complete = len(header)
+        tail_end = size
+        while tail_end > len(header):
+            tail_start = max(len(header), tail_end - 64 * 1024)
+            f.seek(tail_start)
+            newline = f.read(tail_end - tail_start).rfind(b'\n')
+            if newline >= 0:
+                complete = tail_start + newline + 1
+                break
+            tail_end = tail_start
+        columns = next(csv.reader([header.decode()])) if header else []
+        chunks = []
+        start = len(header)
+        while start < complete:
+            if start + chunk_bytes >= complete:
+                end = complete
+            else:
+                f.seek(start + chunk_bytes - 1)
+                f.readline()
+                end = f.tell()
+            chunks.append((start, end))
+            start = end
+    return columns, chunks
+
+
+def capture_chunks(path, chunk_frames=CHUNK_FRAMES):
+    # (first frame, end frame, start, end) per chunk of chunk_frames indexed frames
+    from CaptureFile import CaptureReader
+    with CaptureReader(path) as reader:
+        offsets = np.asarray(reader.index['offset'], dtype=np.int64)
+        ends = offsets + np.asarray(reader.index['length'], dtype=np.int64)
+    return [(first, min(first + chunk_frames, len(offsets)), int(offsets[first]), int(ends[min(first + chunk_frames, len(offsets)) - 1]))
+            for first in range(0, len(offsets), chunk_frames)]
+
+
+def parse_csv_chunk(data, count):
+    # Rows of whole CSV lines as a (rows, count) float array, empty fields are NaN
+    rows = data.count(b'\n')
+    text = b'\n' + data.replace(b'\r', b'')
+    # Every empty field gets a value, then the lines are joined into one comma separated list
+    text = text.replace(b',,', b',nan,').replace(b',,', b',nan,')
+    text = text.replace(b'\n,', b'\nnan,').replace(b',\n', b',nan\n')
+    try:
+        values = np.fromstring(text[1:].replace(b'\n', b','), sep=',')
+    except ValueError:
+        values = None
+    if values is not None and values.size == rows * count:
+        return values.reshape(rows, count)
+
+    # Lines with a different number of fields or text, parsed one by one
+    table = np.full((rows, count), np.nan)
+    for i, row in enumerate(csv.reader(data.decode(errors='replace').splitlines())):
+        for j, value in enumerate(row[:count]):
+            try:
+                table[i, j] = float(value)
+            except ValueError:
+                pass
+    return table
+
+
+def decode_capture_chunk(path, first, last):
+    # Column names and (rows, columns) float array of the capture's frames [first, last),
+    # with the columns of the CSV logs
+    from CaptureFile import CaptureReader
+    from DataPacketParser import XsDataPacket
+    from LayoutParser import LayoutParser
+    columns = csv_headers(True)
+    parser = LayoutParser()
+    nan = float('nan')
+    with CaptureReader(path) as reader:
+        table = np.empty((last - first, len(columns)))
+        for row, i in enumerate(range(first, last)):
+            data = XsDataPacket()
+            parser.parse_data_packet(reader.frame(i), data)
+            table[row] = [nan if value == '' else value for value in csv_row(data, True)]
+    return columns, table
+
+
+# Summaries
+
+def _values_summary(values):
+    # Mergeable statistics of the non-NaN values, None when there are none
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    mean = float(values.mean())
+    return {
+        'count': int(len(values)),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': mean,
+        'm2': float(((values - mean) ** 2).sum()),
+        # Quantiles of every chunk, merged into approximate percentiles in the report
+        'parts': [[int(len(values)), np.quantile(values, QUANTILES).tolist()]],
+    }
+
+
+def _merge_values(a, b):
+    if a is None or b is None:
+        return a if b is None else b
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    return {
+        'count': count,
+        'min': min(a['min'], b['min']),
+        'max': max(a['max'], b['max']),
+        'mean': a['mean'] + delta * b['count'] / count,
+        'm2': a['m2'] + b['m2'] + delta * delta * a['count'] * b['count'] / count,
+        'parts': a['parts'] + b['parts'],
+    }
+
+
+def _timing_summary(counter, stf, utc):
+    # Loss, sample interval and drift statistics of consecutive rows. Intervals are divided by the
+    # packetCounter step, so a lost packet doesn't show up as jitter.
+    summary = {}
+    valid = ~np.isnan(counter)
+    summary['packets'] = int(valid.sum())
+    steps = np.diff(counter[valid].astype(np.int64)) & 0xFFFF
+    summary['gaps'] = int(((steps > 1) & (steps < 0x8000)).sum())
+    summary['missing'] = int((steps[(steps > 1) & (steps < 0x8000)] - 1).sum())
+    summary['duplicates'] = int((steps == 0).sum())
+    # A large jump back is a restart of the device, not loss
+    summary['resets'] = int((steps >= 0x8000).sum())
+
+    valid = ~np.isnan(stf)
+    ticks = np.diff(stf[valid].astype(np.int64)) & 0xFFFFFFFF
+    # Rows without a packetCounter count as one step
+    counter_steps = np.nan_to_num(np.diff(counter[valid]), nan=1.0).astype(np.int64) & 0xFFFF
+    usable = (counter_steps >= 1) & (counter_steps < 0x8000)
+    summary['interval'] = _values_summary(ticks[usable] / counter_steps[usable])
+
+    valid &= ~np.isnan(utc)
+    device = (np.diff(stf[valid].astype(np.int64)) & 0xFFFFFFFF) / TICKS_PER_SECOND
+    host = np.diff(utc[valid])
+    summary['device_seconds'] = float(device.sum())
+    summary['utc_seconds'] = float(host.sum())
+    return summary
+
+
+def _first_last(values):
+    valid = np.flatnonzero(~np.isnan(values))
+    if not len(valid):
+        return None, None
+    return float(values[valid[0]]), float(values[valid[-1]])
+
+
+def summarize(columns, table):
+    # Summary of one chunk, see merge()
+    index = {name: i for i, name in enumerate(columns)}
+    nan_column = np.full(len(table), np.nan)
+    timing = [table[:, index[name]] if name in index else nan_column for name in TIMING_COLUMNS]
+    ends = [_first_last(values) for values in timing]
+    return {
+        'rows': int(len(table)),
+        'head': [first for first, _ in ends],
+        'tail': [last for _, last in ends],
+        'timing': _timing_summary(*timing),
+        'fields': {name: _values_summary(table[:, i]) for name, i in index.items() if name not in SKIPPED_COLUMNS},
+    }
+
+
+def _merge_timing(a, b):
+    merged = {key: a[key] + b[key] for key in ('packets', 'gaps', 'missing', 'duplicates', 'resets', 'device_seconds', 'utc_seconds')}
+    merged['interval'] = _merge_values(a['interval'], b['interval'])
+    return merged
+
+
+def merge(a, b):
+    # Summary of chunk a followed by chunk b, including the step from a's last row to b's first
+    boundary = np.array([[np.nan if value is None else value for value in a['tail']],
+                         [np.nan if value is None else value for value in b['head']]])
+    step = _timing_summary(*boundary.T)
+    step['packets'] = 0  # both rows are counted in their chunks
+    timing = _merge_timing(_merge_timing(a['timing'], step), b['timing'])
+    fields = dict(a['fields'])
+    for name, values in b['fields'].items():
+        fields[name] = _merge_values(fields.get(name), values)
+    return {
+        'rows': a['rows'] + b['rows'],
+        'head': [first if first is not None else later for first, later in zip(a['head'], b['head'])],
+        'tail': [last if last is not None else earlier for earlier, last in zip(a['tail'], b['tail'])],
+        'timing': timing,
+        'fields': fields,
+    }
+
+
+def _summarize_job(job):
+    # Runs in a worker process: reads and summarises one chunk
+    kind, path, start, end, columns, first, last = job
+    if kind == 'csv':
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        summary = summarize(columns, parse_csv_chunk(data, len(columns)))
+        check = zlib.crc32(data[-_TAIL_CHECK_BYTES:])
+    else:
+        summary = summarize(*decode_capture_chunk(path, first, last))
+        with open(path, 'rb') as f:
+            check = _tail_check(f, end)
+    summary['check'] = check
+    return summary
+
+
+# Analysis
+
+def _load_cache(path, columns):
+    try:
+        with open(cache_path(path)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION or cache.get('columns') != columns:
+        return {}
+    return cache.get('chunks', {})
+
+
+def _save_cache(path, columns, chunks):
+    try:
+        with open(cache_path(path), 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'columns': columns, 'chunks': chunks}, f)
+    except OSError as e:
+        print(f"Could not write the analytics cache of {path}: {e}")
+
+
+def analyze(path, workers=None, chunk_bytes=CHUNK_BYTES, chunk_frames=CHUNK_FRAMES, cache=True):
+    # Merged summary of a CSV log (*.csv) or a raw capture (anything else), see report().
+    # workers is the number of processes, all cores by default, 1 runs in this process.
+    if path.endswith('.csv'):
+        columns, ranges = csv_chunks(path, chunk_bytes)
+        jobs = [('csv', path, start, end, columns, 0, 0) for start, end in ranges]
+    else:
+        columns = csv_headers(True)
+        jobs = [('capture', path, start, end, None, first, last) for first, last, start, end in capture_chunks(path, chunk_frames)]
+
+    cached = _load_cache(path, columns) if cache else {}
+    summaries = [None] * len(jobs)
+    todo = []
+    with open(path, 'rb') as f:
+        for i, job in enumerate(jobs):
+            summary = cached.get(f'{job[2]}:{job[3]}')
+            if summary is not None and summary['check'] == _tail_check(f, job[3]):
+                summaries[i] = summary
+            else:
+                todo.append(i)
+
+    workers = os.cpu_count() if workers is None else workers
+    if len(todo) > 1 and workers > 1:
+        with ProcessPoolExecutor(min(workers, len(todo))) as executor:
+            results = list(executor.map(_summarize_job, [jobs[i] for i in todo]))
+    else:
+        results = [_summarize_job(jobs[i]) for i in todo]
+    for i, summary in zip(todo, results):
+        summaries[i] = summary
+
+    if cache and todo:
+        _save_cache(path, columns, {f'{job[2]}:{job[3]}': summary for job, summary in zip(jobs, summaries)})
+
+    merged = None
+    for summary in summaries:
+        merged = summary if merged is None else merge(merged, summary)
+    if merged is None:
+        merged = summarize(columns, np.zeros((0, len(columns))))
+    merged['chunks'] = len(jobs)
+    merged['cached_chunks'] = len(jobs) - len(todo)
+    return merged
+
+
+def percentiles(values, q=(1, 50, 99)):
+    # Approximate percentiles from the quantiles of every chunk: each chunk's quantiles give a
+    # piecewise linear distribution, their count weighted sum is inverted at q
+    points = np.unique(np.concatenate([part[1] for part in values['parts']]))
+    cdf = sum(count * np.interp(points, quantiles, QUANTILES) for count, quantiles in values['parts']) / values['count']
+    return [float(value) for value in np.interp(np.asarray(q) / 100.0, cdf, points)]
+
+
+def _describe(values, scale=1.0):
+    std = math.sqrt(values['m2'] / values['count'])
+    p1, p50, p99 = percentiles(values)
+    return {
+        'count': values['count'],
+        'min': values['min'] * scale,
+        'mean': values['mean'] * scale,
+        'std': std * scale,
+        'p1': p1 * scale,
+        'p50': p50 * scale,
+        'p99': p99 * scale,
+        'max': values['max'] * scale,
+    }
+
+
+def report(summary):
+    # Plain numbers of a merged summary: loss, sample interval in milliseconds, drift in ppm
+    timing = summary['timing']
+    lost = timing['missing']
+    result = {
+        'rows': summary['rows'],
+        'chunks': summary.get('chunks', 1),
+        'cached_chunks': summary.get('cached_chunks', 0),
+        'gaps': timing['gaps'],
+        'lost': lost,
+        'loss': lost / (timing['packets'] + lost) if timing['packets'] + lost else 0.0,
+        'duplicates': timing['duplicates'],
+        'resets': timing['resets'],
+        'interval_ms': _describe(timing['interval'], 1000.0 / TICKS_PER_SECOND) if timing['interval'] else None,
+        'drift_ppm': None,
+        'utc_seconds': timing['utc_seconds'],
+        'fields': {name: _describe(values) for name, values in summary['fields'].items() if values is not None},
+    }
+    if timing['utc_seconds'] > 0:
+        result['drift_ppm'] = (timing['device_seconds'] - timing['utc_seconds']) / timing['utc_seconds'] * 1e6
+    return result
+
+
+def print_report(path, result):
+    print(f"{path}: {result['rows']} rows, {result['chunks']} chunks ({result['cached_chunks']} from cache)")
+    print(f"  packets lost: {result['lost']} ({result['loss']:.3%}) in {result['gaps']} gaps, "
+          f"{result['duplicates']} duplicates, {result['resets']} counter resets")
+    interval = result['interval_ms']
+    if interval is not None:
+        print(f"  sample interval [ms]: mean {interval['mean']:.4f}, jitter (std) {interval['std']:.4f}, "
+              f"min {interval['min']:.4f}, p1 {interval['p1']:.4f}, p50 {interval['p50']:.4f}, "
+              f"p99 {interval['p99']:.4f}, max {interval['max']:.4f}")
+    if result['drift_ppm'] is not None:
+        print(f"  sampleTimeFine drift against UTC: {result['drift_ppm']:+.2f} ppm over {result['utc_seconds']:.1f} s")
+    if result['fields']:
+        print(f"  {'field':<20}{'count':>10}{'min':>14}{'mean':>14}{'std':>14}{'p1':>14}{'p50':>14}{'p99':>14}{'max':>14}")
+        for name, values in result['fields'].items():
+            print(f"  {name:<20}{values['count']:>10}" + ''.join(
+                f"{values[key]:>14.6g}" for key in ('min', 'mean', 'std', 'p1', 'p50', 'p99', 'max')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packet loss, timing and field statistics of recorded sessions.")
+    parser.add_argument('paths', nargs='+', help="CSV logs (*.csv) or raw captures")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument('--no-cache', action='store_true', help="ignore and don't write the .analytics.json files")
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+    args = parser.parse_args()
+    results = {}
+    for path in args.paths:
+        results[path] = report(analyze(path, workers=args.workers, cache=not args.no_cache))
+        if not args.json:
+            print_report(path, results[path])
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,29 @@
 from SerialHandler import SerialHandler
-from XbusPacket import XbusPacket
-from DataPacketParser import DataPacketParser, XsDataPacket
-from SetOutput import set_output_conf
+from NativeFramer import make_framer
+from DataPacketParser import XsDataPacket
+from SetOutput import option4_gnssins_euler_pvt_100hz
 import time
-from data_logging import save_data_to_csv
+from data_logging import CsvLogger
+from SerialPipeline import SerialPipeline
+from CaptureFile import CaptureWriter
+from Metrics import Metrics
+from LayoutParser import LayoutParser
+from SharedRing import RingPublisher
+from CommandChannel import CommandChannel
+from StreamServer import StreamServer
+import os
 from datetime import datetime
 
-def on_live_data_available(packet, filename):
-    xbus_data = XsDataPacket() 
-    DataPacketParser.parse_data_packet(packet, xbus_data)
+# Reused for every packet, the logger copies the values it needs
+xbus_data = XsDataPacket()
+# Decodes packets of the sensor's output configuration with one unpack, learned from the first packets
+parser = LayoutParser()
+
+def on_live_data_available(packet, sink, metrics=None):
+    xbus_data.reset()
+    parser.parse_data_packet(packet, xbus_data)
+    if metrics is not None:
+        parsed_ns = metrics.packet_parsed(xbus_data)
 
     # if xbus_data.packetCounterAvailable:
     #     print(f"\npacketCounter: {xbus_data.packetCounter}, ", end='')
@@ -57,41 +72,110 @@ def on_live_data_available(packet, filename):
     # if xbus_data.deltaQAvailable:
     #     print(f"Delta Q: [{xbus_data.deltaQ[0]:.4f}, {xbus_data.deltaQ[1]:.4f}, {xbus_data.deltaQ[2]:.4f}, {xbus_data.deltaQ[3]:.4f}]")
     
-    save_data_to_csv(xbus_data, filename, log_position_velocity=False)
-
-
-def main():
+    sink(xbus_data)
+    if metrics is not None:
+        metrics.packet_sunk(parsed_ns)
+
+
+def main(use_pipeline=False, capture=False, metrics_interval=None, publish=None, stream_port=None, stream_targets=()):
+    # use_pipeline reads the serial port on its own thread, parsing and logging on another one
+    # capture also records the raw byte stream, it can be replayed later with CaptureFile.CaptureReader
+    # metrics_interval prints counters and stage latencies every metrics_interval seconds
+    # publish is the name of a shared memory ring other processes can read with SharedRing.RingSubscriber
+    # stream_port serves the packets over TCP, stream_targets [(host, port), ...] sends them over UDP,
+    # receive them with StreamServer.StreamClient
+    logger = None
+    capture_writer = None
+    pipeline = None
+    metrics = None
+    publisher = None
+    server = None
     try:
         serial = SerialHandler("COM21", 921600) ##change the port and baudrate to your own MTi's baudrate.
 
-        go_to_config = bytes.fromhex('FA FF 30 00')
-        go_to_measurement = bytes.fromhex('FA FF 10 00')
-
-        serial.send_with_checksum(go_to_config)
-        ###if you want to configure your sensor's output, check the set_output_conf function.
-        ##set_output_conf(serial)
-        time.sleep(0.1)  # Sleep for 0.1 sec
-        
-        packet = XbusPacket(on_data_available=lambda p: on_live_data_available(p, filename))
-        
         # Generate a timestamp-based filename
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'{timestamp}.csv'
-        
-        serial.send_with_checksum(go_to_measurement)
+        logger = CsvLogger(filename, log_position_velocity=False)
+        if capture:
+            capture_writer = CaptureWriter(os.path.join(logger.folder_name, f'{timestamp}.xbus'))
+
+        if metrics_interval:
+            metrics = Metrics()
+            parser.metrics = metrics
+            metrics.start_reporter(metrics_interval)
+
+        sinks = [logger.write]
+        if publish:
+            publisher = RingPublisher(publish)
+            sinks.append(publisher.write)
+        if stream_port or stream_targets:
+            server = StreamServer(stream_targets, ('', stream_port) if stream_port else None)
+            server.start()
+            sinks.append(server.write)
+
+        if len(sinks) == 1:
+            sink = sinks[0]
+        else:
+            def sink(data):
+                for write in sinks:
+                    write(data)
+
+        if use_pipeline:
+            pipeline = SerialPipeline(serial, on_packet=sink, reuse_packet=True,
+                                      on_bytes=capture_writer.write if capture_writer else None,
+                                      metrics=metrics, parser=parser)
+            # Replies have to come from the framer that gets the bytes
+            packet = pipeline.framer
+        else:
+            # The native framer when xbus_native.so is built, XbusPacket otherwise
+            packet = make_framer(on_data_available=lambda p: on_live_data_available(p, sink, metrics))
+            packet.metrics = metrics
+
+        # Each command waits for the device's acknowledgement instead of a fixed sleep
+        commands = CommandChannel(serial, packet, on_bytes=capture_writer.write if capture_writer else None)
+        commands.wait(commands.go_to_config())
+        ###if you want to configure your sensor's output, pass one of the configurations in SetOutput.py.
+        ##commands.wait(commands.set_output_configuration(option4_gnssins_euler_pvt_100hz))
+        commands.wait(commands.go_to_measurement())
         print("Listening for packets...")
 
-        while True:
-            try:
-                byte = serial.read_byte()
-                packet.feed_byte(byte)
-            except RuntimeError as e:
-                print(f"Error reading byte: {e}")
-                continue  # Skip to the next byte
+        if use_pipeline:
+            # From now on the pipeline's reader thread owns the port and feeds the framer, later commands
+            # get their replies from it instead of pumping
+            commands.pump = False
+            pipeline.start()
+            dropped = 0
+            while True:
+                time.sleep(1.0)
+                if pipeline.frames_dropped != dropped:
+                    dropped = pipeline.frames_dropped
+                    print(f"Consumer falling behind, dropped frames: {dropped}")
+        else:
+            while True:
+                # read_bytes() prints read errors and returns None, the next read is tried again
+                data = serial.read_bytes()
+                if data:
+                    if capture_writer is not None:
+                        capture_writer.write(data)
+                    packet.feed_bytes(data)
 
     except Exception as e:
         print(f"Error: {e}")
         return 1
+    finally:
+        if metrics is not None:
+            metrics.stop_reporter()
+        if pipeline is not None:
+            pipeline.stop()
+        if logger is not None:
+            logger.close()
+        if publisher is not None:
+            publisher.close()
+        if server is not None:
+            server.close()
+        if capture_writer is not None:
+            capture_writer.close()
 
 if __name__ == '__main__':
     main()
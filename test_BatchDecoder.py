@@ -0,0 +1,98 @@
+from struct import pack
+
+import numpy as np
+
+from BatchDecoder import BatchDecoder, layouts_from_output_conf
+from DataPacketParser import DataPacketParser, XsDataPacket
+from Metrics import Metrics
+from PacketGenerator import PacketGenerator, build_frame
+from SetOutput import option5_ahrs_quat_400hz
+from XbusPacket import XbusPacket
+from columnar_logging import COLUMNS
+
+
+def _per_packet(data):
+    packets = []
+
+    def on_frame(frame):
+        packets.append(XsDataPacket())
+        DataPacketParser.parse_data_packet(frame, packets[-1])
+
+    framer = XbusPacket(on_data_available=on_frame)
+    framer.metrics = Metrics()
+    framer.feed_bytes(data)
+    return packets
+
+
+def _check_rows(columns, fallback, packets):
+    # Batch rows and fallback packets in stream order against the per-packet parser,
+    # a fallback packet with row r came before batch row r
+    rows = len(columns['present'])
+    assert rows + len(fallback) == len(packets)
+    order = sorted([(row, 0, packet) for row, packet in fallback] + [(row, 1, None) for row in range(rows)],
+                   key=lambda entry: entry[:2])
+    for (row, batch, decoded), packet in zip(order, packets):
+        if not batch:
+            assert decoded.present == packet.present
+            continue
+        assert columns['present'][row] == packet.present
+        for name, _, _, bit in COLUMNS.values():
+            if packet.present & bit:
+                assert np.allclose(columns[name][row], getattr(packet, name), rtol=1e-6)
+            elif name in columns:
+                assert np.isnan(columns[name][row]).all()
+
+
+def test_mixed_rate_layouts():
+    # option5 sends mag in every fourth packet only
+    assert len(layouts_from_output_conf(option5_ahrs_quat_400hz)) == 2
+    data = PacketGenerator(option5_ahrs_quat_400hz).stream(4000, noise=0.01, corruption=0.01)
+    columns, fallback = BatchDecoder.from_output_conf(option5_ahrs_quat_400hz).decode(data)
+    assert fallback == []
+    assert np.isnan(columns['mag'][:, 0]).sum() > len(columns['mag']) // 2
+    _check_rows(columns, fallback, _per_packet(data))
+
+
+def test_decode_file_chunks(tmp_path):
+    # Frames split over chunk boundaries, and frames of a layout the decoder doesn't know
+    data = PacketGenerator(option5_ahrs_quat_400hz).stream(3000, noise=0.02, corruption=0.01)
+    path = tmp_path / 'capture.xbus'
+    path.write_bytes(data)
+    decoder = BatchDecoder(layouts_from_output_conf(option5_ahrs_quat_400hz)[0])
+    whole, whole_fallback = decoder.decode(data)
+    columns, fallback = decoder.decode_file(str(path), chunk_size=1000)
+    assert len(fallback) == len(whole_fallback) > 0
+    assert [row for row, _ in fallback] == [row for row, _ in whole_fallback]
+    for name in whole:
+        assert np.array_equal(columns[name], whole[name], equal_nan=True)
+
+
+def test_extended_length_layout():
+    # 12 items the parser doesn't know make the payload longer than a standard length frame
+    fillers = [(0xA001 + i, 20) for i in range(12)]
+    layout = ((0x1020, 2), (0x4020, 12)) + tuple(fillers)
+    frames = [build_frame(0x36, pack('>HBH', 0x1020, 2, i) + pack('>HB3f', 0x4020, 12, i, 0.5, 9.81) +
+                          b''.join(pack('>HB', data_id, size) + bytes([i & 0xFF]) * size for data_id, size in fillers))
+              for i in range(500)]
+    assert frames[0][3] == 0xFF
+    # A standard length frame of another layout, and a corrupted extended length frame
+    other = build_frame(0x36, pack('>HBH', 0x1020, 2, 1000))
+    corrupted = bytearray(frames[7])
+    corrupted[30] ^= 0x01
+    data = b''.join(frames[:5]) + other + b''.join(frames[5:7]) + bytes(corrupted) + b''.join(frames[8:])
+    decoder = BatchDecoder(layout)
+    columns, fallback = decoder.decode(data)
+    assert columns['packetCounter'].tolist() == [i for i in range(500) if i != 7]
+    assert columns['acc'][:, 0].tolist() == [float(i) for i in range(500) if i != 7]
+    assert (columns['data_A00C'][:, 0] == np.array([i & 0xFF for i in range(500) if i != 7])).all()
+    assert [(row, packet.packetCounter) for row, packet in fallback] == [(5, 1000)]
+    # Reported by the per-packet path, counted in the decoder's metrics
+    assert decoder.metrics.checksum_failures == 1
+
+
+def test_fallback_problems_counted(capsys):
+    data = PacketGenerator(option5_ahrs_quat_400hz).stream(2000, noise=0.02, corruption=0.02)
+    metrics = Metrics()
+    columns, _ = BatchDecoder.from_output_conf(option5_ahrs_quat_400hz, metrics=metrics).decode(data)
+    assert metrics.checksum_failures > 0
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,39 @@
+from struct import pack
+
+import numpy as np
+
+from CaptureFile import SessionReader
+from PacketGenerator import PacketGenerator, build_frame
+from SetOutput import option5_ahrs_quat_400hz
+
+
+def test_packet_counter_window_across_wrap(tmp_path):
+    path = tmp_path / 'session.xbus'
+    path.write_bytes(PacketGenerator(option5_ahrs_quat_400hz).stream(70000))
+    with SessionReader(str(path), every=1000) as reader:
+        assert (np.diff(reader.index['packetCounter']) > 0).all()
+        records = reader.records(65530, 65545, field='packetCounter')
+        assert records['packetCounter'].tolist() == list(range(65530, 65536)) + list(range(9))
+        records = reader.records(65536 + 100, 65536 + 103, field='packetCounter')
+        assert records['packetCounter'].tolist() == [100, 101, 102]
+
+
+def test_frames_without_counters(tmp_path):
+    # Every 4th frame has neither packetCounter nor sampleTimeFine, and some of them are indexed
+    frames = []
+    for i in range(5000):
+        items = b''
+        if i % 4:
+            items += pack('>HBH', 0x1020, 2, i & 0xFFFF) + pack('>HBI', 0x1060, 4, i * 25)
+        items += pack('>HB3f', 0x4020, 12, i, 0.0, 9.81)
+        frames.append(build_frame(0x36, items))
+    path = tmp_path / 'session.xbus'
+    path.write_bytes(b''.join(frames))
+    with SessionReader(str(path), every=10) as reader:
+        assert (reader.index['packetCounter'][::2] == -1).all()
+        assert (reader.index['sampleTimeFine'][1::2] >= 0).all()
+        # Frames without the field belong to the window of the frame before them
+        records = reader.records(3001, 3010, field='packetCounter')
+        assert records['acc'][:, 0].tolist() == list(range(3001, 3010))
+        records = reader.records(3001 * 25, 3010 * 25, field='sampleTimeFine')
+        assert records['acc'][:, 0].tolist() == list(range(3001, 3010))
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+from CommandChannel import (ERROR, GO_TO_CONFIG, GO_TO_MEASUREMENT, SET_OUTPUT_CONFIGURATION, CommandChannel,
+                            CommandError, build_message, wait_all)
+from PacketGenerator import PacketGenerator
+from SetOutput import option5_ahrs_quat_400hz
+from XbusPacket import XbusPacket
+
+
+class _FakeDevice:
+    # Stands in for SerialHandler: parses what is written to serial_port with a framer and answers
+    # every command with its acknowledgement (message id + 1, echoing the data), with an Error message
+    # for the ids in errors or not at all for the ids in silent. Measurement data is streamed in between.
+    def __init__(self, errors=(), silent=(), streaming=False):
+        self.serial_port = self
+        self.errors = set(errors)
+        self.silent = set(silent)
+        self.frames = PacketGenerator(option5_ahrs_quat_400hz).frames(4) if streaming else []
+        self.received = []
+        self.outgoing = bytearray()
+        self.framer = XbusPacket(on_message=self._on_command)
+
+    @property
+    def in_waiting(self):
+        return len(self.outgoing)
+
+    def read(self, size):
+        data = bytes(self.outgoing[:size])
+        del self.outgoing[:size]
+        return data
+
+    def write(self, data):
+        self.framer.feed_bytes(data + b'\x00')
+
+    def _on_command(self, frame):
+        mid = frame[2]
+        start, end = XbusPacket.payload_bounds(frame)
+        self.received.append(mid)
+        for data in self.frames:
+            self.outgoing += data
+        if mid in self.errors:
+            self.outgoing += build_message(ERROR, b'\x04')
+        elif mid not in self.silent:
+            self.outgoing += build_message(mid + 1, bytes(frame[start:end]))
+
+
+def test_acknowledgements():
+    device = _FakeDevice(streaming=True)
+    packets = []
+    framer = XbusPacket(on_data_available=lambda frame: packets.append(bytes(frame)))
+    channel = CommandChannel(device, framer)
+    configuration = bytes.fromhex(option5_ahrs_quat_400hz)
+    assert channel.call(GO_TO_CONFIG) == b''
+    assert wait_all([channel.set_output_configuration(option5_ahrs_quat_400hz), channel.go_to_measurement()]) == \
+        [configuration[4:4 + configuration[3]], b'']
+    assert device.received == [GO_TO_CONFIG, SET_OUTPUT_CONFIGURATION, GO_TO_MEASUREMENT]
+    assert channel.round_trip is not None and not channel.pending
+    # The data streamed next to the replies still reaches the framer's MTData2 callback
+    assert len(packets) == 12
+
+
+def test_error_fails_oldest_command():
+    device = _FakeDevice(errors={GO_TO_CONFIG})
+    channel = CommandChannel(device, XbusPacket())
+    failing = channel.go_to_config()
+    answered = channel.go_to_measurement()
+    with pytest.raises(CommandError) as error:
+        wait_all([failing, answered])
+    assert (error.value.mid, error.value.code) == (GO_TO_CONFIG, 0x04)
+    assert answered.result(timeout=0) == b''
+    assert not channel.pending
+
+
+def test_timeout():
+    device = _FakeDevice(silent={GO_TO_MEASUREMENT})
+    channel = CommandChannel(device, XbusPacket(), timeout=0.05)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        wait_all([channel.go_to_config(), channel.go_to_measurement()])
+    assert 0.05 <= time.monotonic() - started < 1.0
+    assert not channel.pending
+
+
+def test_expire():
+    channel = CommandChannel(_FakeDevice(), XbusPacket(), pump=False)
+    first = channel.go_to_config(timeout=1.0)
+    second = channel.go_to_measurement(timeout=10.0)
+    channel.expire(time.monotonic() + 5.0)
+    assert isinstance(first.exception(timeout=0), TimeoutError)
+    assert not second.done()
+    assert len(channel.pending) == 1
+
+
+def test_replies_fed_by_the_reader():
+    # pump=False: whoever reads the port (SerialPipeline, SensorHub) feeds the framer, wait_all only expires.
+    # A repeated acknowledgement nothing waits for any more is ignored.
+    devices = [_FakeDevice(), _FakeDevice()]
+    channels = [CommandChannel(device, XbusPacket(), pump=False) for device in devices]
+    futures = [channels[0].go_to_config(), channels[1].go_to_measurement()]
+    for channel, device in zip(channels, devices):
+        reply = device.read(device.in_waiting)
+        channel.framer.feed_bytes(reply + reply)
+    assert wait_all(futures) == [b'', b'']
@@ -0,0 +1,70 @@
+from struct import pack
+
+import pytest
+
+from DataPacketParser import DataPacketParser, PacketParser, XsDataPacket
+from LayoutParser import LayoutParser
+from Metrics import Metrics
+from PacketGenerator import build_frame
+from XbusPacket import XbusPacket
+
+
+def _counted(counters):
+    metrics = Metrics()
+    for counter in counters:
+        xbus_data = XsDataPacket()
+        xbus_data.packetCounter = counter
+        xbus_data.present |= XsDataPacket.PACKET_COUNTER
+        metrics.packet_parsed(xbus_data)
+    return metrics
+
+
+def test_packet_counter_gaps_across_wrap():
+    metrics = _counted([65533, 65534, 65535, 0, 1, 5, 6])
+    assert (metrics.packet_counter_gaps, metrics.packets_lost) == (1, 3)
+
+
+def test_duplicate_is_not_loss():
+    metrics = _counted([10, 11, 11, 12, 12, 12, 13])
+    assert metrics.packet_counter_duplicates == 3
+    assert (metrics.packet_counter_gaps, metrics.packets_lost) == (0, 0)
+
+
+def test_reordered_packet_is_not_loss():
+    # 12 arrives after 13, the stream goes on from 13
+    metrics = _counted([10, 11, 13, 12, 14, 15])
+    assert metrics.packets_reordered == 1
+    assert (metrics.packet_counter_gaps, metrics.packets_lost) == (1, 1)
+
+
+def test_reset_is_not_loss():
+    # The device restarts, or a capture is replayed from its start
+    metrics = _counted([5000, 5001, 5002, 0, 1, 2, 3])
+    assert metrics.packet_counter_resets == 1
+    assert (metrics.packet_counter_gaps, metrics.packets_lost) == (0, 0)
+
+
+def test_frames_count_mtdata2_only():
+    frame = build_frame(0x36, pack('>HBH', 0x1020, 2, 1))
+    ack = build_frame(0x31, b'')
+    error = build_frame(0x42, b'\x04')
+    framer = XbusPacket(on_data_available=lambda frame: None, on_message=lambda frame: None)
+    framer.metrics = Metrics()
+    framer.feed_bytes(frame + ack + frame + error + frame + b'\xfa')
+    assert (framer.metrics.frames, framer.metrics.messages) == (3, 2)
+
+
+@pytest.mark.parametrize('make_parser', [PacketParser, lambda: LayoutParser()], ids=['PacketParser', 'LayoutParser'])
+def test_problems_counted_per_parser(make_parser):
+    # Two devices, only the second one sends an unknown id and a short item
+    good = build_frame(0x36, pack('>HBH', 0x1020, 2, 1))
+    bad = build_frame(0x36, pack('>HBH', 0x7777, 2, 1) + pack('>HB', 0x2010, 4) + bytes(4))
+    parsers = [make_parser(), make_parser()]
+    for parser in parsers:
+        parser.metrics = Metrics()
+    for _ in range(3):
+        parsers[0].parse_data_packet(good, XsDataPacket())
+        parsers[1].parse_data_packet(bad, XsDataPacket())
+    assert (parsers[0].metrics.unknown_data_ids, parsers[0].metrics.parse_errors) == (0, 0)
+    assert (parsers[1].metrics.unknown_data_ids, parsers[1].metrics.parse_errors) == (3, 3)
+    assert DataPacketParser.metrics is None
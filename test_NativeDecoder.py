@@ -0,0 +1,169 @@
+import random
+import subprocess
+import sys
+from struct import pack
+
+import numpy as np
+import pytest
+
+import NativeDecoder
+from DataPacketParser import DataPacketParser
+from Metrics import Metrics
+from NativeDecoder import NATIVE_DATA_IDS, NativeFramer, RecordDecoder, make_framer, native_library
+from PacketGenerator import PacketGenerator
+from SetOutput import OUTPUT_CONFIGURATIONS
+from XbusPacket import XbusPacket
+
+needs_native = pytest.mark.skipif(native_library() is None,
+                                  reason="xbus_native.so isn't built, see `python NativeDecoder.py --build`")
+
+
+def _random_item(rnd, data_id):
+    if data_id == 0x1020:
+        return pack('>H', rnd.randrange(65536))
+    if data_id in (0x1060, 0xE020, 0x3010):
+        return pack('>I', rnd.randrange(1 << 32))
+    if data_id == 0x1010:
+        return pack('>IHBBBBBB', rnd.randrange(10 ** 9), rnd.randint(1970, 2100), rnd.randint(1, 12), rnd.randint(1, 31),
+                    rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 60), rnd.randrange(256))
+    if data_id in (0x2010, 0x8030):
+        values = [rnd.uniform(-1, 1) for _ in range(4)]
+        norm = sum(v * v for v in values) ** 0.5 * rnd.choice((1.0, 1.0, 1.0, 0.999, 1.001))
+        return pack('>4f', *[v / norm for v in values])
+    if data_id in (0x5042, 0x5022, 0xD012):
+        count = {0x5042: 2, 0x5022: 1, 0xD012: 3}[data_id]
+        return b''.join(pack('>ih', rnd.randrange(-1 << 31, 1 << 31), rnd.randrange(-1 << 15, 1 << 15)) for _ in range(count))
+    if data_id == 0x0810:
+        return pack('>f', rnd.uniform(-40, 85))
+    return pack('>3f', *[rnd.uniform(-1000, 1000) for _ in range(3)])
+
+
+def _random_stream(rnd, count):
+    # Frames with random items, orders and values, plus the cases the Python parser reports:
+    # unknown ids, short and truncated items, noise, corrupted frames and other messages
+    ids = sorted(NATIVE_DATA_IDS)
+    parts = []
+    for _ in range(count):
+        items = []
+        for data_id in rnd.sample(ids, rnd.randint(1, len(ids))):
+            data = _random_item(rnd, data_id)
+            problem = rnd.random()
+            if problem < 0.01:
+                data = data[:-1]
+            elif problem < 0.02:
+                data += b'\x00' * rnd.randint(1, 3)
+            items.append(pack('>HB', data_id, len(data)) + data)
+        if rnd.random() < 0.02:
+            items.append(pack('>HB', 0x7777, 2) + b'\x01\x02')
+        payload = b''.join(items)
+        if rnd.random() < 0.01:
+            payload += b'\x10'
+        if len(payload) > XbusPacket.MAX_PAYLOAD_LENGTH:
+            continue
+        body = bytes((0xFF, 0x36)) + (bytes((len(payload),)) if len(payload) < 0xFF
+                                      else bytes((0xFF, len(payload) >> 8, len(payload) & 0xFF))) + payload
+        frame = bytearray(b'\xfa' + body + bytes(((-sum(body)) & 0xFF,)))
+        if rnd.random() < 0.01:
+            frame[rnd.randrange(1, len(frame))] ^= 1 << rnd.randrange(8)
+        if rnd.random() < 0.02:
+            parts.append(bytes(rnd.randrange(256) for _ in range(rnd.randint(1, 20))))
+        if rnd.random() < 0.01:
+            parts.append(b'\xfa\xff\x31\x00\xd0')  # GoToConfigAck
+        if rnd.random() < 0.005:
+            parts.append(b'\xfa\xff\x36\xff\x09\x00')  # Extended length over MAX_PAYLOAD_LENGTH
+        parts.append(bytes(frame))
+    return b''.join(parts)
+
+
+def _streams(count=4000, seed=0):
+    rnd = random.Random(seed)
+    streams = {'random items': _random_stream(rnd, count)}
+    for name, conf in OUTPUT_CONFIGURATIONS.items():
+        streams[name] = PacketGenerator(conf, seed=seed).stream(count // 4, noise=0.01, corruption=0.01)
+    return streams
+
+
+STREAMS = _streams()
+
+
+def _pieces(data, seed):
+    rnd = random.Random(seed)
+    pos = 0
+    while pos < len(data):
+        size = rnd.choice((1, 7, 100, 300, 4096, 65536))
+        yield data[pos:pos + size]
+        pos += size
+
+
+def _decode_in_pieces(data, data_ids, native, seed):
+    messages = []
+    decoder = RecordDecoder(data_ids, native, capacity=64, on_message=lambda frame: messages.append(bytes(frame)))
+    records, offsets = [], []
+    for piece in _pieces(data, seed):
+        part_records, part_offsets = decoder.feed_bytes(piece)
+        records.append(part_records)
+        offsets.append(part_offsets)
+    return np.concatenate(records), np.concatenate(offsets), messages, decoder.checksum_failures
+
+
+@pytest.fixture
+def counted_problems():
+    # Unknown ids and problems are reported by the Python parser, counted instead of printed here
+    DataPacketParser.metrics = Metrics()
+    yield
+    DataPacketParser.metrics = None
+
+
+@needs_native
+@pytest.mark.parametrize('data_ids', [None, {0x1020, 0x2010}, {0x1010, 0x5042, 0xD012, 0x7777}],
+                         ids=['all', 'counter quat', 'time position unknown'])
+@pytest.mark.parametrize('name', list(STREAMS))
+def test_native_records_match_python(name, data_ids, counted_problems):
+    data = STREAMS[name]
+    python = _decode_in_pieces(data, data_ids, False, seed=len(data))
+    native = _decode_in_pieces(data, data_ids, True, seed=len(data))
+    assert len(python[0]) == len(native[0]) > 0
+    for field in python[0].dtype.names:
+        assert python[0][field].tobytes() == native[0][field].tobytes(), field
+    assert np.array_equal(python[1], native[1])
+    assert python[2] == native[2]
+    assert python[3] == native[3]
+
+
+def _frame(framer, data):
+    # Everything a framer hands out and counts for data fed in pieces
+    frames = []
+    framer.on_data_available = lambda frame: frames.append((framer.frame_offset, bytes(frame)))
+    framer.on_message = lambda frame: frames.append(('message', framer.frame_offset, bytes(frame)))
+    framer.set_mid_handler(0x31, lambda frame: frames.append(('ack', framer.frame_offset, bytes(frame))))
+    framer.metrics = Metrics()
+    for piece in _pieces(data, seed=len(data)):
+        framer.feed_bytes(piece)
+    counters = {name: getattr(framer.metrics, name) for name in Metrics.COUNTERS}
+    return frames, counters, list(framer.failed_frames), framer.stream_offset, bytes(framer.buffer)
+
+
+@needs_native
+@pytest.mark.parametrize('options', [{}, {'capacity': 4, 'min_size': 0}], ids=['default', 'small'])
+@pytest.mark.parametrize('name', ['random items', 'option1', 'option5'])
+def test_native_framer_matches_xbus_packet(name, options):
+    data = STREAMS[name]
+    python = _frame(XbusPacket(), data)
+    native = _frame(NativeFramer(**options), data)
+    assert len(python[0]) > 0
+    assert native == python
+
+
+def test_make_framer_falls_back(monkeypatch):
+    # A library that isn't there or can't be loaded is cached as False
+    monkeypatch.setattr('NativeFramer._native', False)
+    framer = make_framer()
+    assert type(framer) is XbusPacket
+    with pytest.raises(RuntimeError):
+        make_framer(native=True)
+
+
+def test_serial_reader_imports_without_numpy():
+    # The live path only needs the standard library (and pyserial) besides the native framer
+    code = "import sys; sys.modules['numpy'] = None; import NativeFramer, SerialPipeline, SensorHub; NativeFramer.make_framer()"
+    subprocess.run([sys.executable, '-c', code], check=True)
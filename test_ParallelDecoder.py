@@ -0,0 +1,75 @@
+from struct import pack
+
+import pytest
+
+import NativeDecoder
+from DataPacketParser import XsDataPacket
+from NativeDecoder import native_library
+from PacketGenerator import PacketGenerator, build_frame
+from ParallelDecoder import SYNC_BYTES, decode_capture
+from SetOutput import option5_ahrs_quat_400hz
+
+CHUNK = SYNC_BYTES
+# Frame with only an acc item, an empty MTData2 frame (FA FF 36 00 CB) is hidden in its data
+HIDDEN_FRAME = build_frame(0x36, pack('>HB', 0x4020, 12) + b'\x00\x00\x00' + b'\xfa\xff\x36\x00\xcb' + b'\x00' * 4)
+
+
+def _capture():
+    # Frames of option5 with something at every chunk boundary, returns the capture and the
+    # packetCounters of the frames a single framer decodes
+    frames = PacketGenerator(option5_ahrs_quat_400hz).frames(6000)
+    data = bytearray()
+    counters = []
+    i = 0
+
+    def fill_to(position):
+        # Whole frames up to position, zeros for the rest
+        nonlocal i
+        while len(data) + len(frames[i]) <= position:
+            data.extend(frames[i])
+            counters.append(i)
+            i += 1
+        data.extend(bytes(position - len(data)))
+
+    # A frame split by the first boundary
+    fill_to(CHUNK - 20)
+    data.extend(frames[i])
+    counters.append(i)
+    i += 1
+    # A corrupted frame across the second one
+    fill_to(2 * CHUNK - 30)
+    frame = bytearray(frames[i])
+    frame[40] ^= 0x01
+    data.extend(frame)
+    i += 1
+    # The third one falls in front of an empty MTData2 frame inside the acc item of another frame,
+    # the next worker decodes it before it finds the frames of the previous worker
+    fill_to(3 * CHUNK - 5)
+    data.extend(HIDDEN_FRAME)
+    counters.append(None)
+    # The same at the fourth one, with no frame within SYNC_BYTES after it, so the next chunk is
+    # decoded again from where the previous worker stopped
+    fill_to(4 * CHUNK - 5)
+    data.extend(HIDDEN_FRAME)
+    counters.append(None)
+    data.extend(bytes(SYNC_BYTES + 5000))
+    fill_to(7 * CHUNK + 1234)
+    return bytes(data), counters
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('native', [False, pytest.param(True, marks=pytest.mark.skipif(
+    native_library() is None, reason="xbus_native.so isn't built"))])
+def test_chunk_boundaries(tmp_path, monkeypatch, workers, native):
+    if not native:
+        monkeypatch.setattr('NativeFramer._native', False)
+    data, counters = _capture()
+    path = tmp_path / 'capture.xbus'
+    path.write_bytes(data)
+    serial = decode_capture(str(path), workers=1, chunk_bytes=len(data) + 1)
+    parallel = decode_capture(str(path), workers=workers, chunk_bytes=CHUNK)
+    assert len(serial) == len(counters)
+    # The frames without a packetCounter are the ones with the empty frame inside
+    assert [None if record['present'] & XsDataPacket.PACKET_COUNTER == 0 else int(record['packetCounter']) for record in serial] == counters
+    # Byte for byte, so NaNs of missing fields compare equal
+    assert parallel.tobytes() == serial.tobytes()
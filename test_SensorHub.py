@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+from struct import pack
+
+from CaptureFile import CaptureReader, CaptureWriter
+from PacketGenerator import build_frame
+from SensorHub import CaptureSource, SensorHub
+
+RATE = 100
+
+
+def _frame(i):
+    # packetCounter and sampleTimeFine (10 kHz ticks) of sample i at RATE Hz
+    return build_frame(0x36, pack('>HBH', 0x1020, 2, i & 0xFFFF) + pack('>HBI', 0x1060, 4, i * 10000 // RATE))
+
+
+def _capture(path, count, offset, drift, seed, burst=4):
+    # Frames are read burst at a time like from a USB serial port, all of them with the receive time of the
+    # last one: its device time + offset + drift * device time plus up to 2 ms of latency
+    rnd = random.Random(seed)
+    with CaptureWriter(str(path)) as writer:
+        for i in range(0, count, burst):
+            t = (i + burst - 1) / RATE
+            writer.write(b''.join(_frame(j) for j in range(i, i + burst)),
+                         host_time=t + offset + drift * t + rnd.uniform(0.0, 0.002))
+    return CaptureReader(str(path))
+
+
+def test_replay_in_time_order_with_drift(tmp_path):
+    count = 6000
+    readers = [_capture(tmp_path / 'a.xbus', count, 1000.0, 0.0, seed=1),
+               _capture(tmp_path / 'b.xbus', count, 1000.0042, 200e-6, seed=2)]
+    delivered = []
+    # A long max_wait, a reader thread that doesn't get the CPU for a while must not count as stalled here
+    hub = SensorHub([CaptureSource(reader) for reader in readers],
+                    lambda index, aligned_time, xbus_data: delivered.append((aligned_time, index, xbus_data.packetCounter)),
+                    max_wait=10.0, metrics=True)
+    hub.start()
+    hub.join()
+    for reader in readers:
+        reader.close()
+
+    assert len(delivered) == 2 * count
+    times = [aligned_time for aligned_time, _, _ in delivered]
+    assert times == sorted(times)
+    for index in (0, 1):
+        assert [counter for _, i, counter in delivered if i == index] == list(range(count))
+    stats = hub.stats()
+    assert abs(stats[0]['drift_ppm']) < 30
+    assert abs(stats[1]['drift_ppm'] - 200) < 30
+    assert [device['packets_lost'] for device in stats] == [0, 0]
+
+
+class _LiveSource:
+    # Sends frames until stalled is set, then nothing until the hub stops
+    def __init__(self, stalled=None):
+        self.stalled = stalled
+        self.i = 0
+
+    def read_bytes(self):
+        time.sleep(0.002)
+        if self.stalled is not None and self.stalled.is_set():
+            return b''
+        self.i += 1
+        return _frame(self.i - 1)
+
+
+def test_stalled_device_released_after_max_wait():
+    stalled = threading.Event()
+    delivered = []
+    hub = SensorHub([_LiveSource(), _LiveSource(stalled)],
+                    lambda index, aligned_time, xbus_data: delivered.append((time.monotonic(), index)), max_wait=0.2)
+    hub.start()
+    try:
+        deadline = time.monotonic() + 5.0
+        while not any(index == 1 for _, index in delivered) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stalled.set()
+        time.sleep(0.05)
+        stalled_at = time.monotonic()
+        # Device 0 is held back by device 1 at first, then released once device 1 is max_wait quiet
+        while not any(wall > stalled_at + 0.2 and index == 0 for wall, index in delivered) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        hub.stop()
+    assert any(index == 1 for _, index in delivered)
+    assert any(wall > stalled_at + 0.2 and index == 0 for wall, index in delivered)
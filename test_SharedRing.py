@@ -0,0 +1,58 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from DataPacketParser import XsDataPacket
+from SharedRing import RingPublisher, RingSubscriber
+
+
+RECORDS = 200000
+DATA_IDS = [0x1060, 0x5042, 0x5022, 0xD012]
+
+
+def _writer(name, ready, done):
+    # Every field of record n holds n, so a torn record has fields of two different records
+    with RingPublisher(name, capacity=4, data_ids=DATA_IDS) as ring:
+        data = XsDataPacket()
+        data.present = XsDataPacket.SAMPLE_TIME_FINE | XsDataPacket.LATLON | XsDataPacket.ALTITUDE | XsDataPacket.VELOCITY
+        ready.set()
+        for n in range(1, RECORDS + 1):
+            data.sampleTimeFine = n
+            data.latlon[:] = (n, n)
+            data.altitude = n
+            data.vel[:] = (n, n, n)
+            ring.write(data)
+        done.wait(60)
+
+
+def _torn(records):
+    seq = records['seq'].astype(np.float64)
+    intact = (records['sampleTimeFine'] == records['seq']) & (records['altitude'] == seq)
+    intact &= (records['latlon'] == seq[:, None]).all(axis=1) & (records['vel'] == seq[:, None]).all(axis=1)
+    return int((~intact).sum())
+
+
+def test_concurrent_writer_and_reader():
+    name = f'test_ring_{os.getpid()}'
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    done = context.Event()
+    writer = context.Process(target=_writer, args=(name, ready, done))
+    writer.start()
+    try:
+        assert ready.wait(30)
+        read = torn = 0
+        with RingSubscriber(name) as ring:
+            while ring.head() < RECORDS and writer.is_alive():
+                records = ring.read()
+                latest = ring.latest()
+                read += len(records)
+                torn += _torn(records)
+                if latest is not None:
+                    torn += _torn(latest[None])
+        assert read > 0
+        assert torn == 0
+    finally:
+        done.set()
+        writer.join(30)
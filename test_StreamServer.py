@@ -0,0 +1,106 @@
+import errno
+import time
+
+import numpy as np
+import pytest
+
+from DataPacketParser import DataPacketParser, XsDataPacket
+from PacketGenerator import PacketGenerator
+from SetOutput import option5_ahrs_quat_400hz
+from StreamServer import StreamClient, StreamServer
+
+
+class _FullSocket:
+    # UDP socket whose send buffer is always full
+    def __init__(self, error):
+        self.error = error
+        self.sent = 0
+
+    def sendto(self, message, target):
+        self.sent += 1
+        raise self.error
+
+    def close(self):
+        pass
+
+
+def test_raw_server_write_raises():
+    server = StreamServer(raw=True)
+    with pytest.raises(TypeError):
+        server.write(XsDataPacket())
+    server.close()
+
+
+@pytest.mark.parametrize('error', [BlockingIOError(errno.EAGAIN, 'full'), OSError(errno.ENOBUFS, 'no buffers')])
+def test_full_udp_socket_drops(error):
+    server = StreamServer(udp_targets=[('127.0.0.1', 9)], batch_size=1)
+    assert not server.udp.getblocking()
+    server.udp.close()
+    server.udp = _FullSocket(error)
+    for _ in range(3):
+        server.write(XsDataPacket())
+    assert server.udp.sent == 3
+    assert server.stats()['messages_dropped'] == 3
+    assert server.stats()['udp_errors'] == 0
+    server.close()
+
+
+def _receive(client, count):
+    # Samples of every message until count samples arrived or the client times out
+    received = []
+    while client.samples < count:
+        message = client.receive()
+        if message is None:
+            break
+        received.extend(message[3])
+    return received
+
+
+def _loopback(raw, count=500):
+    frames = PacketGenerator(option5_ahrs_quat_400hz).frames(count)
+    udp_client = None if raw else StreamClient(udp_port=0, host='127.0.0.1')
+    server = StreamServer(udp_targets=[] if raw else [('127.0.0.1', udp_client.port)],
+                          tcp_address=('127.0.0.1', 0), raw=raw)
+    server.start()
+    tcp_client = StreamClient(tcp_address=server.tcp_address)
+    try:
+        while not server.clients:
+            time.sleep(0.001)
+        packets = []
+        for frame in frames:
+            if raw:
+                server.write_frame(frame)
+            else:
+                xbus_data = XsDataPacket()
+                DataPacketParser.parse_data_packet(frame, xbus_data)
+                packets.append(xbus_data)
+                server.write(xbus_data)
+        server.flush()
+        clients = {'tcp': tcp_client} if raw else {'tcp': tcp_client, 'udp': udp_client}
+        received = {name: _receive(client, count) for name, client in clients.items()}
+        assert all(client.lost == 0 for client in clients.values())
+        assert server.stats()['messages_dropped'] == 0
+    finally:
+        server.close()
+        tcp_client.close()
+        if udp_client is not None:
+            udp_client.close()
+    return frames, packets, received
+
+
+def test_loopback_records():
+    frames, packets, received = _loopback(raw=False)
+    for samples in received.values():
+        records = np.array(samples)
+        assert records['seq'].tolist() == list(range(1, len(frames) + 1))
+        assert records['packetCounter'].tolist() == [packet.packetCounter for packet in packets]
+        assert np.array_equal(records['quat'], np.array([packet.quat for packet in packets], dtype=np.float32))
+        assert np.array_equal(records['acc'], np.array([packet.acc for packet in packets], dtype=np.float32))
+        has_mag = [packet.magAvailable for packet in packets]
+        assert np.array_equal(records['mag'][has_mag], np.array([packet.mag for packet in packets if packet.magAvailable], dtype=np.float32))
+        assert np.isnan(records['mag'][np.logical_not(has_mag)]).all()
+
+
+def test_loopback_raw_frames():
+    frames, _, received = _loopback(raw=True)
+    assert received['tcp'] == frames
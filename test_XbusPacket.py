@@ -0,0 +1,108 @@
+import pytest
+
+from NativeFramer import NativeFramer, native_library
+from PacketGenerator import PacketGenerator, build_frame
+from SetOutput import option5_ahrs_quat_400hz
+from XbusPacket import XbusPacket
+
+FRAMES = PacketGenerator(option5_ahrs_quat_400hz).frames(200)
+STREAM = b''.join(FRAMES)
+
+
+@pytest.fixture(params=['python', pytest.param('native', marks=pytest.mark.skipif(
+    native_library() is None, reason="xbus_native.so isn't built"))])
+def make_framer(request):
+    # The tests run against XbusPacket and the native framer (with every chunk framed natively)
+    if request.param == 'native':
+        return lambda: NativeFramer(min_size=0)
+    return XbusPacket
+
+
+def _frame(framer, data, chunk_size):
+    frames = []
+    framer.on_data_available = lambda frame: frames.append((framer.frame_offset, bytes(frame)))
+    for pos in range(0, len(data), chunk_size):
+        framer.feed_bytes(data[pos:pos + chunk_size])
+    return frames
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1000, len(STREAM)])
+def test_same_frames_for_any_chunk_size(make_framer, chunk_size):
+    offsets = [sum(len(frame) for frame in FRAMES[:i]) for i in range(len(FRAMES))]
+    assert _frame(make_framer(), STREAM, chunk_size) == list(zip(offsets, FRAMES))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 4096])
+def test_resync_after_corrupted_frame(make_framer, chunk_size):
+    corrupted = bytearray(FRAMES[1])
+    corrupted[20] ^= 0x10
+    framer = make_framer()
+    frames = _frame(framer, FRAMES[0] + bytes(corrupted) + FRAMES[2], chunk_size)
+    assert [frame for _, frame in frames] == [FRAMES[0], FRAMES[2]]
+    assert framer.checksum_failures == 1
+    assert framer.failed_frames[0] == (len(FRAMES[0]), bytes(corrupted))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 4096])
+def test_resync_after_false_preamble(make_framer, chunk_size):
+    # A preamble with a length that reaches into the next frames, and a real frame hidden in the
+    # payload of a frame whose own preamble was lost
+    false_header = b'\xfa\xff\x36\x20'
+    hidden = build_frame(0x36, b'\x40\x20\x0c' + b'\x01' * 3 + build_frame(0x36, b'') + b'\x00' * 4)
+    data = false_header + FRAMES[0] + hidden[1:] + FRAMES[1]
+    frames = _frame(make_framer(), data, chunk_size)
+    assert [frame for _, frame in frames] == [FRAMES[0], build_frame(0x36, b''), FRAMES[1]]
+    assert frames[0][0] == len(false_header)
+
+
+def test_last_byte_kept(make_framer):
+    framer = make_framer()
+    frames = _frame(framer, FRAMES[0] + b'\x00\x00\xfa', 4096)
+    assert frames == [(0, FRAMES[0])]
+    assert bytes(framer.buffer) == b'\xfa'
+    assert framer.stream_offset == len(FRAMES[0]) + 2
+    framer.feed_bytes(FRAMES[1][1:])
+    assert frames[1] == (len(FRAMES[0]) + 2, FRAMES[1])
+    assert bytes(framer.buffer) == b''
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_extended_length(make_framer, chunk_size):
+    long_frame = build_frame(0x36, b'\x40\x20\xfe' + bytes(range(254)) * 2 + b'\x40\x20\x0c' + bytes(12))
+    assert long_frame[3] == XbusPacket.EXTENDED_LENGTH
+    # A length over MAX_PAYLOAD_LENGTH isn't a frame, the preamble is skipped
+    too_long = b'\xfa\xff\x36\xff\x09\x00'
+    frames = _frame(make_framer(), FRAMES[0] + too_long + long_frame + FRAMES[1], chunk_size)
+    assert [frame for _, frame in frames] == [FRAMES[0], long_frame, FRAMES[1]]
+    assert XbusPacket.payload_bounds(long_frame) == (6, len(long_frame) - 1)
+
+
+def test_messages_routed_by_mid(make_framer):
+    ack = build_frame(0x31, b'')
+    error = build_frame(0x42, b'\x04')
+    received = []
+    framer = make_framer()
+    framer.on_data_available = lambda frame: received.append(('data', bytes(frame)))
+    framer.on_message = lambda frame: received.append(('message', bytes(frame)))
+    framer.set_mid_handler(0x31, lambda frame: received.append(('ack', bytes(frame))))
+    framer.feed_bytes(ack + FRAMES[0] + error)
+    framer.set_mid_handler(0x31, None)
+    framer.feed_bytes(ack + b'\x00')
+    assert received == [('ack', ack), ('data', FRAMES[0]), ('message', error), ('message', ack)]
+
+
+def test_raising_callback_gets_no_frame_twice(make_framer):
+    received = []
+
+    def on_frame(frame):
+        received.append(bytes(frame))
+        if len(received) == 2:
+            raise ValueError("sink failed")
+
+    framer = make_framer()
+    framer.on_data_available = on_frame
+    with pytest.raises(ValueError):
+        framer.feed_bytes(b''.join(FRAMES[:4]))
+    assert framer.stream_offset == len(FRAMES[0]) + len(FRAMES[1])
+    framer.feed_bytes(FRAMES[4])
+    assert received == FRAMES[:5]
@@ -0,0 +1,96 @@
+import os
+from types import SimpleNamespace
+
+import data_logging
+from DataPacketParser import DataPacketParser, XsDataPacket
+from PacketGenerator import PacketGenerator
+from SetOutput import option1_gnssins_quat_400hz
+from XbusPacket import XbusPacket
+from data_logging import CsvLogger, save_data_to_csv
+
+
+def _packets(count=1000):
+    packets = []
+
+    def on_frame(frame):
+        packets.append(XsDataPacket())
+        DataPacketParser.parse_data_packet(frame, packets[-1])
+
+    XbusPacket(on_data_available=on_frame).feed_bytes(PacketGenerator(option1_gnssins_quat_400hz).stream(count))
+    return packets
+
+
+PACKETS = _packets()
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_same_bytes_as_save_data_to_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for log_position_velocity in (True, False):
+        name = f'session_{log_position_velocity}.csv'
+        for packet in PACKETS:
+            save_data_to_csv(packet, 'reference_' + name, log_position_velocity)
+        with CsvLogger(name, log_position_velocity) as logger:
+            for packet in PACKETS:
+                logger.write(packet)
+        assert _read(os.path.join('data_logging', name)) == _read(os.path.join('data_logging', 'reference_' + name))
+
+
+def _rotated(folder):
+    # Rows of the files written after each other, every file has the header
+    names = sorted(os.listdir(folder))
+    contents = [_read(os.path.join(folder, name)) for name in names]
+    header = contents[0].split(b'\r\n', 1)[0] + b'\r\n'
+    assert all(content.startswith(header) for content in contents)
+    return names, contents, header + b''.join(content[len(header):] for content in contents)
+
+
+def test_rotation_by_size(tmp_path):
+    with CsvLogger('single.csv', folder_name=str(tmp_path / 'single')) as logger:
+        for packet in PACKETS:
+            logger.write(packet)
+    folder = str(tmp_path / 'rotated')
+    with CsvLogger('session.csv', folder_name=folder, flush_rows=10, max_bytes=20000) as logger:
+        for packet in PACKETS:
+            logger.write(packet)
+    names, contents, joined = _rotated(folder)
+    assert names[:3] == ['session.csv', 'session_001.csv', 'session_002.csv']
+    assert names == ['session.csv'] + [f'session_{i:03d}.csv' for i in range(1, len(names))]
+    # A file is closed at the first flush at or past max_bytes
+    row_bytes = max(len(line) for line in contents[0].split(b'\r\n'))
+    assert all(20000 <= len(content) < 20000 + 10 * (row_bytes + 2) for content in contents[:-1])
+    assert joined == _read(str(tmp_path / 'single' / 'single.csv'))
+
+
+def test_rotation_by_duration(tmp_path, monkeypatch):
+    # 400 packets per second, a new file at the first flush (every 100 rows) 2 seconds after opening
+    now = [1000.0]
+    monkeypatch.setattr(data_logging, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    folder = str(tmp_path / 'rotated')
+    with CsvLogger('session.csv', folder_name=folder, flush_rows=100, max_duration=2.0) as logger:
+        for packet in PACKETS:
+            logger.write(packet)
+            now[0] += 1 / 400.0
+    names, contents, _ = _rotated(folder)
+    assert names == ['session.csv', 'session_001.csv']
+    assert [content.count(b'\r\n') - 1 for content in contents] == [900, 100]
+
+
+def test_flush_interval(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(data_logging, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    path = str(tmp_path / 'session.csv')
+    logger = CsvLogger('session.csv', folder_name=str(tmp_path), flush_rows=1000, flush_interval=1.0)
+    logger.write(PACKETS[0])
+    # The header is written with the first rows
+    assert _read(path) == b''
+    now[0] += 1.0
+    logger.write(PACKETS[1])
+    assert _read(path).count(b'\r\n') == 3
+    logger.write(PACKETS[2])
+    logger.close()
+    assert _read(path).count(b'\r\n') == 4
@@ -0,0 +1,126 @@
+import csv
+import random
+
+import pytest
+
+from CaptureFile import CaptureWriter
+from PacketGenerator import PacketGenerator
+from SetOutput import option1_gnssins_quat_400hz
+from data_logging import csv_headers
+from log_analytics import analyze, csv_chunks, report
+
+COLUMNS = csv_headers(False)
+ACC = [COLUMNS.index(name) for name in ('AccelerationX', 'AccelerationY', 'AccelerationZ')]
+
+
+def _samples(count, dropped=(), duplicated=(), reset_at=None):
+    # Sample numbers of a 400 Hz log with the given samples dropped or written twice, and the
+    # counters starting again from 0 at reset_at. The packetCounter wraps at 65536 in the middle.
+    start = 60000
+    samples = []
+    for i in range(start, start + count):
+        if i - start in dropped:
+            continue
+        samples.append(i)
+        if i - start in duplicated:
+            samples.append(i)
+    if reset_at is not None:
+        samples = samples[:reset_at] + [i - samples[reset_at] for i in samples[reset_at:]]
+    return samples
+
+
+def _write_csv(path, samples, mode='w', seed=0):
+    rnd = random.Random(seed)
+    with open(path, mode, newline='') as f:
+        writer = csv.writer(f)
+        if mode == 'w':
+            writer.writerow(COLUMNS)
+        for i in samples:
+            row = [''] * len(COLUMNS)
+            row[:3] = [i & 0xFFFF, (i * 25) & 0xFFFFFFFF, repr(1.7e9 + i / 400.0)]
+            for column in ACC:
+                row[column] = repr(rnd.gauss(0.0, 1.0))
+            writer.writerow(row)
+
+
+def _same(a, b):
+    # Chunked and single pass reports agree, percentiles are approximate
+    for key in ('rows', 'gaps', 'lost', 'duplicates', 'resets'):
+        assert a[key] == b[key], key
+    for name in ['interval_ms'] + list(a['fields']):
+        values = a['interval_ms'] if name == 'interval_ms' else a['fields'][name]
+        expected = b['interval_ms'] if name == 'interval_ms' else b['fields'][name]
+        for key in ('count', 'min', 'max', 'mean', 'std'):
+            assert values[key] == pytest.approx(expected[key], rel=1e-9, abs=1e-12), (name, key)
+        for key in ('p1', 'p50', 'p99'):
+            assert values[key] == pytest.approx(expected[key], abs=0.05), (name, key)
+    assert a['drift_ppm'] == pytest.approx(b['drift_ppm'], abs=1e-6)
+
+
+def test_chunks_merge_like_one_chunk(tmp_path):
+    path = str(tmp_path / 'session.csv')
+    _write_csv(path, _samples(20000, dropped={100, 101, 7000}, duplicated={9000}))
+    single = report(analyze(path, workers=1, chunk_bytes=1 << 30, cache=False))
+    chunked = report(analyze(path, workers=2, chunk_bytes=50000, cache=False))
+    assert single['chunks'] == 1 and chunked['chunks'] > 20
+    _same(chunked, single)
+    assert chunked['interval_ms']['mean'] == pytest.approx(2.5)
+    assert chunked['fields']['AccelerationX']['std'] == pytest.approx(1.0, abs=0.05)
+    assert abs(chunked['drift_ppm']) < 0.01
+
+
+def test_gaps_duplicates_and_resets(tmp_path):
+    path = str(tmp_path / 'session.csv')
+    # 11 samples lost in 3 gaps, one of them across the packetCounter wrap (sample 5536)
+    dropped = {100, 101, 5535, 5536, 5537, 12000, 12001, 12002, 12003, 12004, 12005}
+    _write_csv(path, _samples(20000, dropped=dropped, duplicated={300, 301}, reset_at=15000))
+    for chunk_bytes in (1 << 30, 30000):
+        result = report(analyze(path, workers=1, chunk_bytes=chunk_bytes, cache=False))
+        assert (result['rows'], result['gaps'], result['lost']) == (20000 - 11 + 2, 3, 11)
+        assert (result['duplicates'], result['resets']) == (2, 1)
+        # Lost samples don't show up as jitter
+        assert result['interval_ms']['max'] == pytest.approx(2.5)
+
+
+def test_cache_reused_after_append(tmp_path):
+    path = str(tmp_path / 'session.csv')
+    samples = _samples(30000)
+    _write_csv(path, samples[:20000])
+    first = analyze(path, workers=1, chunk_bytes=50000)
+    assert first['cached_chunks'] == 0
+    _write_csv(path, samples[20000:], mode='a', seed=1)
+    # Only the previous last chunk (which now ends later) and the new ones are read
+    grown = analyze(path, workers=1, chunk_bytes=50000)
+    assert grown['cached_chunks'] == first['chunks'] - 1
+    _same(report(grown), report(analyze(path, workers=1, chunk_bytes=50000, cache=False)))
+    assert report(grown)['rows'] == 30000
+    assert analyze(path, workers=1, chunk_bytes=50000)['cached_chunks'] == grown['chunks']
+
+    # A digit changed near the end of the first chunk, the boundaries stay the same but its check doesn't match
+    end = csv_chunks(path, 50000)[1][0][1]
+    with open(path, 'r+b') as f:
+        f.seek(end - 200)
+        tail = f.read(200)
+        pos = end - 200 + next(i for i, byte in enumerate(tail) if byte in b'12345678')
+        f.seek(pos)
+        f.write(b'9')
+    changed = analyze(path, workers=1, chunk_bytes=50000)
+    assert changed['cached_chunks'] == changed['chunks'] - 1
+    _same(report(changed), report(analyze(path, workers=1, chunk_bytes=50000, cache=False)))
+
+
+def test_capture(tmp_path):
+    path = str(tmp_path / 'session.xbus')
+    frames = PacketGenerator(option1_gnssins_quat_400hz).frames(3000)
+    dropped = {10, 11, 2000}
+    with CaptureWriter(path) as writer:
+        for i, frame in enumerate(frames):
+            if i not in dropped:
+                writer.write(frame, host_time=i / 400.0)
+    single = report(analyze(path, workers=1, chunk_frames=10000, cache=False))
+    chunked = report(analyze(path, workers=1, chunk_frames=400, cache=False))
+    assert chunked['chunks'] == 8
+    _same(chunked, single)
+    assert (chunked['rows'], chunked['gaps'], chunked['lost']) == (3000 - 3, 2, 3)
+    assert chunked['interval_ms']['mean'] == pytest.approx(2.5)
+    assert abs(chunked['drift_ppm']) < 1.0
@@ -0,0 +1,396 @@
+/*
+ * Optional native framer and MTData2 decoder, loaded by NativeDecoder.py with ctypes.
+ * Build: cc -O2 -shared -fPIC -ffp-contract=off -o xbus_native.so xbus_native.c -lm
+ * (or python NativeDecoder.py --build)
+ *
+ * Frames a byte buffer exactly like XbusPacket.feed_bytes (xbus_frame, used by NativeDecoder.NativeFramer)
+ * and decodes MTData2 frames like DataPacketParser into records laid out by the caller
+ * (SharedRing.record_dtype, xbus_decode). Frames the Python parser would report a problem for are
+ * flagged and decoded in Python instead.
+ */
+#include <math.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+
+#define EXTENDED_LENGTH 0xFF
+#define MAX_PAYLOAD_LENGTH 2048
+#define MTDATA2 0x36
+
+/* XsDataPacket.present bits */
+#define EULER (1u << 0)
+#define QUATERNION (1u << 1)
+#define ACC (1u << 2)
+#define FREE_ACC (1u << 3)
+#define ROT (1u << 4)
+#define LATLON (1u << 5)
+#define ALTITUDE (1u << 6)
+#define VELOCITY (1u << 7)
+#define MAG (1u << 8)
+#define PACKET_COUNTER (1u << 9)
+#define SAMPLE_TIME_FINE (1u << 10)
+#define UTC_TIME (1u << 11)
+#define STATUS_WORD (1u << 12)
+#define TEMPERATURE (1u << 13)
+#define BAROPRESSURE (1u << 14)
+#define DELTA_V (1u << 15)
+#define DELTA_Q (1u << 16)
+
+/* Item modes, indexed by data id */
+#define SKIP 0
+#define DECODE 1
+#define IN_PYTHON 2
+
+/* Result codes */
+#define NEED_DATA 0
+#define MESSAGE 1
+#define FULL 2
+
+static const double rad2deg = 57.295779513082320876798154814105;
+static const double half_pi = 1.5707963267948966192313216916397514420985846996875529104874;
+
+static uint16_t be16(const uint8_t *p) { return (uint16_t)((p[0] << 8) | p[1]); }
+static uint32_t be32(const uint8_t *p) { return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | p[3]; }
+
+static double be_float(const uint8_t *p)
+{
+    uint32_t bits = be32(p);
+    float value;
+    memcpy(&value, &bits, 4);
+    return (double)value;
+}
+
+static double fp1632(const uint8_t *p)
+{
+    /* Signed 32-bit fraction followed by a signed 16-bit integer part, exact in a double */
+    int64_t value = ((int64_t)(int16_t)be16(p + 4) * 4294967296LL) + (int64_t)be32(p);
+    return (double)value / 4294967296.0;
+}
+
+static void put_u16(uint8_t *record, int32_t offset, uint16_t value) { if (offset >= 0) memcpy(record + offset, &value, 2); }
+static void put_u32(uint8_t *record, int32_t offset, uint32_t value) { if (offset >= 0) memcpy(record + offset, &value, 4); }
+static void put_f64(uint8_t *record, int32_t offset, double value) { if (offset >= 0) memcpy(record + offset, &value, 8); }
+
+static void put_f32(uint8_t *record, int32_t offset, const double *values, int count)
+{
+    if (offset < 0)
+        return;
+    for (int i = 0; i < count; i++) {
+        float value = (float)values[i];
+        memcpy(record + offset + 4 * i, &value, 4);
+    }
+}
+
+static void put_f64s(uint8_t *record, int32_t offset, const double *values, int count)
+{
+    if (offset >= 0)
+        memcpy(record + offset, values, 8 * count);
+}
+
+static int64_t days_from_civil(int64_t year, int64_t month, int64_t day)
+{
+    /* Days since 1970-01-01 of a proleptic Gregorian date */
+    year -= month <= 2;
+    int64_t era = (year >= 0 ? year : year - 399) / 400;
+    int64_t yoe = year - era * 400;
+    int64_t doy = (153 * (month + (month > 2 ? -3 : 9)) + 2) / 5 + day - 1;
+    int64_t doe = yoe * 365 + yoe / 4 - yoe / 100 + doy;
+    return era * 146097 + doe - 719468;
+}
+
+static double asin_clamped(double x)
+{
+    if (x <= -1.0)
+        return -half_pi;
+    if (x >= 1.0)
+        return half_pi;
+    return asin(x);
+}
+
+/*
+ * Decodes one MTData2 frame into record. field_offsets is indexed by data id: the byte offset of the
+ * item's column in the record, or -1. Returns 0, or 1 when the frame has to be decoded in Python.
+ */
+static int decode_frame(const uint8_t *frame, size_t pos, size_t data_end, uint8_t *record,
+                        const uint8_t *modes, const int32_t *field_offsets, int32_t euler_offset,
+                        int32_t present_offset)
+{
+    uint32_t present = 0;
+    int euler_pending = 0;
+    double quat[4] = {0.0, 0.0, 0.0, 0.0};
+    double values[4];
+
+    while (pos < data_end) {
+        if (pos + 3 > data_end)
+            return 1;
+        unsigned data_id = be16(frame + pos);
+        size_t data_len = frame[pos + 2];
+        pos += 3;
+        if (pos + data_len > data_end)
+            return 1;
+        const uint8_t *data = frame + pos;
+        int32_t offset = field_offsets[data_id];
+        pos += data_len;
+
+        if (modes[data_id] == SKIP)
+            continue;
+        if (modes[data_id] == IN_PYTHON)
+            return 1;
+
+        switch (data_id) {
+        case 0x1020:
+            if (data_len < 2) return 1;
+            put_u16(record, offset, be16(data));
+            present |= PACKET_COUNTER;
+            break;
+        case 0x1060:
+            if (data_len < 4) return 1;
+            put_u32(record, offset, be32(data));
+            present |= SAMPLE_TIME_FINE;
+            break;
+        case 0x1010: {
+            if (data_len < 11) return 1;
+            unsigned year = be16(data + 4), month = data[6];
+            /* calendar.timegm raises for these, left to Python */
+            if (year < 1 || year > 9999 || month < 1 || month > 12)
+                return 1;
+            int64_t days = days_from_civil(year, month, 1) + data[7] - 1;
+            int64_t seconds = ((days * 24 + data[8]) * 60 + data[9]) * 60 + data[10];
+            put_f64(record, offset, (double)seconds + be32(data) * 1e-9);
+            present |= UTC_TIME;
+            break;
+        }
+        case 0x2030:
+            if (data_len < 12) return 1;
+            for (int i = 0; i < 3; i++) values[i] = be_float(data + 4 * i);
+            put_f32(record, offset, values, 3);
+            euler_pending = 0;
+            present |= EULER;
+            break;
+        case 0x2010:
+            if (data_len < 16) return 1;
+            for (int i = 0; i < 4; i++) quat[i] = be_float(data + 4 * i);
+            put_f32(record, offset, quat, 4);
+            euler_pending = 1;
+            present |= QUATERNION | EULER;
+            break;
+        case 0x4020:
+        case 0x4030:
+        case 0x8020:
+        case 0xC020:
+        case 0x4010:
+            if (data_len < 12) return 1;
+            for (int i = 0; i < 3; i++) values[i] = be_float(data + 4 * i);
+            put_f32(record, offset, values, 3);
+            present |= data_id == 0x4020 ? ACC : data_id == 0x4030 ? FREE_ACC : data_id == 0x8020 ? ROT
+                     : data_id == 0xC020 ? MAG : DELTA_V;
+            break;
+        case 0x8030:
+            if (data_len < 16) return 1;
+            for (int i = 0; i < 4; i++) values[i] = be_float(data + 4 * i);
+            put_f32(record, offset, values, 4);
+            present |= DELTA_Q;
+            break;
+        case 0x5042:
+            if (data_len < 12) return 1;
+            values[0] = fp1632(data);
+            values[1] = fp1632(data + 6);
+            put_f64s(record, offset, values, 2);
+            present |= LATLON;
+            break;
+        case 0x5022:
+            if (data_len < 6) return 1;
+            put_f64(record, offset, fp1632(data));
+            present |= ALTITUDE;
+            break;
+        case 0xD012:
+            if (data_len < 18) return 1;
+            for (int i = 0; i < 3; i++) values[i] = fp1632(data + 6 * i);
+            put_f64s(record, offset, values, 3);
+            present |= VELOCITY;
+            break;
+        case 0xE020:
+            if (data_len < 4) return 1;
+            put_u32(record, offset, be32(data));
+            present |= STATUS_WORD;
+            break;
+        case 0x0810:
+            if (data_len < 4) return 1;
+            values[0] = be_float(data);
+            put_f32(record, offset, values, 1);
+            present |= TEMPERATURE;
+            break;
+        case 0x3010:
+            if (data_len < 4) return 1;
+            put_u32(record, offset, be32(data));
+            present |= BAROPRESSURE;
+            break;
+        default:
+            /* Decode mode for an id this file doesn't know */
+            return 1;
+        }
+    }
+
+    if (euler_pending) {
+        /* Same expressions as XsDataPacket.convert_quat_to_euler */
+        double sqw = quat[0] * quat[0];
+        double dphi = 2.0 * (sqw + quat[3] * quat[3]) - 1.0;
+        double dpsi = 2.0 * (sqw + quat[1] * quat[1]) - 1.0;
+        values[0] = atan2(2.0 * (quat[2] * quat[3] + quat[0] * quat[1]), dphi) * rad2deg;
+        values[1] = -asin_clamped(2.0 * (quat[1] * quat[3] - quat[0] * quat[2])) * rad2deg;
+        values[2] = atan2(2.0 * (quat[1] * quat[2] + quat[0] * quat[3]), dpsi) * rad2deg;
+        put_f32(record, euler_offset, values, 3);
+    }
+    put_u32(record, present_offset, present);
+    return 0;
+}
+
+/* find_frame results, also the event kinds of xbus_frame */
+#define FRAME 0
+#define BAD_CHECKSUM 1
+#define BAD_LENGTH 2
+#define INCOMPLETE 3
+
+/*
+ * Looks for the next frame in buffer[*pos_io:size] like XbusPacket.feed_bytes. Returns FRAME with the
+ * frame in buffer[*start:*end], BAD_CHECKSUM for a frame whose checksum fails, BAD_LENGTH for an
+ * extended length over MAX_PAYLOAD_LENGTH (both at *start, framing continues at *start + 1), or
+ * INCOMPLETE with *pos_io where framing continues when more data is there.
+ */
+static int find_frame(const uint8_t *buffer, size_t size, size_t *pos_io, size_t *start_out, size_t *end_out)
+{
+    size_t pos = *pos_io;
+    const uint8_t *found = NULL;
+    if (pos + 1 < size) {
+        const uint8_t *p = buffer + pos;
+        const uint8_t *last = buffer + size - 1;
+        while ((p = memchr(p, 0xFA, (size_t)(last - p))) != NULL) {
+            if (p[1] == 0xFF) {
+                found = p;
+                break;
+            }
+            p++;
+        }
+    }
+    if (found == NULL) {
+        /* Keep the last byte, it may be the preamble of the next frame */
+        if (size > 0 && pos < size - 1)
+            *pos_io = size - 1;
+        return INCOMPLETE;
+    }
+    size_t start = (size_t)(found - buffer);
+    *start_out = start;
+    if (start + 4 > size) {
+        *pos_io = start;
+        return INCOMPLETE;
+    }
+
+    size_t length = buffer[start + 3];
+    size_t end;
+    if (length != EXTENDED_LENGTH) {
+        end = start + 4 + length + 1;
+    } else {
+        if (start + 6 > size) {
+            *pos_io = start;
+            return INCOMPLETE;
+        }
+        length = ((size_t)buffer[start + 4] << 8) | buffer[start + 5];
+        if (length > MAX_PAYLOAD_LENGTH) {
+            *end_out = start + 1;
+            return BAD_LENGTH;
+        }
+        end = start + 6 + length + 1;
+    }
+    if (end > size) {
+        *pos_io = start;
+        return INCOMPLETE;
+    }
+    *end_out = end;
+
+    unsigned sum = 0;
+    for (size_t i = start + 1; i < end; i++)
+        sum += buffer[i];
+    return (sum & 0xFF) ? BAD_CHECKSUM : FRAME;
+}
+
+/*
+ * Frames buffer[*pos_io:size] without decoding anything: every frame (any message id), checksum failure
+ * and rejected extended length is an event of three values in events: its kind (FRAME, BAD_CHECKSUM,
+ * BAD_LENGTH), start and end. Stops after max_events or when more data is needed, *pos_io is where
+ * framing continues. Returns the number of events.
+ */
+long xbus_frame(const uint8_t *buffer, size_t size, size_t *pos_io, uint64_t *events, size_t max_events)
+{
+    size_t pos = *pos_io;
+    size_t count = 0;
+    size_t start, end;
+
+    while (count < max_events) {
+        int kind = find_frame(buffer, size, &pos, &start, &end);
+        if (kind == INCOMPLETE)
+            break;
+        events[3 * count] = (uint64_t)kind;
+        events[3 * count + 1] = start;
+        events[3 * count + 2] = end;
+        count++;
+        pos = kind == FRAME ? end : start + 1;
+    }
+
+    *pos_io = pos;
+    return (long)count;
+}
+
+/*
+ * Frames buffer[*pos:size] and decodes the MTData2 frames into records, each one starting as a copy
+ * of template_record. Stops when more data is needed (NEED_DATA, *pos is where framing continues with
+ * more data), at another message (MESSAGE, the frame is buffer[*pos:*message_end]) or when
+ * max_records are written (FULL). frame_starts gets the position of every record's frame, in_python
+ * whether it has to be decoded in Python. checksum_failures is incremented for every rejected frame.
+ * Returns the number of records written.
+ */
+long xbus_decode(const uint8_t *buffer, size_t size, size_t *pos_io, size_t *message_end, int *result,
+                 uint8_t *records, size_t record_size, size_t max_records, const uint8_t *template_record,
+                 const uint8_t *modes, const int32_t *field_offsets, int32_t euler_offset, int32_t present_offset,
+                 uint64_t *frame_starts, uint8_t *in_python, uint64_t *checksum_failures)
+{
+    size_t pos = *pos_io;
+    size_t count = 0;
+    size_t start, end;
+    *result = NEED_DATA;
+
+    for (;;) {
+        int kind = find_frame(buffer, size, &pos, &start, &end);
+        if (kind == INCOMPLETE)
+            break;
+        if (kind != FRAME) {
+            if (kind == BAD_CHECKSUM)
+                (*checksum_failures)++;
+            pos = start + 1;
+            continue;
+        }
+
+        if (buffer[start + 2] != MTDATA2) {
+            pos = start;
+            *message_end = end;
+            *result = MESSAGE;
+            break;
+        }
+        if (count == max_records) {
+            pos = start;
+            *result = FULL;
+            break;
+        }
+
+        size_t data_start = start + (buffer[start + 3] == EXTENDED_LENGTH ? 6 : 4);
+        uint8_t *record = records + count * record_size;
+        memcpy(record, template_record, record_size);
+        frame_starts[count] = start;
+        in_python[count] = (uint8_t)decode_frame(buffer, data_start, end - 1, record, modes, field_offsets,
+                                                 euler_offset, present_offset);
+        count++;
+        pos = end;
+    }
+
+    *pos_io = pos;
+    return (long)count;
+}